@@ -0,0 +1,135 @@
+import json
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# Requests carry their position as a label: Vertex echoes the request next to each prediction,
+# and label values only allow lowercase letters, digits, '-' and '_'
+INDEX_LABEL = "batch_index"
+
+# The engine runs with every harm filter off (horror/survival themes); batch requests match
+SAFETY_CATEGORIES = (
+    "HARM_CATEGORY_HATE_SPEECH",
+    "HARM_CATEGORY_DANGEROUS_CONTENT",
+    "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+    "HARM_CATEGORY_HARASSMENT",
+)
+
+class BatchJobState(NamedTuple):
+    ended: bool
+    succeeded: bool
+    output_location: Optional[str]
+    error: Optional[str] = None
+
+def request_line(
+    index: int,
+    system_prompt: str,
+    user_input: str,
+    temperature: float,
+    max_output_tokens: int,
+    response_schema: Optional[dict] = None
+) -> Dict[str, Any]:
+    """One line of a Gemini batch prediction input file."""
+    generation_config = {"temperature": temperature, "maxOutputTokens": max_output_tokens}
+    if response_schema:
+        generation_config["responseMimeType"] = "application/json"
+        generation_config["responseSchema"] = response_schema
+    return {"request": {
+        "contents": [{"role": "user", "parts": [{"text": user_input}]}],
+        "systemInstruction": {"parts": [{"text": system_prompt}]},
+        "generationConfig": generation_config,
+        "safetySettings": [{"category": category, "threshold": "BLOCK_NONE"} for category in SAFETY_CATEGORIES],
+        "labels": {INDEX_LABEL: f"r{index}"}
+    }}
+
+def parse_result_line(line: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+    """
+    Returns (index, {"system_prompt", "user_input", "text", "usage"}) for an answered request,
+    or None for a failed or blocked one (the caller makes those calls inline).
+    """
+    row = json.loads(line)
+    request, response = row.get("request") or {}, row.get("response") or {}
+    label = (request.get("labels") or {}).get(INDEX_LABEL, "")
+    candidates = response.get("candidates") or []
+    if row.get("status") or not label.startswith("r") or not candidates:
+        return None
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    text = "".join(part.get("text", "") for part in parts)
+    if not text:
+        return None
+    usage = response.get("usageMetadata") or {}
+    return int(label[1:]), {
+        "system_prompt": "".join(p.get("text", "") for p in (request.get("systemInstruction") or {}).get("parts", [])),
+        "user_input": "".join(p.get("text", "") for c in request.get("contents", []) for p in c.get("parts", [])),
+        "text": text,
+        # Same shape as LangChain's usage_metadata, which the AI logs already store
+        "usage": {
+            "input_tokens": usage.get("promptTokenCount", 0),
+            "output_tokens": usage.get("candidatesTokenCount", 0),
+            "total_tokens": usage.get("totalTokenCount", 0)
+        }
+    }
+
+def _split_gcs_uri(uri: str) -> Tuple[str, str]:
+    bucket, _, path = uri[len("gs://"):].partition("/")
+    return bucket, path
+
+class BatchClient:
+    """
+    Vertex batch prediction jobs staged through a GCS bucket. Blocking SDK calls:
+    AIEngine runs them on worker threads.
+    """
+    def __init__(self, project: str, location: str, bucket: str, prefix: str = "ai-batch"):
+        self.project = project
+        self.location = location
+        self.bucket = bucket
+        self.prefix = prefix
+        self._storage_client = None
+        self._vertex_ready = False
+
+    def _storage(self):
+        if self._storage_client is None:
+            from google.cloud import storage
+            self._storage_client = storage.Client(project=self.project)
+        return self._storage_client
+
+    def _jobs(self):
+        import vertexai
+        from vertexai.batch_prediction import BatchPredictionJob
+        if not self._vertex_ready:
+            vertexai.init(project=self.project, location=self.location)
+            self._vertex_ready = True
+        return BatchPredictionJob
+
+    def submit(self, model_name: str, job_id: str, lines: List[Dict[str, Any]]) -> str:
+        path = f"{self.prefix}/{job_id}/input.jsonl"
+        blob = self._storage().bucket(self.bucket).blob(path)
+        blob.upload_from_string("\n".join(json.dumps(line) for line in lines), content_type="application/jsonl")
+        job = self._jobs().submit(
+            source_model=model_name,
+            input_dataset=f"gs://{self.bucket}/{path}",
+            output_uri_prefix=f"gs://{self.bucket}/{self.prefix}/{job_id}/output"
+        )
+        logging.info(f"AI batch: submitted {job.resource_name} ({len(lines)} requests, {model_name})")
+        return job.resource_name
+
+    def status(self, job_name: str) -> BatchJobState:
+        job = self._jobs()(job_name)
+        error = getattr(job, "error", None)
+        return BatchJobState(job.has_ended, job.has_succeeded, job.output_location, str(error) if error else None)
+
+    def cancel(self, job_name: str):
+        self._jobs()(job_name).cancel()
+
+    def read_results(self, output_location: str) -> Dict[int, Dict[str, Any]]:
+        bucket, prefix = _split_gcs_uri(output_location)
+        results = {}
+        for blob in self._storage().list_blobs(bucket, prefix=prefix):
+            if not blob.name.endswith(".jsonl"):
+                continue
+            for line in blob.download_as_text().splitlines():
+                if not line.strip():
+                    continue
+                parsed = parse_result_line(line)
+                if parsed is not None:
+                    results[parsed[0]] = parsed[1]
+        return results
@@ -1,7 +1,15 @@
 import os
+import json
+import time
+import uuid
+import hashlib
 import logging
 import asyncio
+import datetime
 import warnings
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from google.api_core import exceptions as google_exceptions
 from langchain_core._api.deprecation import LangChainDeprecationWarning
 from .models import AILogEntry
 
@@ -10,15 +18,33 @@ from .models import AILogEntry
 # We are on Cloud Run (Vertex AI) using Service Account Auth, so we MUST use ChatVertexAI.
 warnings.filterwarnings("ignore", category=LangChainDeprecationWarning)
 
-from langchain_google_vertexai import ChatVertexAI, HarmBlockThreshold, HarmCategory
+from langchain_google_vertexai import ChatVertexAI, HarmBlockThreshold, HarmCategory, create_context_cache
 from langchain_core.messages import HumanMessage, SystemMessage
 from . import persistence
+from . import io_stats
+from . import config
+from . import ai_batch
 
-# --- SHARED AUTH STATE ---
-# We keep the model instance global so it reuses the underlying 
-# connection pool and cached OAuth tokens across parallel games.
-_SHARED_MODEL = None
-_MODEL_LOCK = asyncio.Lock()
+# --- STATIC PROMPT REGISTRY ---
+# Large shared system prompt prefixes (e.g. a cartridge's lore bible), keyed by content hash.
+# AI logs store the hash plus the dynamic suffix instead of repeating the prefix on every row.
+_STATIC_PROMPTS: Dict[str, str] = {}
+
+def prompt_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def register_static_prompt(text: str) -> str:
+    digest = prompt_hash(text)
+    _STATIC_PROMPTS.setdefault(digest, text)
+    return digest
+
+def split_static_prefix(system_prompt: str) -> Tuple[Optional[str], str]:
+    """Returns (hash, suffix) for the longest registered prefix, or (None, system_prompt)."""
+    best_hash, best_len = None, 0
+    for digest, text in _STATIC_PROMPTS.items():
+        if len(text) > best_len and system_prompt.startswith(text):
+            best_hash, best_len = digest, len(text)
+    return best_hash, system_prompt[best_len:]
 
 def _sanitize_schema(schema: dict) -> dict:
     """
@@ -59,6 +85,262 @@ def _sanitize_schema(schema: dict) -> dict:
 
     return sanitized
 
+class ModelPool:
+    """
+    Model clients keyed by (model name, generation config overrides), built on first use and
+    kept LRU up to max_size. Each client holds its own connection pool and cached OAuth token,
+    so games on different models reuse theirs instead of rebuilding a single shared one.
+    A warm lookup is a plain dict read; concurrent misses for one key share a single build.
+    """
+    def __init__(self, factory: Callable[[str, Dict[str, Any]], Any], max_size: int):
+        self.factory = factory
+        self.max_size = max_size
+        self._clients: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._building: Dict[Tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(model_name: str, overrides: Optional[Dict[str, Any]]) -> Tuple[str, str]:
+        # Canonical JSON: override values can be unhashable (a response schema, stop sequences)
+        return (model_name, json.dumps(overrides or {}, sort_keys=True, default=str))
+
+    async def get(self, model_name: str, overrides: Optional[Dict[str, Any]] = None):
+        key = self._key(model_name, overrides)
+        client = self._clients.get(key)
+        if client is not None:
+            self.hits += 1
+            self._clients.move_to_end(key)
+            return client
+
+        pending = self._building.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._building[key] = future
+        try:
+            logging.info(f"System: Initializing AI client ({model_name}, {overrides or 'defaults'})")
+            # Client construction resolves credentials, which can block
+            client = await asyncio.to_thread(self.factory, model_name, dict(overrides or {}))
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved: nobody may be waiting on it
+            raise
+        finally:
+            del self._building[key]
+
+        self._clients[key] = client
+        while len(self._clients) > self.max_size:
+            evicted, _ = self._clients.popitem(last=False)
+            self.evictions += 1
+            logging.info(f"System: Evicted AI client ({evicted[0]})")
+        future.set_result(client)
+        return client
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": [name for name, _ in self._clients],
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+class PromptCache:
+    """
+    Explicit Vertex cached-content resources holding registered static prompts, one per
+    (model, prompt hash) since a cache is bound to its model. A resource is rebuilt when less
+    than refresh_margin of its TTL remains, and a new template hash simply gets a new one (the
+    old resource expires on its own). Failed creations (unsupported model, prompt below the
+    minimum cacheable size) are not retried until retry_after has passed. Held by the
+    process-wide engine (ai_engine.ai): every game on an instance shares the billed resources.
+    """
+    def __init__(self, create: Callable[[Any, str, int], str], ttl_seconds: int, refresh_margin: float, retry_after: float, clock: Callable[[], float] = time.monotonic):
+        self.create = create
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        self.clock = clock
+        self._entries: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._failed: Dict[Tuple[str, str], float] = {}
+        self._building: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.created = 0
+        self.failures = 0
+
+    async def get(self, model_name: str, client, digest: str, text: str) -> Optional[str]:
+        """The cached-content name for the prompt, or None when the call must send it inline."""
+        key = (model_name, digest)
+        now = self.clock()
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] - now > self.refresh_margin:
+            return entry[0]
+        if self._failed.get(key, float("-inf")) > now:
+            return entry[0] if entry is not None and entry[1] > now else None
+
+        pending = self._building.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._building[key] = future
+        name = None
+        try:
+            name = await asyncio.to_thread(self.create, client, text, self.ttl_seconds)
+            # Other digests on the same model keep their resources; only expired entries are dropped
+            self._entries = {k: v for k, v in self._entries.items() if v[1] > now}
+            self._entries[key] = (name, self.clock() + self.ttl_seconds)
+            self.created += 1
+            logging.info(f"System: Cached static prompt {digest[:12]} for {model_name} as {name}")
+        except Exception as e:
+            self.failures += 1
+            self._failed[key] = self.clock() + self.retry_after
+            logging.warning(f"System: Context cache unavailable for {model_name} ({digest[:12]}), sending prompts inline: {e}")
+            # Keep using a resource that has not expired yet
+            name = entry[0] if entry is not None and entry[1] > now else None
+        finally:
+            del self._building[key]
+            future.set_result(name)
+        return name
+
+    def invalidate(self, model_name: str, digest: str):
+        self._entries.pop((model_name, digest), None)
+        self._failed[(model_name, digest)] = self.clock() + self.retry_after
+
+    def stats(self) -> Dict[str, Any]:
+        now = self.clock()
+        return {
+            "resources": {f"{model}:{digest[:12]}": round(expires - now) for (model, digest), (_, expires) in self._entries.items()},
+            "created": self.created,
+            "failures": self.failures
+        }
+
+def _create_prompt_cache(client, text: str, ttl_seconds: int) -> str:
+    return create_context_cache(client, [SystemMessage(content=text)], time_to_live=datetime.timedelta(seconds=ttl_seconds))
+
+def _is_throttled(error: Exception) -> bool:
+    """Quota rejections (HTTP 429 / RESOURCE_EXHAUSTED) that outlived the client's own retries."""
+    if isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+        return True
+    return getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429
+
+def _usage_tokens(result) -> int:
+    """Input plus output tokens a call reported (0 when the response carries no usage)."""
+    usage = (getattr(result, "response_metadata", None) or {}).get("usage_metadata") or {}
+    total = usage.get("total_token_count")
+    if total is None:
+        total = (usage.get("prompt_token_count") or usage.get("input_tokens") or 0) + \
+                (usage.get("candidates_token_count") or usage.get("output_tokens") or 0)
+    return int(total or 0)
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one model's calls, shared by every game on the instance.
+    Each successful call raises the limit by 1/limit (about +1 per window of calls); a
+    throttled call or one slower than latency_ceiling multiplies it by backoff, at most once
+    per cooldown so one burst of rejections counts once. Callers over the limit wait FIFO.
+    With a tokens_per_minute budget, the tokens each call reports are counted over a sliding
+    minute and new calls wait while the window is spent, since Vertex quotas tokens as well.
+    """
+    def __init__(self, initial: float, minimum: int, maximum: int, latency_ceiling: float, backoff: float, cooldown: float = 2.0,
+                 tokens_per_minute: int = 0, clock: Callable[[], float] = time.monotonic):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_ceiling = latency_ceiling
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self._last_decrease = float("-inf")
+        self.throttled = 0
+        self.decreases = 0
+        self.tokens_per_minute = tokens_per_minute
+        self.clock = clock
+        self._tokens: deque = deque()
+        self._tokens_in_window = 0
+        self.token_waits = 0
+
+    @property
+    def capacity(self) -> int:
+        return max(self.minimum, int(self.limit))
+
+    def _expire_tokens(self, now: float):
+        while self._tokens and now - self._tokens[0][0] >= 60:
+            self._tokens_in_window -= self._tokens.popleft()[1]
+
+    def token_wait(self) -> float:
+        """Seconds until the token window has room again (0 when it has room, or without a budget)."""
+        if not self.tokens_per_minute:
+            return 0.0
+        now = self.clock()
+        self._expire_tokens(now)
+        if self._tokens_in_window < self.tokens_per_minute:
+            return 0.0
+        return max(0.0, self._tokens[0][0] + 60 - now)
+
+    def record_tokens(self, tokens: int):
+        if self.tokens_per_minute and tokens > 0:
+            self._tokens.append((self.clock(), tokens))
+            self._tokens_in_window += tokens
+
+    async def acquire(self):
+        wait = self.token_wait()
+        if wait:
+            self.token_waits += 1
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self.token_wait()
+        if self.in_flight < self.capacity and not self._waiters:
+            self.in_flight += 1
+            return
+        slot = asyncio.get_running_loop().create_future()
+        self._waiters.append(slot)
+        try:
+            await slot
+        except asyncio.CancelledError:
+            if slot.done() and not slot.cancelled():
+                # Granted just as we were cancelled: hand the slot on
+                self.in_flight -= 1
+                self._wake()
+            else:
+                self._waiters.remove(slot)
+            raise
+
+    def release(self, latency: float, ok: bool = True, throttled: bool = False):
+        self.in_flight -= 1
+        if throttled:
+            self.throttled += 1
+        if throttled or latency > self.latency_ceiling:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                self.limit = max(float(self.minimum), self.limit * self.backoff)
+                self.decreases += 1
+                logging.warning(f"AI limiter: {'throttled' if throttled else f'{latency:.1f}s call'}, concurrency now {self.capacity}")
+        elif ok:
+            self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.capacity:
+            slot = self._waiters.popleft()
+            if not slot.done():
+                self.in_flight += 1
+                slot.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "throttled": self.throttled,
+            "decreases": self.decreases,
+            "tokens_last_minute": self._tokens_in_window,
+            "token_waits": self.token_waits
+        }
+
 class AIEngine:
     def __init__(self):
         # Default to sandbox ID but allow env override
@@ -80,15 +362,60 @@ class AIEngine:
             "max_output_tokens": 8192,
             "safety_settings": self.safety_settings,
         }
+        self.models = ModelPool(self._build_model, config.AI_MODEL_POOL_SIZE)
+        # Vertex quotas are per model, so each model gets its own limit
+        self.limiters: Dict[str, AdaptiveLimiter] = {}
+        self.prompt_cache = PromptCache(
+            _create_prompt_cache,
+            ttl_seconds=config.AI_CONTEXT_CACHE_TTL_SECONDS,
+            refresh_margin=config.AI_CONTEXT_CACHE_REFRESH_SECONDS,
+            retry_after=config.AI_CONTEXT_CACHE_RETRY_SECONDS
+        )
+        self.batch = ai_batch.BatchClient(self.project_id, self.location, config.AI_BATCH_BUCKET)
+
+    def register_static_prompts(self, prompts: List[str]):
+        for text in prompts or []:
+            register_static_prompt(text)
+
+    def _build_model(self, model_name: str, overrides: Dict[str, Any]):
+        return ChatVertexAI(model_name=model_name, **{**self.base_config, **overrides})
 
     async def _get_model(self, model_name: str):
-        """Ensures a single instance of the model is shared across the app."""
-        global _SHARED_MODEL
-        async with _MODEL_LOCK:
-            if _SHARED_MODEL is None or _SHARED_MODEL.model_name != model_name:
-                logging.info(f"System: Initializing Shared AI Session ({model_name})")
-                _SHARED_MODEL = ChatVertexAI(model_name=model_name, **self.base_config)
-            return _SHARED_MODEL
+        """One shared client per model (see ModelPool)."""
+        return await self.models.get(model_name)
+
+    def _limiter(self, model_name: str) -> AdaptiveLimiter:
+        limiter = self.limiters.get(model_name)
+        if limiter is None:
+            limiter = self.limiters[model_name] = AdaptiveLimiter(
+                initial=config.AI_CONCURRENCY_INITIAL,
+                minimum=config.AI_CONCURRENCY_MIN,
+                maximum=config.AI_CONCURRENCY_MAX,
+                latency_ceiling=config.AI_CONCURRENCY_LATENCY_SECONDS,
+                backoff=config.AI_CONCURRENCY_BACKOFF,
+                tokens_per_minute=config.AI_TOKENS_PER_MINUTE
+            )
+        return limiter
+
+    async def _invoke(self, model_name: str, invocation_model, messages, **kwargs):
+        """
+        Every model call goes through the model's limiter, which adapts to latency and 429s
+        and is fed the tokens the call used.
+        """
+        limiter = self._limiter(model_name)
+        await limiter.acquire()
+        started = time.monotonic()
+        ok, throttled = False, False
+        try:
+            result = await invocation_model.ainvoke(messages, **kwargs)
+            ok = True
+            limiter.record_tokens(_usage_tokens(result))
+            return result
+        except Exception as e:
+            throttled = _is_throttled(e)
+            raise
+        finally:
+            limiter.release(time.monotonic() - started, ok=ok, throttled=throttled)
 
     async def generate_response(
         self, 
@@ -105,7 +432,7 @@ class AIEngine:
                 HumanMessage(content=user_input)
             ]
             
-            # Reuse the shared model/connection pool for Auth caching
+            # Reuse the pooled client (connection pool and cached auth) for this model
             model = await self._get_model(model_version)
             
             # Restore your instrumentation logic
@@ -129,18 +456,28 @@ class AIEngine:
             else:
                 invocation_model = model
 
-            result = await invocation_model.ainvoke(messages)
+            static_hash, dynamic_suffix = split_static_prefix(system_prompt)
+            result = None
+            if static_hash and config.AI_CONTEXT_CACHE_ENABLED:
+                result = await self._invoke_with_cached_prefix(
+                    model_version, invocation_model, static_hash, dynamic_suffix, user_input
+                )
+            if result is None:
+                result = await self._invoke(model_version, invocation_model, messages)
             
             if target_id:
                 log_entry = AILogEntry(
                     game_id=target_id,
                     model=model.model_name,
-                    system_prompt=system_prompt,
+                    system_prompt=dynamic_suffix,
+                    prompt_hash=static_hash,
                     user_input=user_input,
                     raw_response=result.content,
-                    usage=result.response_metadata.get('usage_metadata', {})
+                    usage=result.response_metadata.get('usage_metadata', {}),
+                    scope=getattr(io_stats.current_scope(), "label", None)
                 )
-                asyncio.create_task(persistence.db.log_ai_interaction(log_entry))            
+                static_text = _STATIC_PROMPTS.get(static_hash) if static_hash else None
+                await persistence.db.enqueue_ai_log(log_entry, static_text)
 
             metadata = result.response_metadata
             finish_reason = metadata.get('finish_reason')
@@ -154,7 +491,7 @@ class AIEngine:
                 logging.error(f"[AI TRUNCATION] Stop Reason: {finish_reason} (Game: {target_id})")
 
             if target_id:
-                asyncio.create_task(self._track_usage(target_id, result.response_metadata))
+                self._track_usage(target_id, result.response_metadata)
             
             return result.content
             
@@ -162,7 +499,139 @@ class AIEngine:
             logging.error(f"AI Generation Error: {e}")
             return f"[SYSTEM ERROR]: {e}"
 
-    async def _track_usage(self, game_id: str, metadata: dict):
+    async def _invoke_with_cached_prefix(self, model_version: str, invocation_model, digest: str, dynamic_suffix: str, user_input: str):
+        """
+        Sends only the dynamic part of the prompt, referencing the static prefix held in an
+        explicit context cache. A cached call cannot carry its own system instruction, so the
+        suffix (e.g. the drone identity) leads the user turn. Returns None to send inline.
+        """
+        base_model = await self._get_model(model_version)
+        cache_name = await self.prompt_cache.get(model_version, base_model, digest, _STATIC_PROMPTS[digest])
+        if cache_name is None:
+            return None
+        suffix = dynamic_suffix.strip()
+        content = f"{suffix}\n\n{user_input}" if suffix else user_input
+        try:
+            return await self._invoke(model_version, invocation_model, [HumanMessage(content=content)], cached_content=cache_name)
+        except Exception as e:
+            if _is_throttled(e):
+                raise
+            # e.g. the resource was deleted or expired early: stop using it for a while
+            logging.warning(f"Cached prompt call failed for {model_version}, retrying inline: {e}")
+            self.prompt_cache.invalidate(model_version, digest)
+            return None
+
+    # --- BATCH PREDICTION ---
+    # Calls that do not need an answer within the task (dreams, dusk, epilogues) can be submitted
+    # as one Vertex batch job per model: batch pricing, and no online quota taken from live chat.
+    # The caller keeps the returned handle in its state and polls collect_batch from later tasks.
+
+    @property
+    def batch_enabled(self) -> bool:
+        return config.AI_BATCH_ENABLED and bool(config.AI_BATCH_BUCKET)
+
+    async def submit_batch(self, game_id: str, requests: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        requests: [{"key", "system_prompt", "user_input", "model_version", "response_schema"?}].
+        Returns a JSON-serializable handle, or None when the calls should be made inline.
+        """
+        if not self.batch_enabled or not requests:
+            return None
+        by_model: Dict[str, List[str]] = {}
+        lines: Dict[str, List[Dict[str, Any]]] = {}
+        for index, request in enumerate(requests):
+            model_name = request.get("model_version") or "gemini-2.5-flash"
+            schema = request.get("response_schema")
+            by_model.setdefault(model_name, []).append(str(index))
+            lines.setdefault(model_name, []).append(ai_batch.request_line(
+                index, request["system_prompt"], request["user_input"],
+                self.base_config["temperature"], self.base_config["max_output_tokens"],
+                _sanitize_schema(schema) if schema else None
+            ))
+
+        jobs = {}
+        try:
+            for model_name, model_lines in lines.items():
+                job_id = f"{game_id}-{uuid.uuid4().hex[:12]}".lower()
+                jobs[model_name] = await asyncio.to_thread(self.batch.submit, model_name, job_id, model_lines)
+        except Exception as e:
+            logging.warning(f"AI batch: submission failed for {game_id}, calling inline: {e}")
+            for job_name in jobs.values():
+                await self._cancel_batch_job(job_name)
+            return None
+        return {
+            "jobs": jobs,
+            "keys": [request["key"] for request in requests],
+            "submitted_at": time.time(),
+            "poll_seconds": config.AI_BATCH_POLL_SECONDS
+        }
+
+    async def collect_batch(self, game_id: str, handle: Dict[str, Any]) -> Optional[Dict[str, str]]:
+        """
+        None while any job is still running. Otherwise {key: response text} for every answered
+        request; failed jobs, jobs past AI_BATCH_TIMEOUT_SECONDS (cancelled) and blocked requests
+        leave their keys out, for the caller to make those calls inline.
+        """
+        timed_out = time.time() - handle.get("submitted_at", 0) > config.AI_BATCH_TIMEOUT_SECONDS
+        states = {}
+        for model_name, job_name in handle.get("jobs", {}).items():
+            try:
+                states[model_name] = await asyncio.to_thread(self.batch.status, job_name)
+            except Exception as e:
+                if not timed_out:
+                    logging.warning(f"AI batch: status check failed for {job_name}: {e}")
+                    return None
+                states[model_name] = ai_batch.BatchJobState(True, False, None, str(e))
+        if not timed_out and any(not state.ended for state in states.values()):
+            return None
+
+        keys = handle.get("keys", [])
+        results = {}
+        for model_name, state in states.items():
+            job_name = handle["jobs"][model_name]
+            if not state.ended:
+                logging.warning(f"AI batch: {job_name} timed out, calling inline")
+                await self._cancel_batch_job(job_name)
+                continue
+            if not state.succeeded or not state.output_location:
+                logging.warning(f"AI batch: {job_name} failed ({state.error}), calling inline")
+                continue
+            try:
+                rows = await asyncio.to_thread(self.batch.read_results, state.output_location)
+            except Exception as e:
+                logging.warning(f"AI batch: could not read {state.output_location}: {e}")
+                continue
+            for index, row in rows.items():
+                if index >= len(keys):
+                    continue
+                results[keys[index]] = row["text"]
+                await self._log_batch_result(game_id, model_name, row)
+        return results
+
+    async def _cancel_batch_job(self, job_name: str):
+        try:
+            await asyncio.to_thread(self.batch.cancel, job_name)
+        except Exception as e:
+            logging.warning(f"AI batch: could not cancel {job_name}: {e}")
+
+    async def _log_batch_result(self, game_id: str, model_name: str, row: Dict[str, Any]):
+        static_hash, dynamic_suffix = split_static_prefix(row["system_prompt"])
+        log_entry = AILogEntry(
+            game_id=game_id,
+            model=model_name,
+            system_prompt=dynamic_suffix,
+            prompt_hash=static_hash,
+            user_input=row["user_input"],
+            raw_response=row["text"],
+            usage=row["usage"],
+            scope=getattr(io_stats.current_scope(), "label", None)
+        )
+        static_text = _STATIC_PROMPTS.get(static_hash) if static_hash else None
+        await persistence.db.enqueue_ai_log(log_entry, static_text)
+        self._track_usage(game_id, {"usage_metadata": row["usage"]})
+
+    def _track_usage(self, game_id: str, metadata: dict):
+        """Coalesced in memory; the engine flushes one increment per task (and on its cron tick)."""
         try:
             usage = metadata.get('usage_metadata', {})
             in_tokens = usage.get('prompt_token_count', 0)
@@ -172,7 +641,7 @@ class AIEngine:
             if out_tokens == 0: out_tokens = usage.get('output_tokens', 0)
             
             if in_tokens + out_tokens > 0:
-                await persistence.db.increment_token_usage(game_id, in_tokens, out_tokens)
+                persistence.db.record_token_usage(game_id, in_tokens, out_tokens)
                 
         except Exception as e:
             logging.warning(f"Failed to track usage for {game_id}: {e}")
@@ -0,0 +1,48 @@
+import zlib
+from typing import Any, Tuple
+
+from .storage.base import decode_document, encode_document
+
+try:
+    import zstandard
+except ImportError:  # Optional: archives fall back to zlib
+    zstandard = None
+
+# Compact binary encoding for journal events and snapshots: tagged JSON, zlib compressed
+
+def pack(data: Any, level: int = 6) -> bytes:
+    return zlib.compress(encode_document(data).encode("utf-8"), level)
+
+def unpack(blob: bytes) -> Any:
+    return decode_document(zlib.decompress(blob).decode("utf-8"))
+
+# Blob encoding of the live state document's metadata (STATE_ENCODING=blob). The codec name is
+# stored next to the blob, so the format can change without rewriting existing games.
+
+STATE_CODEC = "json-zlib-1"
+
+def pack_state(data: Any) -> Tuple[str, bytes]:
+    # Written on every commit: a fast level, since the gain over 6 is small on this data
+    return STATE_CODEC, pack(data, level=1)
+
+def unpack_state(blob: bytes, codec_name: str) -> Any:
+    if codec_name != STATE_CODEC:
+        raise ValueError(f"Unknown state codec {codec_name!r}")
+    return unpack(blob)
+
+# Archives of ended games: zstd when available (better ratio on repetitive logs), zlib otherwise
+
+def pack_archive(data: Any) -> Tuple[str, bytes]:
+    raw = encode_document(data).encode("utf-8")
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(raw)
+    return "zlib", zlib.compress(raw, 9)
+
+def unpack_archive(blob: bytes, codec_name: str) -> Any:
+    if codec_name == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to open this archive")
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        raw = zlib.decompress(blob)
+    return decode_document(raw.decode("utf-8"))
@@ -23,9 +23,9 @@ async def _get_ui_presenter(ctx: Dict[str, Any], params: Dict[str, Any]):
         if channel_id:
             game_id = await persistence.db.get_game_id_by_channel_index(channel_id)
             if game_id:
-                game = await persistence.db.get_game_by_id(game_id)
-                if game:
-                    cartridge_id = game.story_id
+                header = await persistence.db.get_game_header(game_id)
+                if header:
+                    cartridge_id = header.story_id
     cartridge_id = cartridge_id or "foster-protocol"
     module_path, class_name = UI_MAP.get(cartridge_id, UI_MAP["foster-protocol"])
     module = importlib.import_module(module_path)
@@ -95,7 +95,7 @@ async def handle_kill(ctx: Dict[str, Any], params: Dict[str, Any]):
         await discord_client.client.edit_response(token, app_id, presentation.ERR_NO_GAME)
         return
 
-    game = await persistence.db.get_game_by_id(game_id)
+    game = await persistence.db.get_game_header(game_id)
     if not game:
         await discord_client.client.edit_response(token, app_id, presentation.ERR_NO_GAME)
         return
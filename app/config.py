@@ -18,4 +18,111 @@ if not PROJECT_ID:
     try:
         _, PROJECT_ID = google.auth.default()
     except:
-        PROJECT_ID = "sandbox-456821" # Fallback from your uploaded files
\ No newline at end of file
+        PROJECT_ID = "sandbox-456821" # Fallback from your uploaded files
+
+# --- PERSISTENCE CACHE CONFIG ---
+# Read-through cache for game documents. Full-game hits are only served while the coherence
+# listener keeps them current; header-only hits (routing, lobby views) are bounded by the TTL.
+GAME_CACHE_MAX_ENTRIES = int(os.environ.get("GAME_CACHE_MAX_ENTRIES", "256"))
+GAME_CACHE_TTL_SECONDS = float(os.environ.get("GAME_CACHE_TTL_SECONDS", "30"))
+
+# Channel -> game index. Negative entries (non-game channels) expire so the map stays bounded.
+# A negative cached for a new game channel is overwritten by the provisioning commit on its own
+# instance and by the coherence listener on the others, so the TTL can stay long.
+CHANNEL_INDEX_MAX_ENTRIES = int(os.environ.get("CHANNEL_INDEX_MAX_ENTRIES", "20000"))
+CHANNEL_INDEX_NEGATIVE_TTL_SECONDS = float(os.environ.get("CHANNEL_INDEX_NEGATIVE_TTL_SECONDS", "600"))
+
+# Cross-instance cache coherence via Firestore snapshot listeners (scoped to active games).
+# While the listener runs, cached games can live much longer than the plain TTL.
+CACHE_COHERENCE_ENABLED = os.environ.get("CACHE_COHERENCE_ENABLED", "false").lower() == "true"
+GAME_CACHE_COHERENT_TTL_SECONDS = float(os.environ.get("GAME_CACHE_COHERENT_TTL_SECONDS", "900"))
+
+# --- AI LOG WRITE-BEHIND ---
+AI_LOG_BUFFER_SIZE = int(os.environ.get("AI_LOG_BUFFER_SIZE", "1000"))
+AI_LOG_BATCH_SIZE = int(os.environ.get("AI_LOG_BATCH_SIZE", "200"))  # Firestore caps a batch at 500 writes
+AI_LOG_BATCH_BYTES = int(os.environ.get("AI_LOG_BATCH_BYTES", "4000000"))
+AI_LOG_FLUSH_INTERVAL_SECONDS = float(os.environ.get("AI_LOG_FLUSH_INTERVAL_SECONDS", "2"))
+# A failed batch commit is retried with exponential backoff (1s, 2s, ...) before it is dropped
+AI_LOG_RETRY_ATTEMPTS = int(os.environ.get("AI_LOG_RETRY_ATTEMPTS", "3"))
+AI_LOG_RETRY_BACKOFF_SECONDS = float(os.environ.get("AI_LOG_RETRY_BACKOFF_SECONDS", "1"))
+
+# --- AI MODEL POOL ---
+# Model clients kept per (model, generation config); the least recently used is dropped beyond this
+AI_MODEL_POOL_SIZE = int(os.environ.get("AI_MODEL_POOL_SIZE", "8"))
+
+# --- AI CONCURRENCY ---
+# Per-model AIMD limit on in-flight Vertex calls: +1 per window of successes, multiplied by the
+# backoff on a 429 or a call slower than the latency ceiling
+AI_CONCURRENCY_INITIAL = int(os.environ.get("AI_CONCURRENCY_INITIAL", "8"))
+AI_CONCURRENCY_MIN = int(os.environ.get("AI_CONCURRENCY_MIN", "1"))
+AI_CONCURRENCY_MAX = int(os.environ.get("AI_CONCURRENCY_MAX", "64"))
+AI_CONCURRENCY_LATENCY_SECONDS = float(os.environ.get("AI_CONCURRENCY_LATENCY_SECONDS", "45"))
+AI_CONCURRENCY_BACKOFF = float(os.environ.get("AI_CONCURRENCY_BACKOFF", "0.5"))
+# Per-model budget of reported input + output tokens over a sliding minute (0 disables it).
+# Set it just under the project's tokens-per-minute quota so calls queue instead of drawing 429s.
+AI_TOKENS_PER_MINUTE = int(os.environ.get("AI_TOKENS_PER_MINUTE", "0"))
+
+# --- AI CONTEXT CACHE ---
+# Registered static prompts (e.g. the Foster Protocol base prompt) are held in explicit Vertex
+# cached-content resources, rebuilt when less than the refresh margin of their TTL remains.
+# Off by default: resources are billed per hour and need a minimum prompt size.
+AI_CONTEXT_CACHE_ENABLED = os.environ.get("AI_CONTEXT_CACHE_ENABLED", "false").lower() == "true"
+AI_CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get("AI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+AI_CONTEXT_CACHE_REFRESH_SECONDS = float(os.environ.get("AI_CONTEXT_CACHE_REFRESH_SECONDS", "300"))
+AI_CONTEXT_CACHE_RETRY_SECONDS = float(os.environ.get("AI_CONTEXT_CACHE_RETRY_SECONDS", "900"))
+
+# --- AI BATCH PREDICTION ---
+# Dream, dusk and epilogue calls are submitted as Vertex batch jobs (staged in the bucket) and
+# polled by Cloud Tasks; jobs still running after the timeout are cancelled and called inline
+AI_BATCH_ENABLED = os.environ.get("AI_BATCH_ENABLED", "false").lower() == "true"
+AI_BATCH_BUCKET = os.environ.get("AI_BATCH_BUCKET", "")
+AI_BATCH_POLL_SECONDS = int(os.environ.get("AI_BATCH_POLL_SECONDS", "60"))
+AI_BATCH_TIMEOUT_SECONDS = int(os.environ.get("AI_BATCH_TIMEOUT_SECONDS", "3600"))
+
+# --- STORAGE BACKEND ---
+# firestore (default), sqlite (single file, WAL) or memory (process local, for tests and benchmarks)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "firestore").lower()
+FIRESTORE_DATABASE = os.environ.get("FIRESTORE_DATABASE", "sandbox")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "cscratch.sqlite3")
+
+# --- STATE ENCODING ---
+# map (default) stores the cartridge metadata as a Firestore map; blob stores it as one compressed
+# tagged-JSON field. Games are converted to the configured encoding on their next commit.
+STATE_ENCODING = os.environ.get("STATE_ENCODING", "map").lower()
+
+# --- GAME JOURNAL ---
+# Every metadata commit is appended to games/{id}/journal; a full snapshot is kept every N versions.
+# Off by default: it turns each chat field patch into a transaction plus a journal document.
+GAME_JOURNAL_ENABLED = os.environ.get("GAME_JOURNAL_ENABLED", "false").lower() == "true"
+GAME_SNAPSHOT_INTERVAL = int(os.environ.get("GAME_SNAPSHOT_INTERVAL", "50"))
+
+# --- ARCHIVAL ---
+# Ended games are compacted into one compressed archive after this delay (negative disables)
+GAME_ARCHIVE_DELAY_SECONDS = int(os.environ.get("GAME_ARCHIVE_DELAY_SECONDS", "3600"))
+
+# --- TASK REBASE ---
+# A task result that loses its OCC check to writes on the cartridge's REBASE_SAFE_PATHS is
+# merged onto the latest state and retried with exponential backoff
+TASK_REBASE_ATTEMPTS = int(os.environ.get("TASK_REBASE_ATTEMPTS", "3"))
+TASK_REBASE_BACKOFF_SECONDS = float(os.environ.get("TASK_REBASE_BACKOFF_SECONDS", "0.1"))
+
+# --- I/O ACCOUNTING ---
+# Requests and tasks that touch at least this many documents log their persistence I/O
+IO_LOG_SCOPE_MIN_DOCS = int(os.environ.get("IO_LOG_SCOPE_MIN_DOCS", "1"))
+
+# --- STATE SIZE GUARD ---
+# Firestore rejects documents over 1 MiB. Commits above the warning size are logged; cartridge
+# results above the offload size shed their oldest log stream lines to the target (archiving any
+# lines the stream does not hold yet first).
+STATE_SIZE_WARN_BYTES = int(os.environ.get("STATE_SIZE_WARN_BYTES", "700000"))
+STATE_SIZE_OFFLOAD_BYTES = int(os.environ.get("STATE_SIZE_OFFLOAD_BYTES", "900000"))
+STATE_SIZE_TARGET_BYTES = int(os.environ.get("STATE_SIZE_TARGET_BYTES", "600000"))
+
+# Page size when a cartridge reads a whole archived log stream (EngineContext.read_log_stream)
+LOG_STREAM_PAGE_SIZE = int(os.environ.get("LOG_STREAM_PAGE_SIZE", "500"))
+
+# --- ANALYTICS EXPORT ---
+# python -m app.export only exports AI logs older than this, so rows still in the write-behind
+# buffer are picked up by the next run instead of falling behind the watermark
+EXPORT_SETTLE_SECONDS = int(os.environ.get("EXPORT_SETTLE_SECONDS", "300"))
+EXPORT_BATCH_ROWS = int(os.environ.get("EXPORT_BATCH_ROWS", "5000"))
@@ -93,7 +93,8 @@ class DiscordRESTInterface:
             }
             
             interface = GameInterface(**interface_data)
-            await persistence.db.update_game_interface(game_id, interface)
+            # No channels yet: the provisioning commit only records the interface
+            await persistence.db.commit_channel_provisioning(game_id, interface, [])
             
             # NOTE: We specifically DO NOT register the origin (dispatch) channel into the persistence layer.
             # Interactions will rely on the embedded game_id in the button custom_ids.
@@ -252,6 +253,7 @@ class DiscordRESTInterface:
         game = await persistence.db.get_game_by_id(game_id)
         if not game or not game.interface.guild_id: return
 
+        created_ids = []
         try:
             guild = await self.client.fetch_guild(int(game.interface.guild_id))
             try:
@@ -268,7 +270,6 @@ class DiscordRESTInterface:
                     pass
 
             interface = game.interface
-            changes = False
             callsign = interface.callsign or "UNK"
 
             for op in ops:
@@ -322,8 +323,7 @@ class DiscordRESTInterface:
                     if str(new_chan.id) not in interface.listener_ids:
                         interface.listener_ids.append(str(new_chan.id))
                     
-                    await persistence.db.register_channel_association(str(new_chan.id), game_id)
-                    changes = True
+                    created_ids.append(str(new_chan.id))
                 
                 elif op['op'] == 'reveal':
                     key = op.get('key')
@@ -331,28 +331,36 @@ class DiscordRESTInterface:
                     if chan_id:
                         await self.unlock_channel(chan_id, game.interface.guild_id)
 
-            if changes: 
-                await persistence.db.update_game_interface(game_id, interface)
-                
         except Exception as e:
             logging.error(f"Channel Op Error: {e}")
+        finally:
+            # Channels that already exist must be routable even if a later op failed,
+            # so the associations and the interface go out in one batch regardless
+            if created_ids:
+                try:
+                    await persistence.db.commit_channel_provisioning(game_id, game.interface, created_ids)
+                except Exception:
+                    pass  # Logged by the persistence layer
 
     async def cleanup_game_channels(self, interface_data: dict):
         if not interface_data: return
         try:
             # We ONLY delete the generated game channels, NOT the main dispatch channel or category
             known_channels = list(interface_data.get('channels', {}).values())
+            deleted_ids = []
             
             for cid in known_channels:
                 if cid:
                     try:
                         c = await self._fetch_channel_safe(int(cid))
                         await c.delete()
-                        await persistence.db.remove_channel_association(cid)
+                        deleted_ids.append(cid)
                     except discord.NotFound:
                         pass
                     except Exception as e:
                         logging.warning(f"Failed to delete channel {cid}: {e}")
+
+            await persistence.db.remove_channel_associations(deleted_ids)
         except Exception as e:
             logging.error(f"Cleanup failed: {e}")
 
@@ -1,4 +1,4 @@
-from typing import Any, Dict, Callable, Awaitable
+from typing import Any, Dict, List, Callable, Awaitable, Optional
 
 class EngineContext:
     def __init__(
@@ -9,7 +9,8 @@ class EngineContext:
         _scheduler: Callable[[str, Any], None],
         _task_scheduler: Callable[[str, str, str, dict, int], None],
         _ender: Callable[[str], Awaitable[None]],
-        trigger_data: Dict[str, Any]
+        trigger_data: Dict[str, Any],
+        _log_reader: Optional[Callable[[str, str], Awaitable[List[Any]]]] = None
     ):
         self.game_id = game_id
         self.cartridge_id = cartridge_id
@@ -17,6 +18,7 @@ class EngineContext:
         self._scheduler = _scheduler
         self._task_scheduler = _task_scheduler
         self._ender = _ender
+        self._log_reader = _log_reader
         self.trigger_data = trigger_data
         
         # Buffers to prevent early external writes before DB commit
@@ -50,4 +52,13 @@ class EngineContext:
         """
         Buffers an event-driven task. Will be dispatched by the engine after state saves.
         """
-        self.pending_tasks.append((operation, data, delay))
\ No newline at end of file
+        self.pending_tasks.append((operation, data, delay))
+
+    async def read_log_stream(self, stream: str) -> List[Any]:
+        """
+        Reads every archived line of one of the cartridge's LOG_STREAMS, oldest first,
+        including the lines that no longer fit in the stream's document window.
+        """
+        if not self._log_reader:
+            return []
+        return await self._log_reader(self.game_id, stream)
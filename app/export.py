@@ -0,0 +1,200 @@
+"""
+Incremental analytics export of games and AI logs to partitioned Parquet files.
+
+    python -m app.export --out exports/
+
+Writes {out}/ai_logs/date=YYYY-MM-DD/part-{run}.parquet and {out}/games/date=.../part-{run}.parquet
+and records the exported window in {out}/_watermark.json, so the next run only reads newer logs and
+only the games that ended after the watermark or have not ended.
+A game row is written by every run in which it was created, started, ended or logged, so keep
+the row with the latest exported_at per game_id. Requires pyarrow, which is not part of the
+service image.
+"""
+import os
+import json
+import uuid
+import asyncio
+import logging
+import argparse
+import datetime
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import config
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Optional: only needed to run the export
+    pyarrow = None
+
+WATERMARK_FILE = "_watermark.json"
+
+# (column, arrow type) per table; rows are plain dicts so the export logic runs without pyarrow
+AI_LOG_COLUMNS: List[Tuple[str, str]] = [
+    ("game_id", "string"), ("log_id", "string"), ("timestamp", "timestamp"), ("model", "string"),
+    ("scope", "string"), ("prompt_hash", "string"), ("user_input", "string"), ("raw_response", "string"),
+    ("input_tokens", "int64"), ("output_tokens", "int64"), ("total_tokens", "int64"), ("cache_read_tokens", "int64")
+]
+GAME_COLUMNS: List[Tuple[str, str]] = [
+    ("game_id", "string"), ("story_id", "string"), ("host_id", "string"), ("status", "string"),
+    ("created_at", "timestamp"), ("started_at", "timestamp"), ("ended_at", "timestamp"),
+    ("player_count", "int64"), ("usage_input_tokens", "int64"), ("usage_output_tokens", "int64"),
+    ("archived", "bool_"), ("exported_at", "timestamp")
+]
+TABLES = {"ai_logs": AI_LOG_COLUMNS, "games": GAME_COLUMNS}
+
+def ai_log_row(game_id: str, log: dict) -> dict:
+    usage = log.get("usage") or {}
+    return {
+        "game_id": game_id,
+        "log_id": log.get("id"),
+        "timestamp": log.get("timestamp"),
+        "model": log.get("model"),
+        "scope": log.get("scope"),
+        "prompt_hash": log.get("prompt_hash"),
+        "user_input": log.get("user_input"),
+        "raw_response": log.get("raw_response"),
+        "input_tokens": usage.get("input_tokens"),
+        "output_tokens": usage.get("output_tokens"),
+        "total_tokens": usage.get("total_tokens"),
+        "cache_read_tokens": (usage.get("input_token_details") or {}).get("cache_read")
+    }
+
+def game_row(game: dict, exported_at: datetime.datetime) -> dict:
+    return {
+        "game_id": game.get("id"),
+        "story_id": game.get("story_id"),
+        "host_id": game.get("host_id"),
+        "status": game.get("status"),
+        "created_at": game.get("created_at"),
+        "started_at": game.get("started_at"),
+        "ended_at": game.get("ended_at"),
+        "player_count": len(game.get("players") or []),
+        "usage_input_tokens": game.get("usage_input_tokens", 0),
+        "usage_output_tokens": game.get("usage_output_tokens", 0),
+        "archived": bool((game.get("archive") or {}).get("purged")),
+        "exported_at": exported_at
+    }
+
+def _partition(value: Optional[datetime.datetime]) -> str:
+    return value.strftime("%Y-%m-%d") if isinstance(value, datetime.datetime) else "unknown"
+
+def _after(value, since: Optional[datetime.datetime]) -> bool:
+    return isinstance(value, datetime.datetime) and (since is None or value > since)
+
+async def export_analytics(layer, sink, since: Optional[datetime.datetime], until: datetime.datetime) -> Dict[str, int]:
+    """
+    Streams the AI logs with since < timestamp <= until, and the games they belong to or
+    that changed in the window, into `sink` (write(table, partition, row)). Returns row counts.
+    """
+    counts = Counter()
+    async for game in layer.stream_games(since=since):
+        game_id = game["id"]
+        logged = 0
+        # stream_games skips games that ended before the window: they cannot have logged in it
+        if (game.get("archive") or {}).get("purged"):
+            archived = await layer.open_archive(game_id) or {}
+            logs = [log for log in archived.get("ai_logs", []) if _after(log.get("timestamp"), since) and log["timestamp"] <= until]
+        else:
+            logs = [log async for log in layer.stream_ai_logs(game_id, after=since, until=until)]
+        for log in logs:
+            sink.write("ai_logs", _partition(log.get("timestamp")), ai_log_row(game_id, log))
+            logged += 1
+
+        changed = any(_after(game.get(field), since) and game[field] <= until for field in ("created_at", "started_at", "ended_at"))
+        if logged or changed:
+            sink.write("games", _partition(game.get("created_at")), game_row(game, until))
+            counts["games"] += 1
+        counts["ai_logs"] += logged
+    return dict(counts)
+
+class ParquetSink:
+    """
+    One Parquet writer per (table, partition), fed in row groups of batch_rows. Files are
+    written under a temporary name and only renamed by close(), so a failed run leaves
+    nothing for readers to pick up and the unchanged watermark makes the next run redo it.
+    """
+    def __init__(self, out_dir: str, run_id: str, batch_rows: int):
+        self.out_dir = out_dir
+        self.run_id = run_id
+        self.batch_rows = batch_rows
+        self.schemas = {table: pyarrow.schema([(name, self._arrow_type(kind)) for name, kind in columns]) for table, columns in TABLES.items()}
+        self._buffers: Dict[Tuple[str, str], List[dict]] = {}
+        self._writers: Dict[Tuple[str, str], Tuple[str, Any]] = {}
+
+    @staticmethod
+    def _arrow_type(kind: str):
+        if kind == "timestamp":
+            return pyarrow.timestamp("us", tz="UTC")
+        return getattr(pyarrow, kind)()
+
+    def write(self, table: str, partition: str, row: dict):
+        buffer = self._buffers.setdefault((table, partition), [])
+        buffer.append(row)
+        if len(buffer) >= self.batch_rows:
+            self._flush(table, partition)
+
+    def _flush(self, table: str, partition: str):
+        rows = self._buffers.pop((table, partition), [])
+        if not rows:
+            return
+        key = (table, partition)
+        if key not in self._writers:
+            directory = os.path.join(self.out_dir, table, f"date={partition}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{self.run_id}.parquet")
+            self._writers[key] = (path, pyarrow.parquet.ParquetWriter(path + ".tmp", self.schemas[table], compression="zstd"))
+        self._writers[key][1].write_table(pyarrow.Table.from_pylist(rows, schema=self.schemas[table]))
+
+    def close(self):
+        for table, partition in list(self._buffers):
+            self._flush(table, partition)
+        for path, writer in self._writers.values():
+            writer.close()
+            os.replace(path + ".tmp", path)
+
+def load_watermark(out_dir: str) -> Optional[datetime.datetime]:
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return datetime.datetime.fromisoformat(json.load(f)["until"])
+
+def save_watermark(out_dir: str, until: datetime.datetime, counts: Dict[str, int]):
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"until": until.isoformat(), "rows": counts}, f)
+    os.replace(path + ".tmp", path)
+
+async def run_export(out_dir: str, full: bool = False) -> Dict[str, int]:
+    from . import persistence
+
+    since = None if full else load_watermark(out_dir)
+    until = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=config.EXPORT_SETTLE_SECONDS)
+    if since is not None and since >= until:
+        logging.info(f"Export: nothing new since {since.isoformat()}")
+        return {}
+
+    run_id = f"{until.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    sink = ParquetSink(out_dir, run_id, config.EXPORT_BATCH_ROWS)
+    counts = await export_analytics(persistence.db, sink, since, until)
+    sink.close()
+    save_watermark(out_dir, until, counts)
+    logging.info(f"Export: {counts} rows up to {until.isoformat()} into {out_dir}")
+    return counts
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Export games and AI logs to partitioned Parquet files.")
+    parser.add_argument("--out", required=True, help="Output directory (holds the watermark between runs)")
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and export everything")
+    args = parser.parse_args(argv)
+    if pyarrow is None:
+        parser.error("pyarrow is required for the export (pip install pyarrow)")
+
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(args.out, exist_ok=True)
+    asyncio.run(run_export(args.out, full=args.full))
+
+if __name__ == "__main__":
+    main()
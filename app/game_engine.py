@@ -1,25 +1,40 @@
 import uuid
+import random
 import logging
 import asyncio
 import datetime
-from typing import Dict, Any, List, Optional
+from collections import Counter
+from typing import Dict, Any, List, Optional, Union
 
 from . import persistence
-from .models import GameState, LobbyPlayer, GameInterface
+from . import config
+from . import io_stats
+from .models import GameState, GameHeader, LobbyPlayer, GameInterface
 from .engine_context import EngineContext
-from .ai_engine import AIEngine
+from .state_diff import (
+    diff_metadata, rebase_metadata, split_log_streams, offload_log_streams, stream_lists,
+    apply_dotted_patch, get_path, path_within, touches_any
+)
+from .storage.base import estimate_size
+from . import ai_engine
 from .task_queue import dispatcher as task_dispatcher
 
+# Task operation handled by the engine itself rather than the cartridge
+ARCHIVE_OPERATION = "__archive__"
+
 CARTRIDGE_MAP = {
     "foster-protocol": "cartridges.foster_protocol.logic"
 }
 
 class GameEngine:
     def __init__(self):
-        self.ai = AIEngine()
+        # The process-wide engine: its model pool, limiters and context caches are shared with /ops/metrics
+        self.ai = ai_engine.ai
         self.interfaces = []
         self.running = False
         self.cron_task = None
+        # Outcomes of task results that lost their OCC check: rebased, conflict, exhausted
+        self.rebase_stats = Counter()
 
     async def start(self):
         if self.running: return
@@ -70,7 +85,8 @@ class GameEngine:
         Attempts to add a player to the game.
         Returns a dict containing status, player_count, max, cost, cartridge, and callsign.
         """
-        game = await persistence.db.get_game_by_id(game_id)
+        # Joins can land on any instance, so the player count must come from the stored document
+        game = await persistence.db.get_game_by_id(game_id, use_cache=False)
         if not game: 
             return {"status": "error"}
 
@@ -123,7 +139,7 @@ class GameEngine:
         task_dispatcher.enqueue_task(cartridge_id, game_id, operation, data, delay)
 
     async def launch_match(self, game_id: str) -> dict:
-        game = await persistence.db.get_game_by_id(game_id)
+        game = await persistence.db.get_game_by_id(game_id, use_cache=False)
         if not game: return {"error": "no_game"}
 
         # Safety check: If game is already active, ignore this request
@@ -167,14 +183,14 @@ class GameEngine:
             
             return {"error": "startup_failed", "detail": str(e)}
 
-    def _create_context(self, game: GameState, channel_id: str, user_id: str, user_name: str = "system") -> EngineContext:
-        """Helper to build a standardized EngineContext."""
+    def _create_context(self, game: Union[GameState, GameHeader], channel_id: str, user_id: str, user_name: str = "system") -> EngineContext:
+        """Helper to build a standardized EngineContext. Header contexts carry no metadata."""
         trigger_data = {
             "channel_id": str(channel_id),
             "user_id": str(user_id),
             "user_name": str(user_name),
             "interface": game.interface.model_dump(),
-            "metadata": game.metadata 
+            "metadata": getattr(game, "metadata", {})
         }
         return EngineContext(
             game_id=game.id,
@@ -183,11 +199,38 @@ class GameEngine:
             _scheduler=self._schedule_background_task,
             _task_scheduler=self._schedule_cloud_task,
             _ender=self.end_game,
-            trigger_data=trigger_data
+            trigger_data=trigger_data,
+            _log_reader=self._read_log_stream
         )
 
-    async def _process_cartridge_patch(self, game_id: str, patch: Optional[Dict[str, Any]], ctx: Optional[EngineContext] = None, expected_version: int = None):
-        """Helper to process standardized cartridge returns (channel_ops & state updates) and flush tasks."""
+    async def _read_log_stream(self, game_id: str, stream: str) -> List[Any]:
+        """Reads a whole archived log stream, oldest line first."""
+        lines, before_seq = [], None
+        while True:
+            page, before_seq = await persistence.db.get_log_stream(game_id, stream, limit=config.LOG_STREAM_PAGE_SIZE, before_seq=before_seq)
+            lines[:0] = [entry.get("line") for entry in page]
+            if before_seq is None:
+                return lines
+
+    async def _process_cartridge_patch(
+        self,
+        game_id: str,
+        patch: Optional[Dict[str, Any]],
+        ctx: Optional[EngineContext] = None,
+        expected_version: int = None,
+        base_metadata: Optional[Dict[str, Any]] = None,
+        log_streams: Optional[Dict[str, Optional[int]]] = None,
+        rebase_paths: Optional[List[str]] = None,
+        expected_chat_version: int = None
+    ):
+        """
+        Helper to process standardized cartridge returns (channel_ops & state updates) and flush tasks.
+        When the metadata the cartridge started from is known, only the changed paths are committed
+        and new lines in the cartridge's log streams are archived append-only.
+        Field patches confined to `rebase_paths` (chat) are versioned apart from task commits; a
+        versioned commit that loses to concurrent writes confined to them is merged over the
+        latest state instead of being dropped.
+        """
         success = True
 
         if patch:
@@ -196,15 +239,33 @@ class GameEngine:
                 channel_ops = patch.pop("channel_ops")
             
             # Check for metadata key or use root
+            is_full_state = "metadata" in patch
             state_update = patch.get("metadata", patch)
+            log_lines = []
+            if state_update and log_streams and base_metadata is not None:
+                state_update, log_lines = self._split_log_streams(base_metadata, state_update, is_full_state, log_streams)
+                if is_full_state:
+                    state_update = await self._guard_state_size(game_id, state_update, log_streams, log_lines)
+
             if state_update: 
                 # Strict OCC for Cloud Tasks to ensure double execution is dropped safely
-                if expected_version is not None and "metadata" in patch:
-                    success = await persistence.db.update_game_metadata(game_id, state_update, expected_version)
+                if expected_version is not None and is_full_state:
+                    if base_metadata is not None:
+                        diff = diff_metadata(base_metadata, state_update)
+                        success = await persistence.db.update_game_metadata_diff(
+                            game_id, diff, expected_version, log_lines,
+                            expected_chat_version=self._chat_guard(diff, rebase_paths, expected_chat_version)
+                        )
+                        if not success and rebase_paths:
+                            success = await self._rebase_task_result(game_id, base_metadata, state_update, log_lines, rebase_paths)
+                    else:
+                        success = await persistence.db.update_game_metadata(game_id, state_update, expected_version, expected_chat_version)
                     if not success:
                         logging.warning(f"Task Aborted (OCC): Game {game_id} version mismatch. Expected {expected_version}.")
                 else:
-                    await self._apply_state_patch(game_id, state_update)
+                    await self._apply_state_patch(game_id, state_update, rebase_paths)
+                    if log_lines:
+                        await persistence.db.append_log_lines(game_id, log_lines)
 
             # Abort external side-effects if the DB commit was rejected
             if not success:
@@ -233,6 +294,99 @@ class GameEngine:
             await self.end_game(game_id)
             ctx.game_ended = False
 
+    def _split_log_streams(self, base_metadata: dict, state_update: dict, is_full_state: bool, log_streams: dict):
+        """Extracts new log stream lines and trims the streams to their document windows."""
+        if is_full_state:
+            return split_log_streams(base_metadata, state_update, log_streams)
+
+        # Dot-notation field patch: evaluate the streams on the patched view, then read the patch back out
+        patched_view = apply_dotted_patch(base_metadata, state_update)
+        trimmed_view, log_lines = split_log_streams(base_metadata, patched_view, log_streams)
+        return {key: get_path(trimmed_view, key) for key in state_update}, log_lines
+
+    async def _rebase_task_result(
+        self,
+        game_id: str,
+        base_metadata: dict,
+        result: dict,
+        log_lines: list,
+        rebase_paths: List[str]
+    ) -> bool:
+        """
+        Three-way merges a task result (computed from `base_metadata`) onto the latest stored
+        metadata and retries the versioned commit with backoff. Any concurrent change outside
+        the cartridge's rebase-safe paths (e.g. a duplicate delivery of the same task) aborts.
+        """
+        for attempt in range(config.TASK_REBASE_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(config.TASK_REBASE_BACKOFF_SECONDS * (2 ** (attempt - 1)) * random.uniform(0.5, 1.0))
+
+            latest = await persistence.db.get_game_by_id(game_id, use_cache=False)
+            if not latest or latest.status != 'active':
+                return False
+
+            merged, conflicts = rebase_metadata(base_metadata, result, latest.metadata, rebase_paths)
+            if merged is None:
+                self.rebase_stats["conflict"] += 1
+                logging.warning(f"Task Rebase Conflict: Game {game_id} changed concurrently at {conflicts[:5]} ({len(conflicts)} paths).")
+                return False
+
+            diff = diff_metadata(latest.metadata, merged)
+            chat_guard = self._chat_guard(diff, rebase_paths, latest.chat_version)
+            if await persistence.db.update_game_metadata_diff(game_id, diff, latest.version, log_lines, expected_chat_version=chat_guard):
+                self.rebase_stats["rebased"] += 1
+                logging.info(f"Task Rebased: Game {game_id} merged onto version {latest.version} (attempt {attempt + 1}).")
+                return True
+
+        self.rebase_stats["exhausted"] += 1
+        logging.warning(f"Task Rebase Exhausted: Game {game_id} kept changing after {config.TASK_REBASE_ATTEMPTS} attempts.")
+        return False
+
+    async def _guard_state_size(self, game_id: str, metadata: dict, log_streams: dict, log_lines: list) -> dict:
+        """
+        Sheds the oldest log stream lines from a full-state result nearing the document limit.
+        Lines kept from before a stream was archived are archived first, so nothing is lost;
+        the rest are already in the stream or are this commit's `log_lines`.
+        """
+        size = estimate_size(metadata)
+        if size <= config.STATE_SIZE_OFFLOAD_BYTES:
+            return metadata
+        if persistence.db.state_encoding == "blob":
+            # The map estimate overstates a compressed document; only its stored size counts
+            size = persistence.db.encoded_state_size(metadata)
+            if size <= config.STATE_SIZE_OFFLOAD_BYTES:
+                return metadata
+        trimmed, dropped = offload_log_streams(metadata, log_streams, config.STATE_SIZE_TARGET_BYTES)
+
+        pending = {path: len(lines) for path, lines in log_lines}
+        kept = stream_lists(trimmed, log_streams)
+        shed = [
+            (path, lines[:max(0, len(lines) - pending.get(path, 0))])
+            for path, lines in stream_lists(metadata, log_streams).items()
+            if len(kept.get(path, [])) < len(lines)
+        ]
+        try:
+            await persistence.db.archive_legacy_lines(game_id, shed)
+        except Exception as e:
+            logging.error(f"State size: could not archive old log lines of game {game_id}, keeping them: {e}")
+            return metadata
+
+        io_stats.stats.record_offload(dropped)
+        logging.warning(f"State size: offloaded {dropped} old log lines from game {game_id} (~{size} -> ~{estimate_size(trimmed)} bytes)")
+        return trimmed
+
+    def _get_log_streams(self, cartridge) -> Dict[str, Optional[int]]:
+        return getattr(cartridge, "LOG_STREAMS", None) or {}
+
+    def _get_rebase_paths(self, cartridge) -> List[str]:
+        return list(getattr(cartridge, "REBASE_SAFE_PATHS", None) or [])
+
+    def _chat_guard(self, diff, rebase_paths: Optional[List[str]], chat_version: Optional[int]) -> Optional[int]:
+        """A task commit only has to match chat_version when it writes to the chat paths itself."""
+        if chat_version is not None and touches_any(diff.paths, rebase_paths or []):
+            return chat_version
+        return None
+
     async def trigger_post_start(self, game_id: str):
         """
         Lifecycle hook called by the Interface (Discord) AFTER channels are created.
@@ -249,25 +403,49 @@ class GameEngine:
             patch = await cartridge.post_game_start(game.metadata, ctx, Toolbox(self.ai))
 
             # 3. Save State Updates and Flush Tasks
-            await self._process_cartridge_patch(game.id, patch, ctx)
+            await self._process_cartridge_patch(
+                game.id, patch, ctx, base_metadata=game.metadata, log_streams=self._get_log_streams(cartridge)
+            )
 
     async def end_game(self, game_id: str):
         await persistence.db.mark_game_ended(game_id)
+        # The cost report reads the usage counters
+        await persistence.db.flush_token_usage(game_id)
         
-        game = await persistence.db.get_game_by_id(game_id)
-        if not game: return
+        header = await persistence.db.get_game_header(game_id)
+        if not header: return
         
         for interface in self.interfaces:
             if hasattr(interface, 'lock_channels'):
-                await interface.lock_channels(game_id, game.interface.model_dump())
+                await interface.lock_channels(game_id, header.interface.model_dump())
+
+        # Compact the game once players have had time to read the final channels and cost report
+        if config.GAME_ARCHIVE_DELAY_SECONDS >= 0:
+            self._schedule_cloud_task(game_id, header.story_id, ARCHIVE_OPERATION, None, config.GAME_ARCHIVE_DELAY_SECONDS)
 
     async def dispatch_input(self, channel_id: str, user_id: str, user_name: str, user_input: str, game_id: str):
-        game = await persistence.db.get_game_by_id(game_id)
+        # The mirrored phase gates screen_input and a state commit on another instance changes it
+        # without touching header_version, so the cached header only serves while it is kept coherent
+        header = await persistence.db.get_game_header(game_id, use_cache=persistence.db.coherence.running)
+        if not header or header.status != 'active':
+            return
+
+        cartridge = await self._load_cartridge(header.story_id)
+
+        # Optional cartridge hook that can answer input from the header alone (e.g. phase locks)
+        screen_input = getattr(cartridge, 'screen_input', None)
+        if screen_input:
+            ctx = self._create_context(header, channel_id, user_id, user_name)
+            if await screen_input(header.model_dump(), user_input, ctx):
+                await self._process_cartridge_patch(header.id, None, ctx)
+                return
+
+        # The header just read stands in for the header document, so only the state is fetched
+        game = await persistence.db.get_game_by_id(game_id, header=header)
         if not game or game.status != 'active':
             return
         
         ctx = self._create_context(game, channel_id, user_id, user_name)
-        cartridge = await self._load_cartridge(game.story_id)
         
         patch = await cartridge.handle_input(
             game.model_dump(), 
@@ -276,13 +454,22 @@ class GameEngine:
             Toolbox(self.ai)
         )
 
-        await self._process_cartridge_patch(game.id, patch, ctx)
+        await self._process_cartridge_patch(
+            game.id, patch, ctx, base_metadata=game.metadata, log_streams=self._get_log_streams(cartridge),
+            rebase_paths=self._get_rebase_paths(cartridge)
+        )
 
     async def dispatch_task(self, cartridge_id: str, game_id: str, payload: dict):
         """
         Routes an incoming task from Cloud Tasks to the appropriate cartridge.
         """
-        game = await persistence.db.get_game_by_id(game_id)
+        io_stats.label_scope(f"task {cartridge_id}:{payload.get('operation')}")
+        if payload.get("operation") == ARCHIVE_OPERATION:
+            await persistence.db.archive_game(game_id)
+            return
+
+        # Bypass the cache: the version read here is the OCC guard for the commit below
+        game = await persistence.db.get_game_by_id(game_id, use_cache=False)
         if not game or game.status != 'active':
             logging.warning(f"Task ignored: Game {game_id} is not active.")
             return
@@ -302,7 +489,17 @@ class GameEngine:
         )
 
         # Injects the expected version (OCC bounds) specifically for task updates
-        await self._process_cartridge_patch(game.id, patch, ctx, expected_version=game.version)
+        await self._process_cartridge_patch(
+            game.id, patch, ctx,
+            expected_version=game.version,
+            expected_chat_version=game.chat_version,
+            base_metadata=game.metadata,
+            log_streams=self._get_log_streams(cartridge),
+            rebase_paths=self._get_rebase_paths(cartridge)
+        )
+
+        # One usage increment per task instead of one per AI call, committed after the task's own write
+        await persistence.db.flush_token_usage(game.id)
 
     async def dispatch_immediate_result(self, game_id: str, result: dict):
         msgs = result.get('messages', [])
@@ -322,18 +519,22 @@ class GameEngine:
         except Exception as e:
             logging.error(f"Background Task Error (Game {game_id}): {e}")
 
-    async def _apply_state_patch(self, game_id: str, patch: Dict[str, Any]):
+    async def _apply_state_patch(self, game_id: str, patch: Dict[str, Any], chat_paths: Optional[List[str]] = None):
         try:
-            await persistence.db.update_game_metadata_fields(game_id, patch)
+            if chat_paths and all(any(path_within(key, pattern) for pattern in chat_paths) for key in patch):
+                # Chat-only writes leave the version in-flight tasks commit against untouched
+                await persistence.db.update_game_metadata_fields(game_id, patch, version_field="chat_version")
+            else:
+                await persistence.db.update_game_metadata_fields(game_id, patch)
         except Exception as e:
             logging.error(f"State Patch Failed: {e}")
             raise e
 
     async def _dispatch_message_to_interfaces(self, game_id: str, channel_key: str, text: str):
-        game = await persistence.db.get_game_by_id(game_id)
-        if not game: return
+        header = await persistence.db.get_game_header(game_id)
+        if not header: return
         
-        channel_id = game.interface.channels.get(channel_key)
+        channel_id = header.interface.channels.get(channel_key)
         if not channel_id:
              if channel_key.isdigit(): channel_id = channel_key
              else: return
@@ -346,12 +547,17 @@ class GameEngine:
         import importlib
         module_path = CARTRIDGE_MAP.get(story_id, CARTRIDGE_MAP["foster-protocol"])
         module = importlib.import_module(module_path)
-        return module.FosterProtocol()
+        cartridge = module.FosterProtocol()
+        # Shared prompt prefixes are logged by hash rather than repeated on every AI log row
+        self.ai.register_static_prompts(getattr(cartridge, "STATIC_PROMPTS", []))
+        return cartridge
 
     async def _cron_loop(self):
         try:
             while self.running:
                 await asyncio.sleep(60)
+                # Usage from chat and other non-task AI calls
+                await persistence.db.flush_token_usage()
         except asyncio.CancelledError:
             pass
 
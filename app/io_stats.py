@@ -0,0 +1,219 @@
+import time
+import bisect
+import logging
+import functools
+import inspect
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from . import config
+
+# Upper bounds (ms) of the latency buckets; the last bucket is unbounded
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Most recently committed games kept in the state size gauge
+STATE_SIZE_GAUGE_GAMES = 200
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th observation (the max for the open bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else round(self.max_ms, 1)
+        return round(self.max_ms, 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"le_{bound}" for bound in LATENCY_BUCKETS_MS] + ["le_inf"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 2),
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": dict(zip(labels, self.counts))
+        }
+
+class IOCounters:
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add(self, reads: int, writes: int, bytes_read: int, bytes_written: int):
+        self.reads += reads
+        self.writes += writes
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+
+    def merge(self, other: "IOCounters"):
+        self.add(other.reads, other.writes, other.bytes_read, other.bytes_written)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"reads": self.reads, "writes": self.writes, "bytes_read": self.bytes_read, "bytes_written": self.bytes_written}
+
+class IOScope:
+    """The persistence I/O of one ingress request or Cloud Task."""
+    def __init__(self, label: str):
+        self.label = label
+        self.started = time.perf_counter()
+        self.io = IOCounters()
+        self.calls = 0
+
+    @property
+    def documents(self) -> int:
+        return self.io.reads + self.io.writes
+
+class _MethodStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.io = IOCounters()
+        self.errors = 0
+
+class _ScopeStats:
+    def __init__(self):
+        self.duration = LatencyHistogram()
+        self.io = IOCounters()
+        self.calls = 0
+
+class IOStats:
+    """
+    Process-wide persistence accounting: latency and I/O per PersistenceLayer method,
+    totals per request/task label, and the estimated state document size of recently
+    committed games. Reset on instance restart, like the caches.
+    """
+    def __init__(self):
+        self.methods: Dict[str, _MethodStats] = {}
+        self.scopes: Dict[str, _ScopeStats] = {}
+        self.state_sizes: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+        self.offloaded_lines = 0
+
+    def record_state_size(self, game_id: str, size_bytes: int):
+        entry = self.state_sizes.pop(game_id, None) or {"bytes": 0, "peak_bytes": 0, "commits": 0}
+        entry["bytes"] = size_bytes
+        entry["peak_bytes"] = max(entry["peak_bytes"], size_bytes)
+        entry["commits"] += 1
+        self.state_sizes[game_id] = entry
+        while len(self.state_sizes) > STATE_SIZE_GAUGE_GAMES:
+            self.state_sizes.popitem(last=False)
+
+    def record_offload(self, lines: int):
+        self.offloaded_lines += lines
+
+    def record_call(self, method: str, elapsed_ms: float, failed: bool = False):
+        stats = self.methods.setdefault(method, _MethodStats())
+        stats.latency.observe(elapsed_ms)
+        if failed:
+            stats.errors += 1
+        scope = _current_scope.get()
+        if scope is not None:
+            scope.calls += 1
+
+    def record_io(self, reads: int, writes: int, bytes_read: int, bytes_written: int):
+        method = _current_method.get() or "other"
+        self.methods.setdefault(method, _MethodStats()).io.add(reads, writes, bytes_read, bytes_written)
+        scope = _current_scope.get()
+        if scope is not None:
+            scope.io.add(reads, writes, bytes_read, bytes_written)
+
+    def close_scope(self, scope: IOScope) -> float:
+        elapsed_ms = (time.perf_counter() - scope.started) * 1000
+        stats = self.scopes.setdefault(scope.label, _ScopeStats())
+        stats.duration.observe(elapsed_ms)
+        stats.io.merge(scope.io)
+        stats.calls += scope.calls
+        return elapsed_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "methods": {
+                name: {"latency": s.latency.snapshot(), "errors": s.errors, **s.io.snapshot()}
+                for name, s in sorted(self.methods.items())
+            },
+            "scopes": {
+                label: {"duration": s.duration.snapshot(), "calls": s.calls, **s.io.snapshot()}
+                for label, s in sorted(self.scopes.items())
+            },
+            "state_bytes": dict(sorted(self.state_sizes.items(), key=lambda item: -item[1]["bytes"])),
+            "offloaded_log_lines": self.offloaded_lines
+        }
+
+    def reset(self):
+        self.methods.clear()
+        self.scopes.clear()
+        self.state_sizes.clear()
+        self.offloaded_lines = 0
+
+stats = IOStats()
+
+_current_scope: contextvars.ContextVar[Optional[IOScope]] = contextvars.ContextVar("io_scope", default=None)
+_current_method: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("io_method", default=None)
+
+def current_scope() -> Optional[IOScope]:
+    return _current_scope.get()
+
+@contextmanager
+def scope(label: str):
+    """Aggregates the persistence I/O of the enclosed request or task, then logs and records it."""
+    io_scope = IOScope(label)
+    token = _current_scope.set(io_scope)
+    try:
+        yield io_scope
+    finally:
+        _current_scope.reset(token)
+        elapsed_ms = stats.close_scope(io_scope)
+        if io_scope.documents >= max(1, config.IO_LOG_SCOPE_MIN_DOCS):
+            logging.info(
+                f"IO: {io_scope.label} {io_scope.io.reads} reads ({io_scope.io.bytes_read} B), "
+                f"{io_scope.io.writes} writes ({io_scope.io.bytes_written} B), "
+                f"{io_scope.calls} calls in {elapsed_ms:.0f} ms"
+            )
+
+def label_scope(label: str):
+    """Names the current scope more precisely than its route (e.g. by task operation)."""
+    io_scope = _current_scope.get()
+    if io_scope is not None:
+        io_scope.label = label
+
+def _timed(name: str, fn):
+    @functools.wraps(fn)
+    async def _wrapper(*args, **kwargs):
+        token = _current_method.set(name)
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await fn(*args, **kwargs)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            stats.record_call(name, (time.perf_counter() - started) * 1000, failed)
+            _current_method.reset(token)
+    return _wrapper
+
+def instrumented(cls):
+    """Class decorator: times every public coroutine method and attributes its I/O to it."""
+    for name, member in list(vars(cls).items()):
+        if not name.startswith("_") and inspect.iscoroutinefunction(member):
+            setattr(cls, name, _timed(name, member))
+    return cls
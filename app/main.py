@@ -3,13 +3,15 @@ import logging
 from contextlib import asynccontextmanager
 
 
-from fastapi import FastAPI, Response, status
+from fastapi import FastAPI, Request, Response, status
 
 from .discord_client import client as discord_client
 from . import game_engine
+from . import persistence
 from .gcp_log import setup_logging
 from . import presentation
 from . import config
+from . import io_stats
 from .routers import dashboard
 from .routers import ingress
 from .routers import ops
@@ -21,6 +23,10 @@ setup_logging()
 async def lifespan(app: FastAPI):
     # Start REST Interface (No WebSocket)
     await discord_client.start(config.DISCORD_TOKEN)
+    # Preload channel routing so ingress ignores non-game chatter without a read
+    await persistence.db.warm_channel_index()
+    if config.CACHE_COHERENCE_ENABLED:
+        persistence.db.coherence.start()
     # Register the headless interface with the engine
     await game_engine.engine.register_interface(discord_client)
     # Start Engine Cron
@@ -32,6 +38,10 @@ async def lifespan(app: FastAPI):
     logging.info("System: Shutdown signal received.")
     
     game_engine.engine.stop()
+    persistence.db.coherence.stop()
+    await persistence.db.log_writer.drain()
+    await persistence.db.flush_token_usage()
+    persistence.db.db.close()
     await discord_client.close()
 
 app = FastAPI(lifespan=lifespan)
@@ -39,6 +49,16 @@ app.include_router(dashboard.router)
 app.include_router(ingress.router)
 app.include_router(ops.router)
 
+@app.middleware("http")
+async def io_accounting(request: Request, call_next):
+    # Persistence I/O is aggregated per request; labelled by route template to keep ids out of the metrics
+    with io_stats.scope(request.method) as scope:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if scope.label == request.method:
+            scope.label = f"{request.method} {getattr(route, 'path', 'unmatched')}"
+        return response
+
 @app.get("/ping")
 async def ping(response: Response):
     # Check if REST interface is authenticated
@@ -1,6 +1,6 @@
 from datetime import datetime, timezone
 from typing import List, Dict, Optional, Any, Literal
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, PrivateAttr
 
 # --- Discord Models ---
 class LobbyPlayer(BaseModel):
@@ -30,26 +30,73 @@ class GameState(BaseModel):
     metadata: Dict[str, Any] = {}
     players: List[LobbyPlayer] = []
     interface: GameInterface = Field(default_factory=GameInterface)
-    schema_version: int = 2
+    # 3: metadata lives in games/{id}/state/current, the game document only holds the header
+    schema_version: int = 3
     
     # Versioning for optimistic concurrency
-    version: int = Field(default=1, description="Sequence number for state updates")
+    version: int = Field(default=1, description="Sequence number for task/simulation metadata updates (the task OCC guard)")
+    chat_version: int = Field(default=1, description="Sequence number for chat-domain field writes (cartridge REBASE_SAFE_PATHS)")
+    seq: int = Field(default=1, description="Sequence number across all metadata commits (the journal key)")
+    header_version: int = Field(default=1, description="Sequence number for lobby/interface/status updates")
     
     # --- COST TRACKING ---
     usage_input_tokens: int = 0
     usage_output_tokens: int = 0
 
+    # Set once an ended game has been compacted into games/{id}/archive (codec, chunks, bytes, ...)
+    archive: Optional[Dict[str, Any]] = None
+
     # Pydantic V2 Config
     model_config = ConfigDict(populate_by_name=True)
 
+class GameHeader(BaseModel):
+    """
+    Lightweight projection of a game used for gating and routing.
+    Carries no cartridge metadata except the current phase.
+    """
+    id: str
+    story_id: str
+    host_id: str
+    status: str
+    header_version: int = 1
+    interface: GameInterface = Field(default_factory=GameInterface)
+    phase: Optional[str] = None
+
+    # The header document this view was projected from (None when built from a cached game),
+    # which lets a full load skip the second read of the header document
+    _document: Optional[Dict[str, Any]] = PrivateAttr(default=None)
+
+    @classmethod
+    def from_game(cls, game: GameState) -> "GameHeader":
+        return cls(
+            id=game.id,
+            story_id=game.story_id,
+            host_id=game.host_id,
+            status=game.status,
+            header_version=game.header_version,
+            interface=game.interface.model_copy(deep=True),
+            phase=(game.metadata or {}).get("phase")
+        )
+
 class AILogEntry(BaseModel):
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     game_id: str
     model: str
+    # When prompt_hash is set, system_prompt only holds the suffix after the stored static prefix
     system_prompt: str
+    prompt_hash: Optional[str] = None
     user_input: str
     raw_response: str
     usage: Dict[str, Any] = Field(default_factory=dict)
+    # The request/task that made the call (e.g. "task foster-protocol:tick_hour"), for analytics
+    scope: Optional[str] = None
+
+class LogLine(BaseModel):
+    """One line of an append-only metadata log stream (e.g. 'blackbox_logs')."""
+    stream: str
+    seq: int
+    line: Any
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class User(BaseModel):
     id: str
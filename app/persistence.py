@@ -1,137 +1,1471 @@
 import os
+import copy
+import time
 import logging
 import asyncio
+import datetime
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
 from google.cloud import firestore
-from .models import GameState, AILogEntry, LobbyPlayer, User
+from .models import GameState, GameHeader, AILogEntry, LobbyPlayer, LogLine, User
+from .state_diff import MetadataDiff, estimate_size_after
+from . import config
+from . import storage
+from . import codec
+from . import io_stats
+from .storage.base import estimate_size
 
+def _set_dotted(target: dict, path: str, value: Any):
+    """Applies a Firestore style dot-notation write to a plain dict."""
+    parts = path.split(".")
+    for part in parts[:-1]:
+        nxt = target.get(part)
+        if not isinstance(nxt, dict):
+            nxt = {}
+            target[part] = nxt
+        target = nxt
+    target[parts[-1]] = value
+
+# Fields read for gating/routing: every field of the header document except the inline metadata of
+# games not yet migrated ("metadata.phase" covers those), so a full load can reuse the projection
+HEADER_FIELDS = ["id", "story_id", "host_id", "status", "created_at", "started_at", "ended_at", "players",
+                 "interface", "schema_version", "header_version", "usage_input_tokens", "usage_output_tokens",
+                 "archive", "phase", "metadata.phase"]
+
+# The cold half of a game lives at games/{id}/state/current
+STATE_COLLECTION = "state"
+STATE_DOC_ID = "current"
+
+# Projections for the dashboard list views (the order field must be part of the projection)
+DASHBOARD_GAME_FIELDS = ["id", "status", "host_id", "created_at", "usage_input_tokens", "usage_output_tokens", "archive"]
+AI_LOG_SUMMARY_FIELDS = ["timestamp", "model", "user_input", "raw_response", "usage", "prompt_hash"]
+
+# Projections for the analytics export (app/export.py)
+EXPORT_GAME_FIELDS = ["id", "story_id", "host_id", "status", "created_at", "started_at", "ended_at",
+                      "players", "usage_input_tokens", "usage_output_tokens", "archive"]
+EXPORT_AI_LOG_FIELDS = AI_LOG_SUMMARY_FIELDS + ["scope"]
+
+# Firestore's document limit, and the allowance for the state document's fields besides metadata
+DOCUMENT_LIMIT_BYTES = 1_048_576
+STATE_DOC_OVERHEAD_BYTES = 128
+
+# Firestore caps a document at 1 MiB, so archive blobs are split across chunk documents
+ARCHIVE_CHUNK_BYTES = 900_000
+ARCHIVE_CHUNKS_PER_BATCH = 8
+DELETE_BATCH_SIZE = 400
+
+# Counters on the state document. version guards task commits, chat_version counts field writes
+# confined to the cartridge's REBASE_SAFE_PATHS, and seq orders every commit (the journal key).
+STATE_VERSION_FIELDS = ("version", "chat_version", "seq")
+STATE_BUMP = ("version", "seq")
+
+def _state_versions(state: dict) -> Dict[str, int]:
+    """Reads the state counters; documents from before the chat domain bumped version on every commit."""
+    version = state.get("version", 1)
+    return {"version": version, "chat_version": state.get("chat_version", 1), "seq": max(state.get("seq", version), version)}
+
+# With STATE_ENCODING=blob the metadata is stored as one compressed field instead of a map
+STATE_BLOB_FIELDS = ("metadata_blob", "metadata_codec")
+
+def _state_metadata(state: dict) -> dict:
+    """Decodes the metadata of a state document in either encoding."""
+    if "metadata_blob" in state:
+        return codec.unpack_state(state["metadata_blob"], state.get("metadata_codec"))
+    return state.get("metadata") or {}
+
+# Metadata keys copied onto the header document so gating reads never touch the state document
+MIRRORED_METADATA_FIELDS = ("phase",)
+
+def _mirrored_fields(updates: Dict[str, Any]) -> Dict[str, Any]:
+    """Picks the mirrored values out of dot-notation metadata writes ('' replaces the whole map)."""
+    mirrored = {}
+    for path, value in updates.items():
+        for field in MIRRORED_METADATA_FIELDS:
+            if path == field:
+                mirrored[field] = value
+            elif path == "" and isinstance(value, dict):
+                mirrored[field] = value.get(field)
+    return mirrored
+
+class GameStateCache:
+    """
+    Bounded LRU/TTL cache of GameState documents keyed by game id.
+    A snapshot never replaces a cached entry with a newer version, so a slow
+    read cannot clobber the value written through by our own updates. The header
+    (header_version) and the state (seq) are compared independently.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, GameState]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def _live_entry(self, game_id: str) -> Optional[GameState]:
+        entry = self._entries.get(game_id)
+        if entry is None:
+            return None
+        stored_at, game = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[game_id]
+            return None
+        return game
+
+    def get(self, game_id: str, copy: bool = True) -> Optional[GameState]:
+        game = self._live_entry(game_id)
+        if game is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(game_id)
+        # Callers mutate the returned model (e.g. interface.channels), so hand out a copy
+        # unless they promise to only read it
+        return game.model_copy(deep=True) if copy else game
+
+    def put(self, game: GameState):
+        incoming = game.model_copy(deep=True)
+        current = self._live_entry(game.id)
+        if current is not None:
+            # Keep whichever half we already hold at a newer version
+            merged = current if current.header_version > incoming.header_version else incoming
+            state = current if (current.seq, current.version) > (incoming.seq, incoming.version) else incoming
+            if merged is not state:
+                merged = merged.model_copy(update={
+                    "metadata": state.metadata,
+                    **{field: getattr(state, field) for field in STATE_VERSION_FIELDS}
+                })
+            incoming = merged
+        self._store(incoming)
+
+    def _store(self, game: GameState):
+        self._entries[game.id] = (time.monotonic(), game)
+        self._entries.move_to_end(game.id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def refresh(self, game_id: str, mutate: Callable[[GameState], None], bump: Union[str, Tuple[str, ...], None] = STATE_BUMP):
+        """
+        Applies one of our own writes to the cached copy (if any) so readers see it immediately.
+        `bump` names the counter(s) the write incremented (STATE_BUMP, "header_version" or None).
+        """
+        game = self._live_entry(game_id)
+        if game is None:
+            return
+        try:
+            mutate(game)
+            for field in ((bump,) if isinstance(bump, str) else bump or ()):
+                setattr(game, field, getattr(game, field) + 1)
+            self._store(game)
+        except Exception as e:
+            logging.warning(f"Game cache refresh failed for {game_id}, dropping entry: {e}")
+            self.invalidate(game_id)
+
+    def invalidate(self, game_id: str):
+        self._entries.pop(game_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale": self.stale,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+class ChannelIndexCache:
+    """
+    In-memory channel_id -> game_id map with positive and negative entries.
+    Channel ids are never reused, so positive entries live until evicted; negative
+    entries expire so a lookup miss is eventually retried against the index.
+    """
+    def __init__(self, max_entries: int, negative_ttl_seconds: float):
+        self.max_entries = max_entries
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[Optional[float], Optional[str]]]" = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def lookup(self, channel_id: str) -> Tuple[bool, Optional[str]]:
+        """Returns (found, game_id). found=True with game_id=None is a cached negative."""
+        entry = self._entries.get(channel_id)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        expires_at, game_id = entry
+        if expires_at is not None and time.monotonic() > expires_at:
+            del self._entries[channel_id]
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(channel_id)
+        if game_id is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return True, game_id
+
+    def store(self, channel_id: str, game_id: Optional[str]):
+        expires_at = None if game_id else time.monotonic() + self.negative_ttl_seconds
+        self._entries[channel_id] = (expires_at, game_id)
+        self._entries.move_to_end(channel_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def store_read(self, channel_id: str, game_id: Optional[str]):
+        """
+        Stores the result of an index read. A read that found nothing never replaces a
+        positive entry: provisioning may have committed the association while it was in flight.
+        """
+        entry = self._entries.get(channel_id)
+        if game_id is None and entry is not None and entry[1] is not None:
+            return
+        self.store(channel_id, game_id)
+
+    def invalidate(self, channel_id: str):
+        self._entries.pop(channel_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses
+        }
+
+class CacheCoherence:
+    """
+    Pushes changes made by other instances into the local caches.
+    Listens to the active games' header documents and, through a collection group
+    query, their state documents; the channel index is fed from each header's
+    interface. Watch callbacks fire on a background thread, so updates are
+    marshalled back onto the event loop before touching the caches.
+    """
+    def __init__(self, layer: "PersistenceLayer"):
+        self.layer = layer
+        self._client = None
+        self._watch = None
+        self._state_watch = None
+        self._loop = None
+        self._base_ttl = None
+
+    @property
+    def running(self) -> bool:
+        return self._watch is not None
+
+    def start(self):
+        if self.running:
+            return
+        if not getattr(self.layer.db, "supports_listeners", False):
+            logging.info("System: Storage backend has no snapshot listeners, cache coherence disabled")
+            return
+        try:
+            self._loop = asyncio.get_running_loop()
+            # Snapshot listeners are only available on the synchronous client
+            self._client = firestore.Client(database=config.FIRESTORE_DATABASE)
+            active = firestore.FieldFilter("status", "==", "active")
+            self._watch = self._client.collection('games').where(filter=active).on_snapshot(self._on_snapshot)
+            # Requires a collection group index exemption on state.status
+            state_query = self._client.collection_group(STATE_COLLECTION).where(filter=active)
+            self._state_watch = state_query.on_snapshot(self._on_state_snapshot)
+            self._base_ttl = self.layer.game_cache.ttl_seconds
+            self.layer.game_cache.ttl_seconds = config.GAME_CACHE_COHERENT_TTL_SECONDS
+            logging.info("System: Cache coherence listener started")
+        except Exception as e:
+            if self._watch is not None:
+                self._watch.unsubscribe()
+            self._watch = None
+            self._state_watch = None
+            logging.error(f"Failed to start cache coherence listener: {e}")
+
+    def stop(self):
+        if not self.running:
+            return
+        for watch in (self._watch, self._state_watch):
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                logging.warning(f"Failed to stop cache coherence listener: {e}")
+        self._watch = None
+        self._state_watch = None
+        self.layer.game_cache.ttl_seconds = self._base_ttl
+
+    def _on_snapshot(self, docs, changes, read_time):
+        updates = []
+        for change in changes:
+            if change.type.name == "REMOVED":
+                updates.append((change.document.id, None))
+            else:
+                updates.append((change.document.id, change.document.to_dict()))
+        if updates and self._loop:
+            self._loop.call_soon_threadsafe(self.apply_game_changes, updates)
+
+    def _on_state_snapshot(self, docs, changes, read_time):
+        updates = [
+            (change.document.reference.parent.parent.id, change.document.to_dict())
+            for change in changes if change.type.name != "REMOVED"
+        ]
+        if updates and self._loop:
+            self._loop.call_soon_threadsafe(self.apply_state_changes, updates)
+
+    def apply_game_changes(self, updates):
+        """
+        Applies (game_id, header_data) pairs; data=None means the game left the active scope.
+        A header alone cannot build an entry, so only games already cached are updated.
+        """
+        for game_id, data in updates:
+            if data is None:
+                self.layer.game_cache.invalidate(game_id)
+                continue
+            cached = self.layer.game_cache.get(game_id, copy=False)
+            try:
+                if "metadata" not in data and cached is not None:
+                    data = {**data, "metadata": cached.metadata, **{field: getattr(cached, field) for field in STATE_VERSION_FIELDS}}
+                game = GameState(**data)
+            except Exception as e:
+                logging.warning(f"Coherence: dropping unparsable snapshot for {game_id}: {e}")
+                self.layer.game_cache.invalidate(game_id)
+                continue
+            if cached is not None or "metadata" in data:
+                self.layer.game_cache.put(game)
+            for channel_id in game.interface.listener_ids:
+                self.layer.channel_index.store(str(channel_id), game.id)
+
+    def apply_state_changes(self, updates):
+        """Applies (game_id, state_data) pairs from the state documents to cached games."""
+        for game_id, data in updates:
+            cached = self.layer.game_cache.get(game_id, copy=False)
+            if cached is None or data is None:
+                continue
+            try:
+                metadata = _state_metadata(data)
+            except Exception as e:
+                logging.warning(f"Coherence: dropping undecodable state snapshot for {game_id}: {e}")
+                self.layer.game_cache.invalidate(game_id)
+                continue
+            self.layer.game_cache.put(cached.model_copy(update={
+                "metadata": metadata,
+                **_state_versions(data)
+            }))
+
+class AILogWriter:
+    """
+    Write-behind queue for AI interaction logs.
+    Entries are grouped into batched commits by count, approximate size and age.
+    The buffer is bounded: submit() waits for room instead of letting writes pile up.
+    A failed commit is retried up to retry_attempts times with exponential backoff before
+    its entries are dropped; log ids are fixed up front so a retry never duplicates rows.
+    """
+    def __init__(self, layer: "PersistenceLayer", max_buffer: int, max_batch: int, max_batch_bytes: int, flush_interval: float,
+                 retry_attempts: int = 3, retry_backoff: float = 1.0):
+        self.layer = layer
+        self.max_batch = max_batch
+        self.max_batch_bytes = max_batch_bytes
+        self.flush_interval = flush_interval
+        self.retry_attempts = retry_attempts
+        self.retry_backoff = retry_backoff
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffer)
+        self._task: Optional[asyncio.Task] = None
+        self.batches_committed = 0
+        self.entries_written = 0
+        self.entries_failed = 0
+        self.commit_retries = 0
+
+    @staticmethod
+    def _estimate_size(entry: AILogEntry) -> int:
+        return len(entry.system_prompt) + len(entry.user_input) + len(entry.raw_response) + 512
+
+    async def submit(self, entry: AILogEntry, static_prompt: str = None):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        await self._queue.put((entry, static_prompt))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = self._estimate_size(batch[0][0])
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch and size < self.max_batch_bytes:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += self._estimate_size(item[0])
+            try:
+                await self._commit(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _commit(self, batch):
+        log_refs = [self.layer.games_collection.document(entry.game_id).collection('logs').document() for entry, _ in batch]
+        for attempt in range(self.retry_attempts + 1):
+            try:
+                await self._write(batch, log_refs)
+                return
+            except Exception as e:
+                if attempt == self.retry_attempts:
+                    self.entries_failed += len(batch)
+                    logging.error(f"Failed to commit batch of {len(batch)} AI logs after {attempt + 1} attempts, dropping it: {e}")
+                    return
+                delay = self.retry_backoff * 2 ** attempt
+                self.commit_retries += 1
+                logging.warning(f"AI log batch commit failed, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+
+    async def _write(self, batch, log_refs):
+        prompts = {}
+        write_batch = self.layer.db.batch()
+        for (entry, static_prompt), log_ref in zip(batch, log_refs):
+            digest = entry.prompt_hash
+            if digest and static_prompt is not None and digest not in self.layer._prompt_texts and digest not in prompts:
+                prompts[digest] = static_prompt
+                write_batch.set(self.layer.prompts_collection.document(digest), {
+                    "text": static_prompt,
+                    "size": len(static_prompt),
+                    "created_at": self.layer.db.SERVER_TIMESTAMP
+                })
+            write_batch.set(log_ref, entry.model_dump())
+        await write_batch.commit()
+        self.layer._prompt_texts.update(prompts)
+        self.batches_committed += 1
+        self.entries_written += len(batch)
+
+    async def drain(self, timeout: float = 15.0):
+        """Flushes everything buffered. Called from the FastAPI lifespan on shutdown."""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"AI log drain timed out with {self._queue.qsize()} entries unwritten")
+        self._task.cancel()
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": self._queue.qsize(),
+            "batches_committed": self.batches_committed,
+            "entries_written": self.entries_written,
+            "entries_failed": self.entries_failed,
+            "commit_retries": self.commit_retries
+        }
+
+@io_stats.instrumented
 class PersistenceLayer:
     def __init__(self):
         # Explicitly use the 'sandbox' database to match existing data
-        self.db = firestore.AsyncClient(database="sandbox")
+        # Firestore by default; sqlite/memory run the same code with no outside service
+        backend = storage.create_backend(config.STORAGE_BACKEND, database=config.FIRESTORE_DATABASE, path=config.SQLITE_PATH)
+        # Every document read/write is counted and sized for io_stats
+        self.db = storage.InstrumentedBackend(backend, io_stats.stats.record_io)
         self.games_collection = self.db.collection('games')
         self.channels_collection = self.db.collection('channels')
         self.users_collection = self.db.collection('users')
+        self.prompts_collection = self.db.collection('prompts')
+        # Content-addressed prompt texts this process has already stored / fetched
+        self._prompt_texts: Dict[str, str] = {}
+        self.journal_enabled = config.GAME_JOURNAL_ENABLED
+        self.snapshot_interval = config.GAME_SNAPSHOT_INTERVAL
+        self.state_encoding = config.STATE_ENCODING
+        self.game_cache = GameStateCache(config.GAME_CACHE_MAX_ENTRIES, config.GAME_CACHE_TTL_SECONDS)
+        self.channel_index = ChannelIndexCache(config.CHANNEL_INDEX_MAX_ENTRIES, config.CHANNEL_INDEX_NEGATIVE_TTL_SECONDS)
+        self.coherence = CacheCoherence(self)
+        # game_id -> [input_tokens, output_tokens] not yet written to the game document
+        self._pending_usage: Dict[str, List[int]] = {}
+        self.log_writer = AILogWriter(
+            self,
+            max_buffer=config.AI_LOG_BUFFER_SIZE,
+            max_batch=config.AI_LOG_BATCH_SIZE,
+            max_batch_bytes=config.AI_LOG_BATCH_BYTES,
+            flush_interval=config.AI_LOG_FLUSH_INTERVAL_SECONDS,
+            retry_attempts=config.AI_LOG_RETRY_ATTEMPTS,
+            retry_backoff=config.AI_LOG_RETRY_BACKOFF_SECONDS
+        )
+
+    # --- GAME DOCUMENTS ---
+    # games/{id} is the small, frequently touched header (lobby, interface, status, usage)
+    # versioned by header_version; games/{id}/state/current holds the cartridge metadata
+    # versioned by version (the OCC guard for task commits) and chat_version (field writes
+    # confined to chat paths), with seq counting every commit.
+
+    def _state_ref(self, game_id: str):
+        return self.games_collection.document(game_id).collection(STATE_COLLECTION).document(STATE_DOC_ID)
+
+    @staticmethod
+    def _split_game(game: GameState) -> Tuple[dict, dict]:
+        """Returns (header_doc, state_doc) for a GameState."""
+        header = game.model_dump()
+        state = {"metadata": header.pop("metadata"), "status": game.status}
+        for field in STATE_VERSION_FIELDS:
+            state[field] = header.pop(field)
+        header.update(_mirrored_fields({"": state["metadata"]}))
+        return header, state
 
     async def create_game_record(self, game: GameState):
-        await self.games_collection.document(game.id).set(game.model_dump())
+        header, state = self._split_game(game)
+        metadata = state.pop("metadata")
+        batch = self.db.batch()
+        batch.set(self.games_collection.document(game.id), header)
+        batch.set(self._state_ref(game.id), {**state, **self._encode_metadata(metadata)})
+        if self.journal_enabled:
+            # Replays need a base: every game starts with a snapshot of its initial state
+            self._write_snapshot(batch, game.id, game.seq, metadata)
+        await batch.commit()
+        self.game_cache.put(game)
 
-    async def get_game_by_id(self, game_id: str) -> GameState:
-        doc = await self.games_collection.document(game_id).get()
-        if doc.exists:
-            return GameState(**doc.to_dict())
-        return None
+    async def get_game_by_id(self, game_id: str, use_cache: bool = True, header: Optional[GameHeader] = None) -> GameState:
+        """
+        Read-through lookup that only reads the halves of a game it cannot vouch for.
+        While the coherence listener runs, cached halves are current (use_cache=False still
+        rereads the state, whose version guards task commits). Without it, a cached header is
+        only trusted when it matches the header_version of `header`, and a cached state never
+        is. A `header` projected by get_game_header stands in for the header document.
+        """
+        coherent = self.coherence.running
+        cached = self.game_cache.get(game_id) if coherent or header is not None else None
+
+        header_data = None
+        if header is not None and header._document is not None:
+            header_data = header._document
+        elif cached is not None and (coherent or cached.header_version == header.header_version):
+            header_data = cached.model_dump(exclude={"metadata", *STATE_VERSION_FIELDS})
+        if header_data is None:
+            return await self._read_game(game_id)
+
+        if cached is not None and coherent and use_cache:
+            return cached
+
+        doc = await self._state_ref(game_id).get()
+        if not doc.exists:
+            # Games still on the inline layout take the full read, which migrates them
+            return await self._read_game(game_id)
+        state = doc.to_dict()
+        if cached is not None and any(_state_versions(state)[field] != getattr(cached, field) for field in STATE_VERSION_FIELDS):
+            self.game_cache.stale += 1
+
+        game = GameState(**{**header_data, "metadata": _state_metadata(state), **_state_versions(state)})
+        self.game_cache.put(game)
+        return game
+
+    async def _read_game(self, game_id: str) -> Optional[GameState]:
+        """Fetches both halves of a game in a single round trip."""
+        header_doc, state_doc = None, None
+        async for doc in self.db.get_all([self.games_collection.document(game_id), self._state_ref(game_id)]):
+            if not doc.exists:
+                continue
+            if doc.id == STATE_DOC_ID:
+                state_doc = doc
+            else:
+                header_doc = doc
+
+        if header_doc is None:
+            self.game_cache.invalidate(game_id)
+            return None
+
+        data = header_doc.to_dict()
+        if state_doc is not None:
+            state = state_doc.to_dict()
+            data["metadata"] = _state_metadata(state)
+            data.update(_state_versions(state))
+        elif "metadata" in data:
+            await self._migrate_inline_state(game_id, data)
+            data.update(_state_versions(data))
+
+        game = GameState(**data)
+        self.game_cache.put(game)
+        return game
+
+    async def _migrate_inline_state(self, game_id: str, data: dict):
+        """
+        Moves metadata stored inline on the game document (schema_version <= 2) into
+        the state document. create() makes concurrent migrations of one game a no-op.
+        """
+        metadata = data.get("metadata") or {}
+        batch = self.db.batch()
+        batch.create(self._state_ref(game_id), {
+            **self._encode_metadata(metadata),
+            "version": data.get("version", 1),
+            "status": data.get("status")
+        })
+        if self.journal_enabled:
+            self._write_snapshot(batch, game_id, data.get("version", 1), metadata)
+        batch.update(self.games_collection.document(game_id), {
+            "metadata": self.db.DELETE_FIELD,
+            "version": self.db.DELETE_FIELD,
+            "schema_version": 3,
+            **_mirrored_fields({"": metadata})
+        })
+        try:
+            await batch.commit()
+            logging.info(f"Migrated game {game_id} to the split header/state layout")
+        except Exception as e:
+            logging.warning(f"State migration skipped for {game_id}: {e}")
+
+    async def get_game_header(self, game_id: str, use_cache: bool = True) -> Optional[GameHeader]:
+        """
+        Status/version/routing view of a game. Served from the game cache when possible,
+        otherwise read with a field projection so the metadata blob is never transferred.
+        """
+        if use_cache:
+            cached = self.game_cache.get(game_id, copy=False)
+            if cached is not None:
+                return GameHeader.from_game(cached)
+
+        doc = await self.games_collection.document(game_id).get(field_paths=HEADER_FIELDS)
+        if not doc.exists:
+            return None
+        document = doc.to_dict()
+        data = dict(document)
+        inline = data.pop("metadata", None) or {}
+        data.setdefault("phase", inline.get("phase"))
+        data.setdefault("id", game_id)
+        header = GameHeader(**data)
+        if not inline:
+            header._document = document
+        return header
 
     async def add_player_to_game(self, game_id: str, player: LobbyPlayer):
         """
-        Uses firestore.ArrayUnion to atomically append a player.
+        Uses ArrayUnion to atomically append a player.
         Safe from race conditions without a transaction.
-        Increments version to signal state change.
+        Increments header_version to signal a lobby change.
         """
         try:
             game_ref = self.games_collection.document(game_id)
             await game_ref.update({
-                "players": firestore.ArrayUnion([player.model_dump()]),
-                "version": firestore.Increment(1)
+                "players": self.db.ArrayUnion([player.model_dump()]),
+                "header_version": self.db.Increment(1)
             })
-            return True
         except Exception as e:
             logging.error(f"Failed to add player via ArrayUnion: {e}")
+            self.game_cache.invalidate(game_id)
             return False
 
-    async def update_game_interface(self, game_id: str, interface):
-        await self.games_collection.document(game_id).update({
-            "interface": interface.model_dump(),
-            "version": firestore.Increment(1)
-        })
+        def _add(game: GameState):
+            if all(p.id != player.id for p in game.players):
+                game.players.append(player.model_copy())
+        self.game_cache.refresh(game_id, _add, bump="header_version")
+        return True
+
+    @staticmethod
+    def _versions_match(game_id: str, current: Dict[str, int], version: int, chat_version: Optional[int]) -> bool:
+        if current["version"] != version:
+            logging.warning(f"Version mismatch for {game_id}: expected {version}, found {current['version']}")
+            return False
+        if chat_version is not None and current["chat_version"] != chat_version:
+            logging.warning(f"Chat version mismatch for {game_id}: expected {chat_version}, found {current['chat_version']}")
+            return False
+        return True
 
-    async def update_game_metadata(self, game_id: str, metadata: dict, expected_version: int):
+    async def update_game_metadata(self, game_id: str, metadata: dict, expected_version: int, expected_chat_version: int = None):
         """
-        Replaces the entire metadata field using a transaction to verify version.
+        Replaces the entire metadata field using a transaction to verify version
+        (and chat_version when given, since a replace also rewrites the chat paths).
         """
         transaction = self.db.transaction()
-        game_ref = self.games_collection.document(game_id)
+        state_ref = self._state_ref(game_id)
+        mirrored = _mirrored_fields({"": metadata})
 
-        @firestore.async_transactional
-        async def _update_with_version(transaction, game_ref, new_metadata, version):
-            snapshot = await game_ref.get(transaction=transaction)
+        @self.db.transactional
+        async def _update_with_version(transaction, state_ref, new_metadata, version):
+            snapshot = await state_ref.get(transaction=transaction)
             if not snapshot.exists:
                 return False
             
-            current_version = snapshot.to_dict().get("version", 1)
-            if current_version != version:
-                logging.warning(f"Version mismatch for {game_id}: expected {version}, found {current_version}")
+            current = _state_versions(snapshot.to_dict())
+            if not self._versions_match(game_id, current, version, expected_chat_version):
                 return False
             
-            transaction.update(game_ref, {
-                "metadata": new_metadata,
-                "version": firestore.Increment(1)
+            replace = MetadataDiff.from_fields({"": new_metadata})
+            writes = self._replace_metadata(new_metadata)
+            measured["bytes"] = self._encoded_size(writes)
+            transaction.update(state_ref, {
+                **writes,
+                "version": version + 1,
+                "seq": current["seq"] + 1,
+                "state_bytes": measured["bytes"]
             })
+            if mirrored:
+                transaction.update(self.games_collection.document(game_id), mirrored)
+            self._journal(transaction, game_id, current["seq"] + 1, "replace", replace, {}, measured["bytes"])
             return True
 
+        measured = {}
         try:
-            return await _update_with_version(transaction, game_ref, metadata, expected_version)
+            success = await _update_with_version(transaction, state_ref, metadata, expected_version)
         except Exception as e:
             logging.error(f"Transaction failed for update_game_metadata: {e}")
+            success = False
+        if success:
+            self._record_state_size(game_id, measured["bytes"])
+
+        if not success:
+            # Whatever we hold for this game is older than the stored document
+            self.game_cache.invalidate(game_id)
             return False
 
-    async def update_game_metadata_fields(self, game_id: str, patch: dict):
-        """Targeted update using dot-notation for nested fields."""
-        update_dict = {"version": firestore.Increment(1)}
-        for key, value in patch.items():
-            update_dict[f"metadata.{key}"] = value
-        
-        await self.games_collection.document(game_id).update(update_dict)
+        def _set_metadata(game: GameState):
+            game.metadata = copy.deepcopy(metadata)
+            game.version = expected_version
+        self.game_cache.refresh(game_id, _set_metadata)
+        return True
 
-    async def set_game_active(self, game_id: str):
-        await self.games_collection.document(game_id).update({
-            "status": "active", 
-            "started_at": firestore.SERVER_TIMESTAMP,
-            "version": firestore.Increment(1)
+    async def update_game_metadata_diff(
+        self,
+        game_id: str,
+        diff: MetadataDiff,
+        expected_version: int,
+        log_lines: Optional[List[Tuple[str, List[Any]]]] = None,
+        expected_chat_version: int = None
+    ):
+        """
+        Commits only the changed metadata paths, under the same version checks as
+        update_game_metadata. Callers pass expected_chat_version only when the diff
+        touches chat paths. Union-safe list growth is sent as ArrayUnion.
+        New log stream lines are archived in the same transaction, so a rejected
+        task leaves no trace in the streams either.
+        """
+        transaction = self.db.transaction()
+        state_ref = self._state_ref(game_id)
+        archived = self._build_log_lines(log_lines)
+        mirrored = _mirrored_fields({**diff.sets, **{path: None for path in diff.deletes}})
+
+        dotted = {}
+        for path, value in diff.sets.items():
+            dotted[f"metadata.{path}" if path else "metadata"] = value
+        for path, items in diff.appends.items():
+            dotted[f"metadata.{path}"] = self.db.ArrayUnion(items)
+        for path in diff.deletes:
+            dotted[f"metadata.{path}"] = self.db.DELETE_FIELD
+
+        @self.db.transactional
+        async def _update_with_version(transaction, state_ref, version):
+            snapshot = await state_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return False
+
+            state = snapshot.to_dict()
+            current = _state_versions(state)
+            if not self._versions_match(game_id, current, version, expected_chat_version):
+                return False
+
+            metadata_before = _state_metadata(state)
+            writes, measured["bytes"] = self._metadata_writes(state, metadata_before, diff, dotted)
+            transaction.update(state_ref, {
+                **writes,
+                "version": version + 1,
+                "seq": current["seq"] + 1,
+                "state_bytes": measured["bytes"]
+            })
+            if mirrored:
+                transaction.update(self.games_collection.document(game_id), mirrored)
+            self._journal(transaction, game_id, current["seq"] + 1, "diff", diff, metadata_before, measured["bytes"])
+            for entry in archived:
+                transaction.set(self._log_stream_ref(game_id, entry.stream).document(), entry.model_dump())
+            return True
+
+        measured = {}
+        try:
+            success = await _update_with_version(transaction, state_ref, expected_version)
+        except Exception as e:
+            logging.error(f"Transaction failed for update_game_metadata_diff: {e}")
+            success = False
+        if success:
+            self._record_state_size(game_id, measured["bytes"])
+
+        if not success:
+            self.game_cache.invalidate(game_id)
+            return False
+
+        def _apply_diff(game: GameState):
+            if game.version != expected_version:
+                raise ValueError(f"cached version {game.version} is not the committed base {expected_version}")
+            diff.apply_to(game.metadata)
+        self.game_cache.refresh(game_id, _apply_diff)
+        return True
+
+    async def update_game_metadata_fields(self, game_id: str, patch: dict, version_field: str = "version"):
+        """
+        Targeted update using dot-notation for nested fields. Patches confined to the
+        cartridge's chat paths pass version_field="chat_version" so they do not
+        invalidate the version an in-flight task will commit against.
+        """
+        dotted = {f"metadata.{key}": value for key, value in patch.items()}
+        update_dict = {version_field: self.db.Increment(1), "seq": self.db.Increment(1), **dotted}
+
+        mirrored = _mirrored_fields(patch)
+        if self.journal_enabled or self.state_encoding == "blob":
+            await self._update_fields_transactional(game_id, patch, dotted, mirrored, version_field)
+        elif mirrored:
+            batch = self.db.batch()
+            batch.update(self._state_ref(game_id), update_dict)
+            batch.update(self.games_collection.document(game_id), mirrored)
+            await batch.commit()
+        else:
+            await self._state_ref(game_id).update(update_dict)
+
+        def _patch_metadata(game: GameState):
+            for key, value in patch.items():
+                _set_dotted(game.metadata, key, copy.deepcopy(value))
+        self.game_cache.refresh(game_id, _patch_metadata, bump=(version_field, "seq"))
+
+    async def _update_fields_transactional(self, game_id: str, patch: dict, dotted: dict, mirrored: dict, version_field: str):
+        """
+        The journal is keyed by seq, so a field patch reads the seq it produces in a transaction.
+        A blob-encoded document cannot take dotted writes and is rewritten in one as well.
+        """
+        transaction = self.db.transaction()
+        state_ref = self._state_ref(game_id)
+        diff = MetadataDiff.from_fields(patch)
+
+        @self.db.transactional
+        async def _update(transaction, state_ref):
+            snapshot = await state_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                raise storage.NotFound(f"No state document for game {game_id}")
+            state = snapshot.to_dict()
+            current = _state_versions(state)
+            seq = current["seq"] + 1
+            metadata_before = _state_metadata(state)
+            writes, measured["bytes"] = self._metadata_writes(state, metadata_before, diff, dotted)
+            transaction.update(state_ref, {
+                **writes,
+                version_field: current[version_field] + 1,
+                "seq": seq,
+                "state_bytes": measured["bytes"]
+            })
+            if mirrored:
+                transaction.update(self.games_collection.document(game_id), mirrored)
+            self._journal(transaction, game_id, seq, "fields", diff, metadata_before, measured["bytes"])
+
+        measured = {}
+        await _update(transaction, state_ref)
+        self._record_state_size(game_id, measured["bytes"])
+
+    # --- STATE ENCODING ---
+    # The metadata is either a Firestore map (dotted writes, readable in the console) or, with
+    # STATE_ENCODING=blob, a compressed tagged-JSON field: a fraction of the size on the wire and
+    # one decode instead of a nested map conversion per read, but every commit rewrites it whole.
+
+    def _encode_metadata(self, metadata: dict) -> dict:
+        """The state document fields holding `metadata` in the configured encoding."""
+        if self.state_encoding == "blob":
+            codec_name, blob = codec.pack_state(metadata)
+            return {"metadata_blob": blob, "metadata_codec": codec_name}
+        return {"metadata": metadata}
+
+    def _replace_metadata(self, metadata: dict) -> dict:
+        """Update fields replacing the stored metadata, clearing the other encoding's fields."""
+        fields = self._encode_metadata(metadata)
+        stale = STATE_BLOB_FIELDS if "metadata" in fields else ("metadata",)
+        return {**fields, **{field: self.db.DELETE_FIELD for field in stale}}
+
+    def _metadata_writes(self, state: dict, metadata_before: dict, diff: MetadataDiff, dotted: dict) -> Tuple[dict, int]:
+        """
+        The writes committing `diff` to a state document, and the resulting size. Map documents
+        staying maps take the dotted writes; anything else is patched here and rewritten whole,
+        which also converts games between encodings.
+        """
+        if self.state_encoding != "blob" and "metadata_blob" not in state:
+            return dotted, self._state_size(metadata_before, diff)
+        metadata = copy.deepcopy(metadata_before)
+        diff.apply_to(metadata)
+        writes = self._replace_metadata(metadata)
+        return writes, self._encoded_size(writes)
+
+    def encoded_state_size(self, metadata: dict) -> int:
+        """Size of the state document holding `metadata` in the configured encoding."""
+        return self._encoded_size(self._encode_metadata(metadata))
+
+    @staticmethod
+    def _encoded_size(writes: dict) -> int:
+        blob = writes.get("metadata_blob")
+        if isinstance(blob, bytes):
+            return len(blob) + STATE_DOC_OVERHEAD_BYTES
+        return estimate_size(writes["metadata"]) + STATE_DOC_OVERHEAD_BYTES
+
+    # --- STATE SIZE ---
+    # Every transactional commit estimates the state document it produces. The figure is
+    # stored on the document and its journal event (growth across cycles) and kept as a gauge.
+
+    @staticmethod
+    def _state_size(metadata_before: dict, diff: MetadataDiff) -> int:
+        return estimate_size_after(metadata_before, diff) + STATE_DOC_OVERHEAD_BYTES
+
+    def _record_state_size(self, game_id: str, size_bytes: int):
+        io_stats.stats.record_state_size(game_id, size_bytes)
+        if size_bytes >= config.STATE_SIZE_WARN_BYTES:
+            logging.warning(f"State size: game {game_id} is ~{size_bytes} bytes ({size_bytes * 100 // DOCUMENT_LIMIT_BYTES}% of the document limit)")
+
+    # --- JOURNAL ---
+    # games/{id}/journal/{seq} holds the change that produced each state commit (task and
+    # chat domains alike) and games/{id}/snapshots/{seq} a full copy every snapshot_interval
+    # commits. The state document stays the read path; the journal is for recovery and replays.
+
+    def _journal_ref(self, game_id: str):
+        return self.games_collection.document(game_id).collection('journal')
+
+    def _snapshots_ref(self, game_id: str):
+        return self.games_collection.document(game_id).collection('snapshots')
+
+    def _write_snapshot(self, writer, game_id: str, seq: int, metadata: dict):
+        writer.set(self._snapshots_ref(game_id).document(f"{seq:012d}"), {
+            "seq": seq,
+            "metadata": codec.pack(metadata),
+            "committed_at": self.db.SERVER_TIMESTAMP
         })
 
-    async def mark_game_ended(self, game_id: str):
-        await self.games_collection.document(game_id).update({
-            "status": "ended",
-            "ended_at": firestore.SERVER_TIMESTAMP,
-            "version": firestore.Increment(1)
+    def _journal(self, writer, game_id: str, seq: int, kind: str, diff: MetadataDiff, metadata_before: dict, state_bytes: int = None):
+        """Adds the event for `seq` (and a snapshot when one is due) to a batch or transaction."""
+        if not self.journal_enabled:
+            return
+        writer.set(self._journal_ref(game_id).document(f"{seq:012d}"), {
+            "seq": seq,
+            "kind": kind,
+            "ops": codec.pack(diff.to_dict()),
+            "state_bytes": state_bytes,
+            "committed_at": self.db.SERVER_TIMESTAMP
+        })
+        if self.snapshot_interval > 0 and seq % self.snapshot_interval == 0:
+            metadata = copy.deepcopy(metadata_before or {})
+            diff.apply_to(metadata)
+            self._write_snapshot(writer, game_id, seq, metadata)
+
+    async def rebuild_metadata(self, game_id: str, at_seq: int = None) -> Optional[Tuple[int, dict]]:
+        """
+        Reconstructs the metadata as of `at_seq` (default: latest) from the closest
+        snapshot plus the journal tail. Returns (seq, metadata), or None when the
+        game has no snapshot at or before that seq.
+        """
+        snapshots = self._snapshots_ref(game_id)
+        if at_seq is not None:
+            snapshots = snapshots.where(filter=self.db.FieldFilter("seq", "<=", at_seq))
+        base = None
+        async for doc in snapshots.order_by("seq", direction=self.db.DESCENDING).limit(1).stream():
+            base = doc.to_dict()
+        if base is None:
+            return None
+
+        seq = base["seq"]
+        metadata = codec.unpack(base["metadata"])
+        events = self._journal_ref(game_id).where(filter=self.db.FieldFilter("seq", ">", seq))
+        if at_seq is not None:
+            events = events.where(filter=self.db.FieldFilter("seq", "<=", at_seq))
+        async for doc in events.order_by("seq").stream():
+            event = doc.to_dict()
+            if event["seq"] != seq + 1:
+                logging.warning(f"Journal gap for {game_id}: expected {seq + 1}, found {event['seq']}")
+                break
+            MetadataDiff.from_dict(codec.unpack(event["ops"])).apply_to(metadata)
+            seq = event["seq"]
+        return seq, metadata
+
+    async def restore_metadata(self, game_id: str, at_seq: int) -> bool:
+        """Rolls a game's metadata back to an earlier commit. The rollback is itself journaled."""
+        rebuilt = await self.rebuild_metadata(game_id, at_seq)
+        if rebuilt is None:
+            return False
+        current = await self._state_ref(game_id).get()
+        if not current.exists:
+            return False
+        return await self.update_game_metadata(game_id, rebuilt[1], current.to_dict().get("version", 1))
+
+    # --- ARCHIVAL ---
+    # An ended game is compacted into one compressed blob (final state, AI logs with their
+    # prompts, log streams) under games/{id}/archive; the game document stays as a summary.
+
+    def _archive_ref(self, game_id: str):
+        return self.games_collection.document(game_id).collection('archive')
+
+    async def _delete_collection(self, collection) -> int:
+        deleted = 0
+        batch, pending = self.db.batch(), 0
+        async for doc in collection.stream():
+            batch.delete(doc.reference)
+            pending += 1
+            if pending >= DELETE_BATCH_SIZE:
+                await batch.commit()
+                deleted += pending
+                batch, pending = self.db.batch(), 0
+        if pending:
+            await batch.commit()
+            deleted += pending
+        return deleted
+
+    async def archive_game(self, game_id: str) -> bool:
+        """
+        Compacts an ended game. Safe to rerun: the summary is only written once every
+        chunk exists, and a rerun after a partial purge just finishes the purge.
+        """
+        game_ref = self.games_collection.document(game_id)
+        header = await game_ref.get()
+        if not header.exists:
+            return False
+        data = header.to_dict()
+        archive = data.get("archive")
+        if archive and archive.get("purged"):
+            return True
+        if data.get("status") != "ended":
+            logging.warning(f"Archive skipped: game {game_id} has not ended")
+            return False
+
+        if not archive:
+            game = await self.get_game_by_id(game_id, use_cache=False)
+            ai_logs = [{**doc.to_dict(), "id": doc.id} async for doc in game_ref.collection('logs').order_by('timestamp').stream()]
+            prompts = await self.get_prompts([log["prompt_hash"] for log in ai_logs if log.get("prompt_hash")])
+            streams = {}
+            async for stream_ref in game_ref.collection('log_streams').list_documents():
+                entries = stream_ref.collection('entries').order_by('seq')
+                streams[stream_ref.id] = [doc.to_dict() async for doc in entries.stream()]
+
+            codec_name, blob = codec.pack_archive({
+                "game": game.model_dump(),
+                "ai_logs": ai_logs,
+                "prompts": prompts,
+                "log_streams": streams
+            })
+            chunks = [blob[i:i + ARCHIVE_CHUNK_BYTES] for i in range(0, len(blob), ARCHIVE_CHUNK_BYTES)] or [b""]
+            for start in range(0, len(chunks), ARCHIVE_CHUNKS_PER_BATCH):
+                batch = self.db.batch()
+                for index in range(start, min(start + ARCHIVE_CHUNKS_PER_BATCH, len(chunks))):
+                    batch.set(self._archive_ref(game_id).document(f"{index:04d}"), {"index": index, "data": chunks[index]})
+                await batch.commit()
+
+            archive = {
+                "codec": codec_name,
+                "chunks": len(chunks),
+                "bytes": len(blob),
+                "ai_logs": len(ai_logs),
+                "purged": False,
+                "archived_at": datetime.datetime.now(datetime.timezone.utc)
+            }
+            await game_ref.update({"archive": archive, "header_version": self.db.Increment(1)})
+
+        # Purge the live data the archive now holds
+        deleted = await self._delete_collection(game_ref.collection('logs'))
+        async for stream_ref in game_ref.collection('log_streams').list_documents():
+            deleted += await self._delete_collection(stream_ref.collection('entries'))
+        deleted += await self._delete_collection(self._journal_ref(game_id))
+        deleted += await self._delete_collection(self._snapshots_ref(game_id))
+        await self._state_ref(game_id).delete()
+        await game_ref.update({"archive.purged": True})
+        self.game_cache.invalidate(game_id)
+        logging.info(f"Archived game {game_id}: {archive.get('bytes')} bytes ({archive.get('codec')}), {deleted} documents purged")
+        return True
+
+    async def open_archive(self, game_id: str) -> Optional[Dict[str, Any]]:
+        """Loads an archived game: {"game", "ai_logs" (prompts expanded), "log_streams"}."""
+        header = await self.games_collection.document(game_id).get()
+        archive = (header.to_dict() or {}).get("archive") if header.exists else None
+        if not archive:
+            return None
+        chunks = [doc.to_dict()["data"] async for doc in self._archive_ref(game_id).order_by('index').stream()]
+        if len(chunks) != archive.get("chunks"):
+            logging.error(f"Archive for {game_id} is incomplete: {len(chunks)}/{archive.get('chunks')} chunks")
+            return None
+        data = codec.unpack_archive(b"".join(chunks), archive["codec"])
+        self._prompt_texts.update(data.pop("prompts", {}))
+        data["ai_logs"] = await self._expand_prompts(data.get("ai_logs", []))
+        return data
+
+    async def _set_status(self, game_id: str, status: str, timestamp_field: str):
+        # The state document carries the status only to scope the coherence listener; its version is untouched
+        batch = self.db.batch()
+        batch.update(self.games_collection.document(game_id), {
+            "status": status,
+            timestamp_field: self.db.SERVER_TIMESTAMP,
+            "header_version": self.db.Increment(1)
         })
+        batch.update(self._state_ref(game_id), {"status": status})
+        await batch.commit()
+
+        def _apply_status(game: GameState):
+            game.status = status
+            setattr(game, timestamp_field, datetime.datetime.now(datetime.timezone.utc))
+        self.game_cache.refresh(game_id, _apply_status, bump="header_version")
+
+    async def set_game_active(self, game_id: str):
+        await self._set_status(game_id, "active", "started_at")
+
+    async def mark_game_ended(self, game_id: str):
+        await self._set_status(game_id, "ended", "ended_at")
 
     async def increment_token_usage(self, game_id: str, input_tokens: int, output_tokens: int):
         """Atomic server-side increment for usage tracking."""
         ref = self.games_collection.document(game_id)
         await ref.update({
-            "usage_input_tokens": firestore.Increment(input_tokens),
-            "usage_output_tokens": firestore.Increment(output_tokens)
+            "usage_input_tokens": self.db.Increment(input_tokens),
+            "usage_output_tokens": self.db.Increment(output_tokens)
         })
 
+        def _add_usage(game: GameState):
+            game.usage_input_tokens += input_tokens
+            game.usage_output_tokens += output_tokens
+        self.game_cache.refresh(game_id, _add_usage, bump=None)
+
+    def record_token_usage(self, game_id: str, input_tokens: int, output_tokens: int):
+        """Accumulates usage in memory. flush_token_usage() turns it into one increment per game."""
+        pending = self._pending_usage.setdefault(game_id, [0, 0])
+        pending[0] += input_tokens
+        pending[1] += output_tokens
+
+    async def flush_token_usage(self, game_id: str = None):
+        """Writes pending usage for one game (or all games). Failed increments are kept for the next flush."""
+        game_ids = [game_id] if game_id else list(self._pending_usage)
+        for gid in game_ids:
+            pending = self._pending_usage.pop(gid, None)
+            if not pending or sum(pending) == 0:
+                continue
+            try:
+                await self.increment_token_usage(gid, pending[0], pending[1])
+            except Exception as e:
+                logging.warning(f"Failed to flush token usage for {gid}: {e}")
+                self.record_token_usage(gid, pending[0], pending[1])
+
     async def register_channel_association(self, channel_id: str, game_id: str):
         try:
             await self.channels_collection.document(str(channel_id)).set({"game_id": game_id})
+            self.channel_index.store(str(channel_id), game_id)
         except Exception as e:
+            self.channel_index.invalidate(str(channel_id))
             logging.error(f"Failed to register channel index: {e}")
 
     async def remove_channel_association(self, channel_id: str):
         try:
             await self.channels_collection.document(str(channel_id)).delete()
+            self.channel_index.store(str(channel_id), None)
         except Exception as e:
+            self.channel_index.invalidate(str(channel_id))
             logging.warning(f"Failed to remove channel index: {e}")
 
+    async def commit_channel_provisioning(self, game_id: str, interface, channel_ids: List[str]):
+        """
+        Registers every new channel association and the updated interface in a single batched write.
+        The only interface write path: lobby creation commits with no channels.
+        """
+        channel_ids = [str(cid) for cid in channel_ids]
+        batch = self.db.batch()
+        for channel_id in channel_ids:
+            batch.set(self.channels_collection.document(channel_id), {"game_id": game_id})
+        batch.update(self.games_collection.document(game_id), {
+            "interface": interface.model_dump(),
+            "header_version": self.db.Increment(1)
+        })
+        try:
+            await batch.commit()
+        except Exception as e:
+            for channel_id in channel_ids:
+                self.channel_index.invalidate(channel_id)
+            self.game_cache.invalidate(game_id)
+            logging.error(f"Failed to commit channel provisioning for {game_id}: {e}")
+            raise e
+
+        # Overwrites any negative entry a message in the new channel cached before the commit
+        for channel_id in channel_ids:
+            self.channel_index.store(channel_id, game_id)
+
+        def _set_interface(game: GameState):
+            game.interface = interface.model_copy(deep=True)
+        self.game_cache.refresh(game_id, _set_interface, bump="header_version")
+
+    async def remove_channel_associations(self, channel_ids: List[str]):
+        """Deletes several channel associations in one batched write."""
+        channel_ids = [str(cid) for cid in channel_ids]
+        if not channel_ids:
+            return
+        batch = self.db.batch()
+        for channel_id in channel_ids:
+            batch.delete(self.channels_collection.document(channel_id))
+        try:
+            await batch.commit()
+            for channel_id in channel_ids:
+                self.channel_index.store(channel_id, None)
+        except Exception as e:
+            for channel_id in channel_ids:
+                self.channel_index.invalidate(channel_id)
+            logging.warning(f"Failed to remove channel index entries: {e}")
+
     async def get_game_id_by_channel_index(self, channel_id: str) -> str:
+        found, game_id = self.channel_index.lookup(str(channel_id))
+        if found:
+            return game_id
+
         doc = await self.channels_collection.document(str(channel_id)).get()
-        if doc.exists:
-            return doc.to_dict().get("game_id")
-        return None
+        game_id = doc.to_dict().get("game_id") if doc.exists else None
+        self.channel_index.store_read(str(channel_id), game_id)
+        return game_id
 
-    async def log_ai_interaction(self, entry: AILogEntry):
+    async def warm_channel_index(self) -> int:
+        """Bulk loads every channel association so routing known channels costs no reads."""
+        count = 0
+        try:
+            async for doc in self.channels_collection.stream():
+                game_id = (doc.to_dict() or {}).get("game_id")
+                if game_id:
+                    self.channel_index.store(doc.id, game_id)
+                    count += 1
+            logging.info(f"System: Channel index warmed with {count} associations")
+        except Exception as e:
+            logging.error(f"Failed to warm channel index: {e}")
+        return count
+
+    async def store_prompt(self, digest: str, text: str):
+        """Writes a content-addressed prompt once per process (the document is immutable)."""
+        if digest in self._prompt_texts:
+            return
+        await self.prompts_collection.document(digest).set({
+            "text": text,
+            "size": len(text),
+            "created_at": self.db.SERVER_TIMESTAMP
+        })
+        self._prompt_texts[digest] = text
+
+    async def get_prompts(self, digests: List[str]) -> Dict[str, str]:
+        missing = [d for d in set(digests) if d not in self._prompt_texts]
+        if missing:
+            refs = [self.prompts_collection.document(d) for d in missing]
+            async for doc in self.db.get_all(refs):
+                if doc.exists:
+                    self._prompt_texts[doc.id] = doc.to_dict().get("text", "")
+        return {d: self._prompt_texts[d] for d in digests if d in self._prompt_texts}
+
+    async def enqueue_ai_log(self, entry: AILogEntry, static_prompt: str = None):
+        """Buffers a log entry for the batched writer; waits only when the buffer is full."""
+        await self.log_writer.submit(entry, static_prompt)
+
+    async def log_ai_interaction(self, entry: AILogEntry, static_prompt: str = None):
+        if entry.prompt_hash and static_prompt is not None:
+            await self.store_prompt(entry.prompt_hash, static_prompt)
         await self.games_collection.document(entry.game_id).collection('logs').add(entry.model_dump())
 
     async def get_game_logs(self, game_id: str, limit: int = 50):
         logs = []
         ref = self.games_collection.document(game_id).collection('logs')
-        async for doc in ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit).stream():
+        async for doc in ref.order_by('timestamp', direction=self.db.DESCENDING).limit(limit).stream():
             logs.append(doc.to_dict())
+        return await self._expand_prompts(logs)
+
+    async def _expand_prompts(self, logs: List[dict]) -> List[dict]:
+        """Reassembles full system prompts for log rows that reference a stored prefix."""
+        digests = [log["prompt_hash"] for log in logs if log.get("prompt_hash")]
+        if not digests:
+            return logs
+        prompts = await self.get_prompts(digests)
+        for log in logs:
+            digest = log.get("prompt_hash")
+            if digest:
+                prefix = prompts.get(digest, f"[missing prompt {digest[:12]}]")
+                log["system_prompt"] = prefix + log.get("system_prompt", "")
         return logs
 
+    # --- DASHBOARD ---
+    # List views read projections and page with a "before" cursor on their sort field,
+    # so a page costs the same however large the collection grows.
+
+    async def list_games(self, limit: int = 20, before: Tuple[datetime.datetime, str] = None) -> Tuple[List[dict], Optional[Tuple[datetime.datetime, str]]]:
+        """
+        Newest games first. Returns the page plus the (created_at, game id) cursor for the next
+        (older) page; ordering on the document id as well keeps games created in the same
+        instant from being skipped at a page boundary.
+        """
+        query = self.games_collection.select(DASHBOARD_GAME_FIELDS)
+        query = query.order_by('created_at', direction=self.db.DESCENDING).order_by(self.db.DOCUMENT_ID, direction=self.db.DESCENDING)
+        if before is not None:
+            query = query.start_after({"created_at": before[0], self.db.DOCUMENT_ID: before[1]})
+
+        docs = [doc async for doc in query.limit(limit).stream()]
+        games = [doc.to_dict() for doc in docs]
+        next_cursor = (games[-1]["created_at"], docs[-1].id) if len(games) == limit else None
+        return games, next_cursor
+
+    async def get_game_log_page(self, game_id: str, limit: int = 25, before: Tuple[datetime.datetime, str] = None) -> Tuple[List[dict], Optional[Tuple[datetime.datetime, str]]]:
+        """
+        Newest AI log rows first, without their system prompts (see get_log_prompt).
+        Paged on (timestamp, log id), like list_games.
+        """
+        query = self.games_collection.document(game_id).collection('logs').select(AI_LOG_SUMMARY_FIELDS)
+        query = query.order_by('timestamp', direction=self.db.DESCENDING).order_by(self.db.DOCUMENT_ID, direction=self.db.DESCENDING)
+        if before is not None:
+            query = query.start_after({"timestamp": before[0], self.db.DOCUMENT_ID: before[1]})
+
+        logs = [{**doc.to_dict(), "id": doc.id} async for doc in query.limit(limit).stream()]
+        next_cursor = (logs[-1]["timestamp"], logs[-1]["id"]) if len(logs) == limit else None
+        return logs, next_cursor
+
+    async def get_log_prompt(self, game_id: str, log_id: str) -> Optional[str]:
+        """The full system prompt of one AI log row."""
+        ref = self.games_collection.document(game_id).collection('logs').document(log_id)
+        doc = await ref.get(field_paths=["system_prompt", "prompt_hash"])
+        if not doc.exists:
+            return None
+        log = (await self._expand_prompts([doc.to_dict()]))[0]
+        return log.get("system_prompt", "")
+
+    # --- ANALYTICS EXPORT ---
+
+    async def stream_games(self, since: Optional[datetime.datetime] = None, page_size: int = 500) -> AsyncIterator[dict]:
+        """
+        Games without the metadata. With no `since`, every game oldest first; otherwise only
+        the games a window after `since` can touch: those that ended after it, then those
+        that have not ended. A game that ends between the two queries is yielded once.
+        """
+        query = self.games_collection.select(EXPORT_GAME_FIELDS)
+        if since is None:
+            async for game in self._page_games(query, "created_at", page_size):
+                yield game
+            return
+
+        seen = set()
+        ended = query.where(filter=self.db.FieldFilter("ended_at", ">", since))
+        running = query.where(filter=self.db.FieldFilter("ended_at", "==", None))
+        for scan, field in ((ended, "ended_at"), (running, None)):
+            async for game in self._page_games(scan, field, page_size):
+                if game["id"] not in seen:
+                    seen.add(game["id"])
+                    yield game
+
+    async def _page_games(self, query, field: Optional[str], page_size: int) -> AsyncIterator[dict]:
+        """
+        Pages `query` on (field, document id), or on the id alone: games sharing a
+        timestamp can straddle a page boundary.
+        """
+        orders = ([field] if field else []) + [self.db.DOCUMENT_ID]
+        for order in orders:
+            query = query.order_by(order)
+        cursor = None
+        while True:
+            paged = query.start_after(cursor) if cursor is not None else query
+            page = [{**doc.to_dict(), "id": doc.id} async for doc in paged.limit(page_size).stream()]
+            for game in page:
+                yield game
+            if len(page) < page_size:
+                return
+            cursor = {order: page[-1]["id"] if order == self.db.DOCUMENT_ID else page[-1][order] for order in orders}
+
+    async def stream_ai_logs(
+        self,
+        game_id: str,
+        after: datetime.datetime = None,
+        until: datetime.datetime = None,
+        page_size: int = 500
+    ) -> AsyncIterator[dict]:
+        """
+        AI log rows with after < timestamp <= until, oldest first, without their system prompts.
+        Paged on (timestamp, document id), like stream_games.
+        """
+        query = self.games_collection.document(game_id).collection('logs').select(EXPORT_AI_LOG_FIELDS)
+        if after is not None:
+            query = query.where(filter=self.db.FieldFilter("timestamp", ">", after))
+        if until is not None:
+            query = query.where(filter=self.db.FieldFilter("timestamp", "<=", until))
+        query = query.order_by('timestamp').order_by(self.db.DOCUMENT_ID)
+        cursor = None
+        while True:
+            paged = query.start_after(cursor) if cursor is not None else query
+            page = [{**doc.to_dict(), "id": doc.id} async for doc in paged.limit(page_size).stream()]
+            for log in page:
+                yield log
+            if len(page) < page_size:
+                return
+            cursor = {"timestamp": page[-1]["timestamp"], self.db.DOCUMENT_ID: page[-1]["id"]}
+
+    # --- LOG STREAMS ---
+    # Growing metadata lists (ship logs, black box, chat) are archived append-only under
+    # games/{id}/log_streams/{stream}/entries; the game document keeps a bounded window.
+
+    def _log_stream_ref(self, game_id: str, stream: str):
+        return self.games_collection.document(game_id).collection('log_streams').document(stream).collection('entries')
+
+    def _build_log_lines(self, log_lines: Optional[List[Tuple[str, List[Any]]]], base_seq: Optional[int] = None) -> List[LogLine]:
+        # A nanosecond clock gives a single sortable field, so reads need no composite index
+        base_seq = time.time_ns() if base_seq is None else base_seq
+        entries = []
+        for stream, lines in log_lines or []:
+            for line in lines:
+                entries.append(LogLine(stream=stream, seq=base_seq + len(entries), line=line))
+        return entries
+
+    async def append_log_lines(self, game_id: str, log_lines: List[Tuple[str, List[Any]]]):
+        """Archives new stream lines in one batched write (used by non-transactional patches)."""
+        entries = self._build_log_lines(log_lines)
+        if not entries:
+            return
+        try:
+            batch = self.db.batch()
+            for entry in entries:
+                batch.set(self._log_stream_ref(game_id, entry.stream).document(), entry.model_dump())
+            await batch.commit()
+        except Exception as e:
+            logging.error(f"Failed to archive log lines for {game_id}: {e}")
+
+    async def archive_legacy_lines(self, game_id: str, streams: List[Tuple[str, List[Any]]]) -> int:
+        """
+        Archives document lines that predate their stream's archive before they leave the document.
+        `streams` holds (stream, lines) already committed to the document, oldest first. Whatever
+        precedes the run matching the archive's newest entries was never archived; it is written
+        with seqs ahead of the oldest archived entry so the stream stays in order.
+        Returns the number of lines archived.
+        """
+        entries = []
+        for stream, lines in streams:
+            if not lines:
+                continue
+            archived, _ = await self.get_log_stream(game_id, stream, limit=len(lines))
+            covered = 0
+            while covered < min(len(archived), len(lines)) and archived[-1 - covered].get("line") == lines[-1 - covered]:
+                covered += 1
+            missing = lines[:len(lines) - covered]
+            if not missing:
+                continue
+            oldest = archived[0]["seq"] if len(archived) < len(lines) else await self._oldest_log_seq(game_id, stream)
+            base_seq = (oldest if oldest is not None else time.time_ns()) - len(missing)
+            entries.extend(self._build_log_lines([(stream, missing)], base_seq=base_seq))
+
+        for start in range(0, len(entries), DELETE_BATCH_SIZE):
+            batch = self.db.batch()
+            for entry in entries[start:start + DELETE_BATCH_SIZE]:
+                batch.set(self._log_stream_ref(game_id, entry.stream).document(), entry.model_dump())
+            await batch.commit()
+        if entries:
+            logging.info(f"Archived {len(entries)} legacy log lines of game {game_id}")
+        return len(entries)
+
+    async def _oldest_log_seq(self, game_id: str, stream: str) -> Optional[int]:
+        query = self._log_stream_ref(game_id, stream).order_by('seq').limit(1)
+        async for doc in query.stream():
+            return doc.to_dict()["seq"]
+        return None
+
+    async def get_log_stream(self, game_id: str, stream: str, limit: int = 100, before_seq: int = None) -> Tuple[List[dict], Optional[int]]:
+        """
+        Pages backwards through an archived stream.
+        Returns the page in chronological order plus the cursor for the next (older) page.
+        """
+        query = self._log_stream_ref(game_id, stream)
+        if before_seq is not None:
+            query = query.where(filter=self.db.FieldFilter("seq", "<", before_seq))
+        query = query.order_by('seq', direction=self.db.DESCENDING).limit(limit)
+
+        lines = []
+        async for doc in query.stream():
+            lines.append(doc.to_dict())
+        lines.reverse()
+        next_cursor = lines[0]["seq"] if len(lines) == limit else None
+        return lines, next_cursor
+
     # --- ECONOMY / SCRATCH ---
 
     async def get_user_balance(self, user_id: str) -> int:
@@ -150,7 +1484,7 @@ class PersistenceLayer:
         transaction = self.db.transaction()
         ref = self.users_collection.document(str(user_id))
 
-        @firestore.async_transactional
+        @self.db.transactional
         async def _adjust_txn(transaction, ref):
             snapshot = await ref.get(transaction=transaction)
             
@@ -177,7 +1511,7 @@ class PersistenceLayer:
         transaction = self.db.transaction()
         ref = self.users_collection.document(str(user_id))
 
-        @firestore.async_transactional
+        @self.db.transactional
         async def _top_up_txn(transaction, ref):
             snapshot = await ref.get(transaction=transaction)
             
@@ -202,7 +1536,7 @@ class PersistenceLayer:
         transaction = self.db.transaction()
         ref = self.users_collection.document(str(user_id))
 
-        @firestore.async_transactional
+        @self.db.transactional
         async def _deduct_txn(transaction, ref):
             snapshot = await ref.get(transaction=transaction)
             if not snapshot.exists:
@@ -1,37 +1,81 @@
-from fastapi import APIRouter, Request
-from fastapi.responses import HTMLResponse
+import datetime
+from typing import Optional, Tuple
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from .. import persistence
 
 router = APIRouter(tags=["dashboard"])
 templates = Jinja2Templates(directory="app/templates") # We need to create this dir
 
+GAMES_PAGE_SIZE = 20
+LOGS_PAGE_SIZE = 25
+
+def _parse_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime.datetime, str]]:
+    """Cursors are "<timestamp>|<document id>" of the last row on the previous page."""
+    if not cursor:
+        return None
+    value, _, doc_id = cursor.partition("|")
+    try:
+        return datetime.datetime.fromisoformat(value), doc_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _format_cursor(cursor) -> Optional[str]:
+    if not cursor or not isinstance(cursor[0], datetime.datetime):
+        return None
+    return f"{cursor[0].isoformat()}|{cursor[1]}"
+
 @router.get("/dashboard", response_class=HTMLResponse)
-async def dashboard_index(request: Request):
-    # Fetch active games first
-    games = []
-    # Note: You might need to add a proper query to persistence for "recent games"
-    # For now, let's assume we scan active ones or top 20 recent
-    ref = persistence.db.games_collection.order_by('created_at', direction='DESCENDING').limit(20)
-    async for doc in ref.stream():
-        games.append(doc.to_dict())
-    
+async def dashboard_index(request: Request, before: Optional[str] = None):
+    games, next_cursor = await persistence.db.list_games(limit=GAMES_PAGE_SIZE, before=_parse_cursor(before))
+
     return templates.TemplateResponse(
-        request=request, 
-        name="index.html.j2", 
-        context={"games": games}
+        request=request,
+        name="index.html.j2",
+        context={"games": games, "next_cursor": _format_cursor(next_cursor)}
     )
 
 @router.get("/dashboard/{game_id}", response_class=HTMLResponse)
-async def dashboard_game(request: Request, game_id: str):
+async def dashboard_game(request: Request, game_id: str, logs_before: Optional[str] = None):
     game = await persistence.db.get_game_by_id(game_id)
-    logs = await persistence.db.get_game_logs(game_id)
-    
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
+    cursor = _parse_cursor(logs_before)
+
+    # Compacted games are opened from their archive on demand
+    archived = await persistence.db.open_archive(game_id) if game.archive else None
+    if archived:
+        game_data = archived["game"]
+        # The archive is already in memory with prompts expanded, so it is paged in place
+        newest_first = sorted(archived["ai_logs"], key=lambda log: (log["timestamp"], log["id"]), reverse=True)
+        older = [log for log in newest_first if cursor is None or (log["timestamp"], log["id"]) < cursor]
+        logs = older[:LOGS_PAGE_SIZE]
+        next_cursor = (logs[-1]["timestamp"], logs[-1]["id"]) if len(older) > LOGS_PAGE_SIZE else None
+        blackbox = archived["log_streams"].get("blackbox_logs", [])
+    else:
+        game_data = game.model_dump()
+        # Prompts are fetched per row when expanded (see dashboard_log_prompt)
+        logs, next_cursor = await persistence.db.get_game_log_page(game_id, limit=LOGS_PAGE_SIZE, before=cursor)
+        # Archived stream first; games that predate the archive only have the in-document window
+        blackbox, _ = await persistence.db.get_log_stream(game_id, "blackbox_logs", limit=500)
+    blackbox_logs = [entry.get("line") for entry in blackbox] or game_data["metadata"].get("blackbox_logs", [])
+
     return templates.TemplateResponse(
-        request=request, 
-        name="game_detail.html.j2", 
+        request=request,
+        name="game_detail.html.j2",
         context={
-            "game": game.model_dump(), 
-            "logs": logs
+            "game": game_data,
+            "logs": logs,
+            "next_logs_cursor": _format_cursor(next_cursor),
+            "blackbox_logs": blackbox_logs,
+            "archived": archived is not None
         }
-    )
\ No newline at end of file
+    )
+
+@router.get("/dashboard/{game_id}/logs/{log_id}/prompt", response_class=PlainTextResponse)
+async def dashboard_log_prompt(game_id: str, log_id: str):
+    prompt = await persistence.db.get_log_prompt(game_id, log_id)
+    if prompt is None:
+        raise HTTPException(status_code=404, detail="Log not found")
+    return prompt
@@ -126,7 +126,7 @@ async def handle_interaction(payload: InteractionPayload):
             
     elif payload.custom_id.startswith("end_delete_btn_"):
         game_id = payload.custom_id.replace("end_delete_btn_", "")
-        game = await persistence.db.get_game_by_id(game_id)
+        game = await persistence.db.get_game_header(game_id)
         if game:
             if game.host_id != payload.user_id:
                 return {"status": "denied"}
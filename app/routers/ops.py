@@ -4,6 +4,9 @@ import logging
 
 from .. import persistence
 from .. import config
+from .. import io_stats
+from .. import game_engine
+from .. import ai_engine
 
 async def verify_ops_auth(x_ops_key: str = Header(...)):
     """
@@ -41,3 +44,20 @@ async def top_up(payload: GiftPayload):
     except Exception as e:
         logging.error(f"Ops Gift Failed: {e}")
         raise HTTPException(status_code=500, detail="Transaction failed")
+
+@router.get("/metrics")
+async def metrics():
+    """
+    Persistence I/O since this instance started: latency histograms, documents and
+    approximate bytes per PersistenceLayer method and per request/task route.
+    """
+    return {
+        **io_stats.stats.snapshot(),
+        "game_cache": persistence.db.game_cache.stats(),
+        "ai_log_writer": persistence.db.log_writer.stats(),
+        "channel_index": persistence.db.channel_index.stats(),
+        "task_rebase": dict(game_engine.engine.rebase_stats),
+        "model_pool": ai_engine.ai.models.stats(),
+        "ai_concurrency": {model: limiter.stats() for model, limiter in ai_engine.ai.limiters.items()},
+        "ai_context_cache": ai_engine.ai.prompt_cache.stats()
+    }
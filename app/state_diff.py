@@ -0,0 +1,322 @@
+import copy
+import fnmatch
+from typing import Any, Dict, List, Optional, Tuple
+
+from .storage.base import estimate_size
+
+# Characters Firestore refuses in an unquoted dot-notation path segment
+_UNSAFE_KEY_CHARS = set(".~*/[]`")
+
+def _is_safe_key(key: Any) -> bool:
+    return isinstance(key, str) and bool(key) and not (_UNSAFE_KEY_CHARS & set(key))
+
+def _join(prefix: str, key: str) -> str:
+    return f"{prefix}.{key}" if prefix else key
+
+def _is_union_safe(before: List[Any], added: List[Any]) -> bool:
+    """
+    ArrayUnion de-duplicates, so an append can only be sent as a union when none of
+    the new items already exist in the list (or repeat among themselves).
+    """
+    seen = list(before)
+    for item in added:
+        if item in seen:
+            return False
+        seen.append(item)
+    return True
+
+class MetadataDiff:
+    """
+    Dot-notation changes between two versions of a cartridge metadata dict.
+    - sets: path -> new value (replaces whatever is stored at that path)
+    - appends: path -> items appended to a list that otherwise did not change
+    - deletes: paths of keys that no longer exist
+    """
+    def __init__(self):
+        self.sets: Dict[str, Any] = {}
+        self.appends: Dict[str, List[Any]] = {}
+        self.deletes: List[str] = []
+
+    def __len__(self):
+        return len(self.sets) + len(self.appends) + len(self.deletes)
+
+    @property
+    def paths(self) -> List[str]:
+        return list(self.sets) + list(self.appends) + list(self.deletes)
+
+    @classmethod
+    def from_fields(cls, patch: Dict[str, Any]) -> "MetadataDiff":
+        """Wraps a dot-notation field patch."""
+        result = cls()
+        result.sets = dict(patch)
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"sets": self.sets, "appends": self.appends, "deletes": self.deletes}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MetadataDiff":
+        result = cls()
+        result.sets = dict(data.get("sets", {}))
+        result.appends = dict(data.get("appends", {}))
+        result.deletes = list(data.get("deletes", []))
+        return result
+
+    def apply_to(self, target: dict):
+        """Applies the diff in place to a plain metadata dict (used to refresh cached copies)."""
+        for path, value in self.sets.items():
+            if not path:
+                # The whole map was replaced
+                target.clear()
+                target.update(copy.deepcopy(value))
+                continue
+            parent, key = _walk(target, path, create=True)
+            parent[key] = copy.deepcopy(value)
+        for path, items in self.appends.items():
+            parent, key = _walk(target, path, create=True)
+            parent.setdefault(key, []).extend(copy.deepcopy(items))
+        for path in self.deletes:
+            parent, key = _walk(target, path, create=False)
+            if parent is not None:
+                parent.pop(key, None)
+
+def _walk(target: dict, path: str, create: bool):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        nxt = target.get(part)
+        if not isinstance(nxt, dict):
+            if not create:
+                return None, parts[-1]
+            nxt = {}
+            target[part] = nxt
+        target = nxt
+    return target, parts[-1]
+
+def diff_metadata(before: Dict[str, Any], after: Dict[str, Any]) -> MetadataDiff:
+    """Computes the minimal set of dot-notation writes that turn `before` into `after`."""
+    result = MetadataDiff()
+    _diff_into(result, before or {}, after or {}, "")
+    return result
+
+def _diff_into(result: MetadataDiff, before: Any, after: Any, path: str):
+    if isinstance(before, dict) and isinstance(after, dict):
+        keys = set(before) | set(after)
+        if not all(_is_safe_key(k) for k in keys):
+            # Keys we cannot address individually: rewrite the whole map
+            if before != after:
+                result.sets[path] = after
+            return
+        for key in after:
+            child = _join(path, key)
+            if key not in before:
+                result.sets[child] = after[key]
+            else:
+                _diff_into(result, before[key], after[key], child)
+        for key in before:
+            if key not in after:
+                result.deletes.append(_join(path, key))
+        return
+
+    if isinstance(before, list) and isinstance(after, list):
+        if before == after:
+            return
+        grew = len(after) > len(before) and after[:len(before)] == before
+        if grew and path and _is_union_safe(before, after[len(before):]):
+            result.appends[path] = after[len(before):]
+        else:
+            result.sets[path] = after
+        return
+
+    if before != after or type(before) is not type(after):
+        result.sets[path] = after
+
+def estimate_size_after(before: Dict[str, Any], diff: MetadataDiff) -> int:
+    """Approximate stored size of `before` with `diff` applied, without building the result."""
+    before = before or {}
+    size = estimate_size(before)
+    for path, value in diff.sets.items():
+        if not path:
+            size = estimate_size(value)
+            continue
+        old = get_path(before, path)
+        key_bytes = len(path.rpartition(".")[2].encode("utf-8")) + 1
+        size += estimate_size(value) - (estimate_size(old) if old is not None else -key_bytes)
+    for items in diff.appends.values():
+        size += estimate_size(items)
+    for path in diff.deletes:
+        old = get_path(before, path)
+        if old is not None:
+            size -= estimate_size(old) + len(path.rpartition(".")[2].encode("utf-8")) + 1
+    return size
+
+
+# --- LOG STREAMS ---
+
+def get_path(node: Any, path: str) -> Any:
+    """Reads a dot-notation path from nested dicts, returning None when any segment is missing."""
+    for part in path.split("."):
+        if not isinstance(node, dict) or part not in node:
+            return None
+        node = node[part]
+    return node
+
+def apply_dotted_patch(base: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns a copy of `base` with a dot-notation field patch applied."""
+    result = copy.deepcopy(base or {})
+    for path, value in patch.items():
+        parent, key = _walk(result, path, create=True)
+        parent[key] = copy.deepcopy(value)
+    return result
+
+def _expand(parts: List[str], node: Any, prefix: str) -> List[str]:
+    """Expands a stream pattern such as 'drones.*.night_chat_log' against the keys present in `node`."""
+    if not parts:
+        return [prefix]
+    if not isinstance(node, dict):
+        return []
+    head, rest = parts[0], parts[1:]
+    keys = [k for k in node if fnmatch.fnmatchcase(str(k), head)]
+    paths = []
+    for key in keys:
+        paths.extend(_expand(rest, node[key], _join(prefix, key)))
+    return paths
+
+def split_log_streams(
+    before: Dict[str, Any],
+    after: Dict[str, Any],
+    streams: Dict[str, Optional[int]]
+) -> Tuple[Dict[str, Any], List[Tuple[str, List[Any]]]]:
+    """
+    Separates the lines each log stream gained between `before` and `after` so they
+    can be archived append-only, and trims every stream in a copy of `after` to its
+    document window (None keeps the whole list in the document).
+    Returns (trimmed_after, [(stream_path, new_lines), ...]).
+    """
+    trimmed = copy.deepcopy(after or {})
+    new_lines = []
+    for pattern, window in streams.items():
+        for path in _expand(pattern.split("."), trimmed, ""):
+            current = get_path(trimmed, path)
+            if not isinstance(current, list):
+                continue
+            previous = get_path(before or {}, path)
+            previous = previous if isinstance(previous, list) else []
+
+            if window and len(previous) > window:
+                # Stored before the stream was windowed, so none of it has been archived yet
+                added = current
+            elif current[:len(previous)] == previous:
+                added = current[len(previous):]
+            else:
+                # Rewritten (e.g. falsified or cleared): archive whatever is now present
+                added = current
+            if added:
+                new_lines.append((path, list(added)))
+
+            if window and len(current) > window:
+                parent, key = _walk(trimmed, path, create=False)
+                parent[key] = current[-window:]
+    return trimmed, new_lines
+
+
+# --- REBASE ---
+
+def path_within(path: str, pattern: str) -> bool:
+    """True when `path` is the pattern's path or lies beneath it (segments may use wildcards)."""
+    parts, heads = path.split("."), pattern.split(".")
+    if not path or len(parts) < len(heads):
+        return False
+    return all(fnmatch.fnmatchcase(part, head) for part, head in zip(parts, heads))
+
+def touches_any(paths: List[str], patterns: List[str]) -> bool:
+    """True when writing `paths` could change anything at or beneath one of the patterns."""
+    for path in paths:
+        if not path:
+            # The whole map
+            if patterns:
+                return True
+            continue
+        parts = path.split(".")
+        for pattern in patterns:
+            heads = pattern.split(".")
+            if all(fnmatch.fnmatchcase(part, head) for part, head in zip(parts, heads)):
+                return True
+    return False
+
+def _overlaps(a: str, b: str) -> bool:
+    if not a or not b or a == b:
+        return True
+    return a.startswith(b + ".") or b.startswith(a + ".")
+
+def rebase_metadata(
+    base: Dict[str, Any],
+    ours: Dict[str, Any],
+    latest: Dict[str, Any],
+    safe_paths: List[str]
+) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    Three-way merge of a result computed from `base` onto the `latest` stored metadata.
+    Concurrent changes must stay within `safe_paths` and must not touch anything `ours`
+    changed, except lists both sides appended to, which are concatenated (latest first).
+    Returns (merged, []) or (None, conflicting_paths).
+    """
+    our_diff = diff_metadata(base, ours)
+    their_diff = diff_metadata(base, latest)
+
+    conflicts = []
+    for their_path in their_diff.paths:
+        if not any(path_within(their_path, pattern) for pattern in safe_paths):
+            conflicts.append(their_path)
+            continue
+        for our_path in our_diff.paths:
+            if not _overlaps(their_path, our_path):
+                continue
+            if their_path == our_path and their_path in their_diff.appends and our_path in our_diff.appends:
+                continue
+            if their_path == our_path and their_path in their_diff.sets and our_diff.sets.get(our_path, object()) == their_diff.sets[their_path]:
+                continue
+            conflicts.append(their_path)
+            break
+    if conflicts:
+        return None, conflicts
+
+    merged = copy.deepcopy(latest or {})
+    our_diff.apply_to(merged)
+    return merged, []
+
+def stream_lists(metadata: Dict[str, Any], streams: Dict[str, Optional[int]]) -> Dict[str, List[Any]]:
+    """Maps every concrete path the stream patterns match in `metadata` to its list of lines."""
+    lists = {}
+    for pattern in streams:
+        for path in _expand(pattern.split("."), metadata or {}, ""):
+            lines = get_path(metadata, path)
+            if isinstance(lines, list):
+                lists[path] = lines
+    return lists
+
+def offload_log_streams(
+    metadata: Dict[str, Any],
+    streams: Dict[str, Optional[int]],
+    target_bytes: int
+) -> Tuple[Dict[str, Any], int]:
+    """
+    Drops the oldest lines of the largest log streams until `metadata` is estimated
+    at or under `target_bytes`. Callers archive the dropped lines first when the stream
+    may not hold them yet. Returns (trimmed_copy, lines_dropped).
+    """
+    trimmed = copy.deepcopy(metadata or {})
+    size = estimate_size(trimmed)
+    paths = [path for pattern in streams for path in _expand(pattern.split("."), trimmed, "")]
+    dropped = 0
+    while size > target_bytes:
+        lists = [(estimate_size(lines), path) for path in paths for lines in [get_path(trimmed, path)] if isinstance(lines, list) and lines]
+        if not lists:
+            break
+        _, path = max(lists)
+        current = get_path(trimmed, path)
+        cut = max(1, len(current) // 2)
+        size -= estimate_size(current[:cut])
+        parent, key = _walk(trimmed, path, create=False)
+        parent[key] = current[cut:]
+        dropped += cut
+    return trimmed, dropped
@@ -0,0 +1,23 @@
+"""
+Storage backends for PersistenceLayer.
+
+Every backend exposes the same document-store surface (collection / document refs,
+batches, optimistic transactions, get_all, simple queries) plus the write sentinels
+and query constants as attributes, so persistence code never imports a client directly.
+"""
+from .base import StorageError, NotFound, AlreadyExists, Contention
+from .instrumented import InstrumentedBackend
+
+def create_backend(kind: str, **options):
+    """Builds the backend named by STORAGE_BACKEND. Imports are lazy so local backends need no cloud SDK."""
+    kind = (kind or "firestore").lower()
+    if kind == "firestore":
+        from .firestore_backend import FirestoreBackend
+        return FirestoreBackend(database=options.get("database", "sandbox"))
+    if kind == "sqlite":
+        from .sqlite_backend import SQLiteBackend
+        return SQLiteBackend(options.get("path", "cscratch.sqlite3"))
+    if kind == "memory":
+        from .memory_backend import MemoryBackend
+        return MemoryBackend()
+    raise ValueError(f"Unknown storage backend: {kind}")
@@ -0,0 +1,97 @@
+import base64
+import datetime
+import json
+from typing import Any, List, NamedTuple
+
+# --- ERRORS ---
+
+class StorageError(Exception):
+    pass
+
+class NotFound(StorageError):
+    """update() on a document that does not exist."""
+
+class AlreadyExists(StorageError):
+    """create() on a document that already exists."""
+
+class Contention(StorageError):
+    """A transaction kept losing to concurrent writers and gave up."""
+
+# --- WRITE SENTINELS ---
+# Backend-neutral equivalents of the Firestore transforms. They are only honoured
+# as top-level values of set()/update() payloads, which is how PersistenceLayer uses them.
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+class ArrayUnion:
+    def __init__(self, values: List[Any]):
+        self.values = list(values)
+
+class _Sentinel:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+DELETE_FIELD = _Sentinel("DELETE_FIELD")
+SERVER_TIMESTAMP = _Sentinel("SERVER_TIMESTAMP")
+
+class FieldFilter(NamedTuple):
+    field_path: str
+    op_string: str
+    value: Any
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+# Field path of the document id, for order_by() tie-breakers and start_after() cursors
+DOCUMENT_ID = "__name__"
+
+# --- ENCODING ---
+# JSON with tagged datetimes and bytes, for backends that persist documents as text
+
+def _encode_default(value):
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"Cannot store value of type {type(value).__name__}")
+
+def _decode_hook(obj):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.datetime.fromisoformat(obj["__datetime__"])
+        if "__bytes__" in obj:
+            return base64.b64decode(obj["__bytes__"])
+    return obj
+
+def encode_document(data: dict) -> str:
+    return json.dumps(data, default=_encode_default, separators=(",", ":"))
+
+def decode_document(text: str) -> dict:
+    return json.loads(text, object_hook=_decode_hook)
+
+# --- SIZE ESTIMATION ---
+# Firestore storage size rules: strings are UTF-8 bytes + 1, numbers, timestamps and
+# sentinels 8, booleans and null 1, map keys are sized like strings, plus 32 per document.
+
+DOCUMENT_OVERHEAD_BYTES = 32
+
+def estimate_size(value: Any) -> int:
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode("utf-8")) + 1
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(key).encode("utf-8")) + 1 + estimate_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(item) for item in value)
+    return 8
+
+def document_size(data: dict) -> int:
+    return estimate_size(data or {}) + DOCUMENT_OVERHEAD_BYTES
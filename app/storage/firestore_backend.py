@@ -0,0 +1,40 @@
+from google.cloud import firestore
+
+class FirestoreBackend:
+    """
+    Cloud Firestore through the async client. The storage interface is the subset
+    of the client surface PersistenceLayer uses, so calls pass straight through.
+    """
+    name = "firestore"
+    supports_listeners = True
+
+    Increment = firestore.Increment
+    ArrayUnion = firestore.ArrayUnion
+    DELETE_FIELD = firestore.DELETE_FIELD
+    SERVER_TIMESTAMP = firestore.SERVER_TIMESTAMP
+    FieldFilter = firestore.FieldFilter
+    ASCENDING = firestore.Query.ASCENDING
+    DESCENDING = firestore.Query.DESCENDING
+    DOCUMENT_ID = firestore.FieldPath.document_id()
+
+    def __init__(self, database: str):
+        self.database = database
+        self.client = firestore.AsyncClient(database=database)
+
+    def collection(self, collection_id: str):
+        return self.client.collection(collection_id)
+
+    def batch(self):
+        return self.client.batch()
+
+    def transaction(self):
+        return self.client.transaction()
+
+    def transactional(self, fn):
+        return firestore.async_transactional(fn)
+
+    def get_all(self, references, field_paths=None):
+        return self.client.get_all(references, field_paths=field_paths)
+
+    def close(self):
+        self.client.close()
@@ -0,0 +1,144 @@
+from typing import Any, Callable, Optional
+
+from .base import document_size
+
+# recorder(reads, writes, bytes_read, bytes_written)
+Recorder = Callable[[int, int, int, int], None]
+
+def _unwrap(value: Any) -> Any:
+    return getattr(value, "_inner", value)
+
+def _snapshot_size(snapshot) -> int:
+    if not snapshot.exists:
+        return 0
+    # Both Firestore and local snapshots keep their data in _data; to_dict() would deep copy it
+    data = getattr(snapshot, "_data", None)
+    return document_size(data if isinstance(data, dict) else snapshot.to_dict())
+
+
+class _Tracked:
+    def __init__(self, inner: Any, record: Recorder):
+        self._inner = inner
+        self._record = record
+
+    def __getattr__(self, name: str):
+        return getattr(self._inner, name)
+
+    def _read(self, snapshot):
+        self._record(1, 0, _snapshot_size(snapshot), 0)
+        return snapshot
+
+
+class TrackedDocument(_Tracked):
+    async def get(self, field_paths=None, transaction=None):
+        snapshot = await self._inner.get(field_paths=field_paths, transaction=_unwrap(transaction))
+        return self._read(snapshot)
+
+    async def set(self, data: dict, merge: bool = False):
+        self._record(0, 1, 0, document_size(data))
+        return await self._inner.set(data, merge=merge)
+
+    async def create(self, data: dict):
+        self._record(0, 1, 0, document_size(data))
+        return await self._inner.create(data)
+
+    async def update(self, fields: dict):
+        self._record(0, 1, 0, document_size(fields))
+        return await self._inner.update(fields)
+
+    async def delete(self):
+        self._record(0, 1, 0, 0)
+        return await self._inner.delete()
+
+    def collection(self, collection_id: str) -> "TrackedCollection":
+        return TrackedCollection(self._inner.collection(collection_id), self._record)
+
+
+class TrackedQuery(_Tracked):
+    def _wrap(self, query) -> "TrackedQuery":
+        return TrackedQuery(query, self._record)
+
+    def where(self, *args, **kwargs):
+        return self._wrap(self._inner.where(*args, **kwargs))
+
+    def order_by(self, *args, **kwargs):
+        return self._wrap(self._inner.order_by(*args, **kwargs))
+
+    def limit(self, count: int):
+        return self._wrap(self._inner.limit(count))
+
+    def select(self, field_paths):
+        return self._wrap(self._inner.select(field_paths))
+
+    def start_after(self, values):
+        return self._wrap(self._inner.start_after(values))
+
+    async def stream(self):
+        async for snapshot in self._inner.stream():
+            yield self._read(snapshot)
+
+    async def get(self):
+        return [self._read(snapshot) for snapshot in await self._inner.get()]
+
+
+class TrackedCollection(TrackedQuery):
+    def document(self, document_id: Optional[str] = None) -> TrackedDocument:
+        inner = self._inner.document(document_id) if document_id else self._inner.document()
+        return TrackedDocument(inner, self._record)
+
+    async def add(self, data: dict):
+        self._record(0, 1, 0, document_size(data))
+        stamp, ref = await self._inner.add(data)
+        return stamp, TrackedDocument(ref, self._record)
+
+    async def list_documents(self):
+        async for ref in self._inner.list_documents():
+            yield TrackedDocument(ref, self._record)
+
+
+class TrackedWriter(_Tracked):
+    """Batch or transaction: writes are counted as they are staged."""
+    def set(self, reference, data: dict, merge: bool = False):
+        self._record(0, 1, 0, document_size(data))
+        return self._inner.set(_unwrap(reference), data, merge=merge)
+
+    def create(self, reference, data: dict):
+        self._record(0, 1, 0, document_size(data))
+        return self._inner.create(_unwrap(reference), data)
+
+    def update(self, reference, fields: dict):
+        self._record(0, 1, 0, document_size(fields))
+        return self._inner.update(_unwrap(reference), fields)
+
+    def delete(self, reference):
+        self._record(0, 1, 0, 0)
+        return self._inner.delete(_unwrap(reference))
+
+
+class InstrumentedBackend(_Tracked):
+    """
+    Wraps any storage backend and reports each document read and write (with its
+    approximate stored size) to `record`. Listener and admin calls pass through uncounted.
+    """
+    def __init__(self, inner: Any, record: Recorder):
+        super().__init__(inner, record)
+
+    @property
+    def inner(self):
+        return self._inner
+
+    def collection(self, collection_id: str) -> TrackedCollection:
+        return TrackedCollection(self._inner.collection(collection_id), self._record)
+
+    def batch(self) -> TrackedWriter:
+        return TrackedWriter(self._inner.batch(), self._record)
+
+    def transactional(self, fn):
+        # The backend drives retries with its own transaction object; the body sees a counting view of it
+        async def _tracked(transaction, *args, **kwargs):
+            return await fn(TrackedWriter(transaction, self._record), *args, **kwargs)
+        return self._inner.transactional(_tracked)
+
+    async def get_all(self, references, field_paths=None):
+        async for snapshot in self._inner.get_all([_unwrap(ref) for ref in references], field_paths=field_paths):
+            yield self._read(snapshot)
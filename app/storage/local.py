@@ -0,0 +1,413 @@
+import copy
+import time
+import uuid
+import datetime
+import operator
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .base import (
+    ASCENDING, DESCENDING, DOCUMENT_ID, DELETE_FIELD, SERVER_TIMESTAMP,
+    AlreadyExists, ArrayUnion, Contention, FieldFilter, Increment, NotFound
+)
+
+def _ranged(compare: Callable[[Any, Any], bool]) -> Callable[[Any, Any], bool]:
+    """Like Firestore, range filters never match null: only values of the bound's type."""
+    return lambda field, value: field is not None and compare(field, value)
+
+_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": _ranged(operator.lt),
+    "<=": _ranged(operator.le),
+    ">": _ranged(operator.gt),
+    ">=": _ranged(operator.ge),
+    "in": lambda field, values: field in values,
+    "not-in": lambda field, values: field not in values,
+    "array_contains": lambda field, value: isinstance(field, list) and value in field,
+}
+
+_MISSING = object()
+
+def _split_path(path: str) -> Tuple[str, str]:
+    """'games/g1/state/current' -> ('games/g1/state', 'current')"""
+    collection, _, doc_id = path.rpartition("/")
+    return collection, doc_id
+
+def _get_field(data: dict, field_path: str) -> Any:
+    node = data
+    for part in field_path.split("."):
+        if not isinstance(node, dict) or part not in node:
+            return _MISSING
+        node = node[part]
+    return node
+
+def _order_value(path: str, data: dict, field_path: str) -> Any:
+    return _split_path(path)[1] if field_path == DOCUMENT_ID else _get_field(data, field_path)
+
+def _past_cursor(values: List[Any], cursor: List[Any], orders) -> bool:
+    """Whether a row's order values sort strictly after the start_after() cursor."""
+    for value, bound, (_, direction) in zip(values, cursor, orders):
+        if value != bound:
+            return value < bound if str(direction).upper() == DESCENDING else value > bound
+    return False
+
+def _resolve(value: Any, current: Any) -> Any:
+    if value is SERVER_TIMESTAMP:
+        return datetime.datetime.now(datetime.timezone.utc)
+    if isinstance(value, Increment):
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        return base + value.value
+    if isinstance(value, ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        for item in value.values:
+            if item not in result:
+                result.append(copy.deepcopy(item))
+        return result
+    return copy.deepcopy(value)
+
+def _apply_set(data: dict) -> dict:
+    return {key: _resolve(value, _MISSING) for key, value in data.items() if value is not DELETE_FIELD}
+
+def _apply_update(current: dict, fields: dict) -> dict:
+    """Applies a Firestore style dot-notation update to a copy of `current`."""
+    result = copy.deepcopy(current)
+    for field_path, value in fields.items():
+        parts = field_path.split(".")
+        parent = result
+        for part in parts[:-1]:
+            nxt = parent.get(part)
+            if not isinstance(nxt, dict):
+                if value is DELETE_FIELD:
+                    parent = None
+                    break
+                nxt = {}
+                parent[part] = nxt
+            parent = nxt
+        if parent is None:
+            continue
+        if value is DELETE_FIELD:
+            parent.pop(parts[-1], None)
+        else:
+            parent[parts[-1]] = _resolve(value, parent.get(parts[-1], _MISSING))
+    return result
+
+def _project(data: dict, field_paths: Optional[List[str]]) -> dict:
+    if field_paths is None:
+        return data
+    result = {}
+    for field_path in field_paths:
+        value = _get_field(data, field_path)
+        if value is _MISSING:
+            continue
+        parts = field_path.split(".")
+        node = result
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return result
+
+
+class LocalSnapshot:
+    def __init__(self, reference: "LocalDocumentReference", data: Optional[dict]):
+        self.reference = reference
+        self._data = data
+
+    @property
+    def id(self) -> str:
+        return self.reference.id
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[dict]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str) -> Any:
+        value = _get_field(self._data or {}, field_path)
+        return None if value is _MISSING else copy.deepcopy(value)
+
+
+class LocalDocumentReference:
+    def __init__(self, backend: "LocalBackend", path: str):
+        self._backend = backend
+        self.path = path
+
+    @property
+    def id(self) -> str:
+        return _split_path(self.path)[1]
+
+    @property
+    def parent(self) -> "LocalCollectionReference":
+        return LocalCollectionReference(self._backend, _split_path(self.path)[0])
+
+    def collection(self, collection_id: str) -> "LocalCollectionReference":
+        return LocalCollectionReference(self._backend, f"{self.path}/{collection_id}")
+
+    async def get(self, field_paths: Optional[List[str]] = None, transaction: "LocalTransaction" = None) -> LocalSnapshot:
+        stored = await self._backend._call(self._backend._read, self.path)
+        if transaction is not None:
+            transaction._record_read(self.path, stored[1] if stored else None)
+        data = _project(stored[0], field_paths) if stored else None
+        return LocalSnapshot(self, data)
+
+    async def set(self, data: dict, merge: bool = False):
+        if merge:
+            raise NotImplementedError("merge writes are not supported by local storage backends")
+        await self._backend._call(self._backend._commit, [("set", self.path, data)])
+
+    async def create(self, data: dict):
+        await self._backend._call(self._backend._commit, [("create", self.path, data)])
+
+    async def update(self, fields: dict):
+        await self._backend._call(self._backend._commit, [("update", self.path, fields)])
+
+    async def delete(self):
+        await self._backend._call(self._backend._commit, [("delete", self.path, None)])
+
+
+class LocalQuery:
+    def __init__(self, backend: "LocalBackend", collection_path: str, filters=(), orders=(), limit_count: Optional[int] = None,
+                 field_paths: Optional[List[str]] = None, cursor: Optional[Dict[str, Any]] = None):
+        self._backend = backend
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit_count
+        self._field_paths = field_paths
+        self._cursor = cursor
+
+    def _copy(self, **changes) -> "LocalQuery":
+        state = {"filters": self._filters, "orders": self._orders, "limit_count": self._limit,
+                 "field_paths": self._field_paths, "cursor": self._cursor}
+        state.update(changes)
+        return LocalQuery(self._backend, self._collection_path, **state)
+
+    def where(self, field_path: str = None, op_string: str = None, value: Any = None, *, filter: FieldFilter = None) -> "LocalQuery":
+        flt = filter if filter is not None else FieldFilter(field_path, op_string, value)
+        if flt.op_string not in _OPERATORS:
+            raise ValueError(f"Unsupported filter operator: {flt.op_string}")
+        return self._copy(filters=self._filters + (flt,))
+
+    def order_by(self, field_path: str, direction: str = ASCENDING) -> "LocalQuery":
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int) -> "LocalQuery":
+        return self._copy(limit_count=count)
+
+    def select(self, field_paths: List[str]) -> "LocalQuery":
+        return self._copy(field_paths=list(field_paths))
+
+    def start_after(self, values: Dict[str, Any]) -> "LocalQuery":
+        """values: {order field: value} of the last row seen (DOCUMENT_ID takes the id)."""
+        return self._copy(cursor=dict(values))
+
+    def _run(self) -> List[LocalSnapshot]:
+        rows = []
+        for path, data in self._backend._scan(self._collection_path):
+            keep = True
+            for flt in self._filters:
+                field = _get_field(data, flt.field_path)
+                if field is _MISSING or not _OPERATORS[flt.op_string](field, flt.value):
+                    keep = False
+                    break
+            # Like Firestore, ordering on a field excludes documents that lack it
+            if keep and all(_order_value(path, data, field) is not _MISSING for field, _ in self._orders):
+                rows.append((path, data))
+
+        if self._cursor is not None:
+            cursor = [self._cursor[field] for field, _ in self._orders]
+            rows = [row for row in rows if _past_cursor([_order_value(row[0], row[1], field) for field, _ in self._orders], cursor, self._orders)]
+
+        # Stable sorts applied from the last key to the first give a multi-key order
+        for field, direction in reversed(self._orders):
+            rows.sort(key=lambda row: _order_value(row[0], row[1], field), reverse=str(direction).upper() == DESCENDING)
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return [LocalSnapshot(LocalDocumentReference(self._backend, path), _project(data, self._field_paths)) for path, data in rows]
+
+    async def stream(self):
+        for snapshot in await self._backend._call(self._run):
+            yield snapshot
+
+    async def get(self) -> List[LocalSnapshot]:
+        return await self._backend._call(self._run)
+
+
+class LocalCollectionReference(LocalQuery):
+    def __init__(self, backend: "LocalBackend", path: str):
+        super().__init__(backend, path)
+        self.path = path
+
+    @property
+    def id(self) -> str:
+        return self.path.rpartition("/")[2]
+
+    def document(self, document_id: Optional[str] = None) -> LocalDocumentReference:
+        return LocalDocumentReference(self._backend, f"{self.path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    async def list_documents(self):
+        """Every document id in the collection, including parents that only hold subcollections."""
+        for doc_id in sorted(await self._backend._call(self._backend._list_ids, self.path)):
+            yield self.document(doc_id)
+
+    async def add(self, data: dict):
+        ref = self.document()
+        await ref.set(data)
+        return datetime.datetime.now(datetime.timezone.utc), ref
+
+
+class LocalWriteBatch:
+    def __init__(self, backend: "LocalBackend"):
+        self._backend = backend
+        self._ops: List[Tuple[str, str, Any]] = []
+
+    def set(self, reference: LocalDocumentReference, data: dict, merge: bool = False):
+        if merge:
+            raise NotImplementedError("merge writes are not supported by local storage backends")
+        self._ops.append(("set", reference.path, data))
+
+    def create(self, reference: LocalDocumentReference, data: dict):
+        self._ops.append(("create", reference.path, data))
+
+    def update(self, reference: LocalDocumentReference, fields: dict):
+        self._ops.append(("update", reference.path, fields))
+
+    def delete(self, reference: LocalDocumentReference):
+        self._ops.append(("delete", reference.path, None))
+
+    async def commit(self):
+        ops, self._ops = self._ops, []
+        await self._backend._call(self._backend._commit, ops)
+
+
+class LocalTransaction(LocalWriteBatch):
+    """Optimistic transaction: reads record document revisions, commit fails if any moved."""
+    def __init__(self, backend: "LocalBackend"):
+        super().__init__(backend)
+        self._reads: Dict[str, Optional[int]] = {}
+
+    def _record_read(self, path: str, revision: Optional[int]):
+        self._reads.setdefault(path, revision)
+
+    def _reset(self):
+        self._ops = []
+        self._reads = {}
+
+
+class LocalBackend:
+    """
+    Document store with the Firestore client surface PersistenceLayer relies on
+    (collections, documents, batches, optimistic transactions, simple queries).
+    Subclasses only provide raw storage of (data, revision) pairs. All writes go
+    through _commit, which applies a list of operations all-or-nothing.
+    Every storage call goes through _call, which runs it inline: in memory they are cheap
+    enough for the event loop. Backends doing real I/O override _call to move it off the loop.
+    """
+    supports_listeners = False
+    max_transaction_attempts = 5
+
+    Increment = Increment
+    ArrayUnion = ArrayUnion
+    DELETE_FIELD = DELETE_FIELD
+    SERVER_TIMESTAMP = SERVER_TIMESTAMP
+    FieldFilter = FieldFilter
+    ASCENDING = ASCENDING
+    DESCENDING = DESCENDING
+    DOCUMENT_ID = DOCUMENT_ID
+
+    # --- Raw storage, implemented by subclasses ---
+
+    def _read(self, path: str) -> Optional[Tuple[dict, int]]:
+        raise NotImplementedError
+
+    def _scan(self, collection_path: str) -> Iterable[Tuple[str, dict]]:
+        raise NotImplementedError
+
+    def _list_ids(self, collection_path: str) -> Iterable[str]:
+        raise NotImplementedError
+
+    def _atomic(self):
+        """Context manager making the reads and writes of one commit atomic."""
+        raise NotImplementedError
+
+    def _put(self, path: str, data: dict, revision: int):
+        raise NotImplementedError
+
+    def _remove(self, path: str):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    async def _call(self, fn: Callable[..., Any], *args) -> Any:
+        return fn(*args)
+
+    # --- Client surface ---
+
+    def collection(self, collection_id: str) -> LocalCollectionReference:
+        return LocalCollectionReference(self, collection_id)
+
+    def batch(self) -> LocalWriteBatch:
+        return LocalWriteBatch(self)
+
+    def transaction(self) -> LocalTransaction:
+        return LocalTransaction(self)
+
+    def transactional(self, fn):
+        """Counterpart of firestore.async_transactional: reruns `fn` when a read document changed before commit."""
+        async def _run(transaction: LocalTransaction, *args, **kwargs):
+            for _ in range(self.max_transaction_attempts):
+                transaction._reset()
+                result = await fn(transaction, *args, **kwargs)
+                try:
+                    await self._call(self._commit, transaction._ops, transaction._reads)
+                    return result
+                except Contention:
+                    continue
+            raise Contention(f"Transaction gave up after {self.max_transaction_attempts} attempts")
+        return _run
+
+    async def get_all(self, references: List[LocalDocumentReference], field_paths: Optional[List[str]] = None):
+        for reference in references:
+            yield await reference.get(field_paths=field_paths)
+
+    # --- Commit pipeline ---
+
+    @staticmethod
+    def _next_revision(current: Optional[int]) -> int:
+        # Time based so a deleted and recreated document never reuses a revision
+        return max(time.time_ns(), (current or 0) + 1)
+
+    def _commit(self, ops: List[Tuple[str, str, Any]], expected: Optional[Dict[str, Optional[int]]] = None):
+        with self._atomic():
+            for path, revision in (expected or {}).items():
+                stored = self._read(path)
+                if (stored[1] if stored else None) != revision:
+                    raise Contention(path)
+
+            # Stage every write first so a failing op leaves nothing applied
+            changes: Dict[str, Optional[Tuple[dict, int]]] = {}
+            for kind, path, payload in ops:
+                current = changes[path] if path in changes else self._read(path)
+                revision = self._next_revision(current[1] if current else None)
+                if kind == "delete":
+                    changes[path] = None
+                elif kind == "create":
+                    if current is not None:
+                        raise AlreadyExists(path)
+                    changes[path] = (_apply_set(payload), revision)
+                elif kind == "set":
+                    changes[path] = (_apply_set(payload), revision)
+                elif kind == "update":
+                    if current is None:
+                        raise NotFound(path)
+                    changes[path] = (_apply_update(current[0], payload), revision)
+                else:
+                    raise ValueError(f"Unknown write: {kind}")
+
+            for path, change in changes.items():
+                if change is None:
+                    self._remove(path)
+                else:
+                    self._put(path, *change)
@@ -0,0 +1,43 @@
+import contextlib
+from typing import Dict, Iterable, Optional, Tuple
+
+from .local import LocalBackend, _split_path
+
+class MemoryBackend(LocalBackend):
+    """
+    Process-local document store for tests and benchmarks. Commits run without
+    yielding to the event loop, so each one is atomic with respect to every other
+    coroutine; transactions get Firestore's optimistic retry semantics on top.
+    """
+    name = "memory"
+
+    def __init__(self):
+        # collection path -> document id -> (data, revision)
+        self._collections: Dict[str, Dict[str, Tuple[dict, int]]] = {}
+
+    def _read(self, path: str) -> Optional[Tuple[dict, int]]:
+        collection, doc_id = _split_path(path)
+        return self._collections.get(collection, {}).get(doc_id)
+
+    def _scan(self, collection_path: str) -> Iterable[Tuple[str, dict]]:
+        docs = self._collections.get(collection_path, {})
+        return [(f"{collection_path}/{doc_id}", data) for doc_id, (data, _) in docs.items()]
+
+    def _list_ids(self, collection_path: str) -> Iterable[str]:
+        ids = set(self._collections.get(collection_path, {}))
+        prefix = f"{collection_path}/"
+        for path, docs in self._collections.items():
+            if path.startswith(prefix) and docs:
+                ids.add(path[len(prefix):].split("/", 1)[0])
+        return ids
+
+    def _atomic(self):
+        return contextlib.nullcontext()
+
+    def _put(self, path: str, data: dict, revision: int):
+        collection, doc_id = _split_path(path)
+        self._collections.setdefault(collection, {})[doc_id] = (data, revision)
+
+    def _remove(self, path: str):
+        collection, doc_id = _split_path(path)
+        self._collections.get(collection, {}).pop(doc_id, None)
@@ -0,0 +1,86 @@
+import asyncio
+import functools
+import contextlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Optional, Tuple
+
+from .base import decode_document, encode_document
+from .local import LocalBackend, _split_path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    collection TEXT NOT NULL,
+    data TEXT NOT NULL,
+    revision INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_by_collection ON documents (collection);
+"""
+
+class SQLiteBackend(LocalBackend):
+    """
+    Single-file document store for local benchmarks and single-node deployments.
+    Runs in WAL mode so readers never block the writer; every commit runs inside
+    BEGIN IMMEDIATE, which serialises writers across processes sharing the file.
+    The connection is only used from one dedicated thread: queries, fsyncs and waits on
+    the busy timeout block that thread instead of the event loop, and never interleave.
+    """
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        # Autocommit mode: transactions are opened explicitly in _atomic
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    async def _call(self, fn: Callable[..., Any], *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args))
+
+    def _read(self, path: str) -> Optional[Tuple[dict, int]]:
+        row = self._conn.execute("SELECT data, revision FROM documents WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        return decode_document(row[0]), row[1]
+
+    def _scan(self, collection_path: str) -> Iterable[Tuple[str, dict]]:
+        rows = self._conn.execute("SELECT path, data FROM documents WHERE collection = ?", (collection_path,))
+        return [(path, decode_document(data)) for path, data in rows]
+
+    def _list_ids(self, collection_path: str) -> Iterable[str]:
+        ids = {_split_path(path)[1] for (path,) in self._conn.execute(
+            "SELECT path FROM documents WHERE collection = ?", (collection_path,)
+        )}
+        prefix = f"{collection_path}/"
+        rows = self._conn.execute(
+            "SELECT DISTINCT collection FROM documents WHERE substr(collection, 1, ?) = ?", (len(prefix), prefix)
+        )
+        ids.update(collection[len(prefix):].split("/", 1)[0] for (collection,) in rows)
+        return ids
+
+    @contextlib.contextmanager
+    def _atomic(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _put(self, path: str, data: dict, revision: int):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO documents (path, collection, data, revision) VALUES (?, ?, ?, ?)",
+            (path, _split_path(path)[0], encode_document(data), revision)
+        )
+
+    def _remove(self, path: str):
+        self._conn.execute("DELETE FROM documents WHERE path = ?", (path,))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._conn.close()
@@ -1,5 +1,5 @@
 import os
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 from jinja2 import Environment, FileSystemLoader
 from .board import GameConfig
 from .models import Caisson, Drone
@@ -116,12 +116,13 @@ def compose_dream_turn(drone: Drone, game_data: Caisson) -> Tuple[str, str]:
     )
     return system_prompt, user_input
 
-def compose_dusk_turn(drone: Drone, game_data: Caisson) -> Tuple[str, str]:
+def compose_dusk_turn(drone: Drone, game_data: Caisson, ship_logs: Optional[List[str]] = None) -> Tuple[str, str]:
+    """`ship_logs` is the whole log read back from the archived stream; the document only keeps a window."""
     system_prompt = _compose_dynamic_system_prompt(drone.id, game_data, force_loyal=False)
     user_input = render(
         "saboteur_dusk.md.j2",
         drone=drone,
-        ship_logs=game_data.ship_logs
+        ship_logs=game_data.ship_logs if ship_logs is None else ship_logs
     )
     return system_prompt, user_input
 
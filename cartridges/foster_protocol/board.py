@@ -2,7 +2,10 @@ from enum import Enum
 
 class GameConfig:
     MAX_PLAYERS = 8
-    AI_PARALLEL_DELAY = 1
+
+    # Log lines kept in the game document; older lines live only in the archived streams
+    SHIP_LOG_WINDOW = 64
+    BLACKBOX_LOG_WINDOW = 64
 
     HOURS_PER_SHIFT = 8
     INITIAL_OXYGEN = 100
@@ -11,6 +11,24 @@ from . import ai_templates
 from . import commands
 from .ui_templates import FosterPresenter
 
+# Structured output for the saboteur's dusk falsification
+DUSK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "falsified_memory": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "Fabricated log of things you saw today"
+        },
+        "falsified_event_log": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "Fabricated log of things you did today"
+        }
+    },
+    "required": ["falsified_memory", "falsified_event_log"]
+}
+
 class FosterProtocol:
     def __init__(self):
         default_state = Caisson()
@@ -25,13 +43,46 @@ class FosterProtocol:
             "dream_phase": self._handle_dream_phase,
             "tick_hour": self._handle_tick_hour,
             "dusk_phase": self._handle_dusk_phase,
-            "physics_arbitration": self._handle_physics_arbitration
+            "physics_arbitration": self._handle_physics_arbitration,
+            "batch_poll": self._handle_batch_poll
+        }
+        self._batch_finishers = {
+            "dream": self._finish_dream_batch,
+            "dusk": self._finish_dusk_batch,
+            "epilogue": self._finish_epilogue_batch
         }
 
     @property
     def MAX_PLAYERS(self):
         return GameConfig.MAX_PLAYERS
 
+    @property
+    def LOG_STREAMS(self):
+        """
+        Append-only metadata lists archived by the engine, mapped to the number of lines
+        kept in the game document (None keeps the list whole; these are cleared every dream).
+        """
+        return {
+            "ship_logs": GameConfig.SHIP_LOG_WINDOW,
+            "blackbox_logs": GameConfig.BLACKBOX_LOG_WINDOW,
+            "drones.*.night_chat_log": None,
+            "drones.*.daily_memory": None,
+        }
+
+    @property
+    def REBASE_SAFE_PATHS(self):
+        """
+        Paths written outside of tasks (nanny chat, renames, sleep requests). Field writes
+        confined to them bump chat_version instead of the task version, and a task result
+        can be merged over them when its versioned commit loses the race.
+        """
+        return ["drones.*.night_chat_log", "drones.*.name", "players.*.requested_sleep"]
+
+    @property
+    def STATIC_PROMPTS(self):
+        """Shared system prompt prefixes; the engine stores these once and logs only the suffix."""
+        return [ai_templates._get_base_prompt()]
+
     def calculate_start_cost(self, player_count: int) -> int:
         return max(4, player_count)
 
@@ -87,7 +138,6 @@ class FosterProtocol:
         tasks = []
         for drone in game_data.drones.values():
             tasks.append(asyncio.create_task(self._generate_intro(drone, game_data, ctx, tools)))
-            await asyncio.sleep(GameConfig.AI_PARALLEL_DELAY)
         if tasks: await asyncio.gather(*tasks)
 
     async def _generate_intro(self, drone, game_data, ctx, tools):
@@ -103,6 +153,9 @@ class FosterProtocol:
             logging.error(f"Intro failed for {drone.id}: {e}")
 
     # --- DREAM SEQUENCE ---
+    def _dreaming_drones(self, game_data: Caisson) -> List[Drone]:
+        return [d for d in game_data.drones.values() if d.status == "active" and (d.night_chat_log or d.daily_memory)]
+
     async def _process_single_dream(self, drone: Drone, game_data: Caisson, tools):
         try:
             sys_prompt, user_msg = ai_templates.compose_dream_turn(drone, game_data)
@@ -110,13 +163,21 @@ class FosterProtocol:
             new_memory = await tools.ai.generate_response(
                 sys_prompt, f"dream_{drone.id}", user_msg, drone.model_version
             )
-            drone.long_term_memory = new_memory.replace("\n", " ").strip()
-            drone.night_chat_log.clear()
-            drone.daily_memory.clear()
-            drone.daily_event_log.clear()
+            self._apply_dream(drone, new_memory)
         except Exception as e:
             logging.error(f"Dream failed for {drone.id}: {e}")
 
+    @staticmethod
+    def _apply_dream(drone: Drone, new_memory: str, chat_lines: Optional[int] = None):
+        """chat_lines: how many leading night chat lines the dream saw (None: all of them)."""
+        drone.long_term_memory = new_memory.replace("\n", " ").strip()
+        if chat_lines is None:
+            drone.night_chat_log.clear()
+        else:
+            del drone.night_chat_log[:chat_lines]
+        drone.daily_memory.clear()
+        drone.daily_event_log.clear()
+
     async def get_drone_action(self, drone, game_data: Caisson, tools_api, game_id: str, hour: int) -> tuple[Dict[str, Any], str]:
         try:
             # INJECT SCHEMA (for guidance only)
@@ -173,7 +234,6 @@ class FosterProtocol:
             if not drone.can_talk:
                 continue
             tasks.append(asyncio.create_task(self._speak_single_drone(ctx, tools, drone, game_data)))
-            await asyncio.sleep(GameConfig.AI_PARALLEL_DELAY)
         if tasks: await asyncio.gather(*tasks)
 
     async def _speak_single_drone(self, ctx, tools, drone, game_data):
@@ -198,24 +258,27 @@ class FosterProtocol:
         except Exception as e:
             logging.error(f"Eulogy failed for {drone.id}: {e}")
 
-    async def generate_epilogues(self, game_data: Caisson, ctx, tools, game_end_state):
+    async def generate_epilogues(self, game_data: Caisson, ctx, tools, game_end_state) -> bool:
+        """Returns True when the epilogues went out as a batch job, whose poll ends the game."""
         saboteur_drone = next((b for b in game_data.drones.values() if b.role == "saboteur"), None)
         foster_of_saboteur = game_data.players[saboteur_drone.foster_id]
         
         await FosterPresenter.report_saboteur(ctx, saboteur_drone, foster_of_saboteur.name)
 
+        surviving = [d for d in game_data.drones.values() if d.status != "destroyed"]
+        compose = lambda drone: ai_templates.compose_epilogue_turn(drone.id, game_data, game_end_state)
+        if await self._submit_batch("epilogue", surviving, compose, game_data, ctx, tools, game_end_state=game_end_state.value):
+            return True
+
         tasks = []
-        for drone in game_data.drones.values():
-            if drone.status == "destroyed":
-                 continue
-            
+        for drone in surviving:
             # Logic for status note handled in templates
             sys_prompt, user_msg = ai_templates.compose_epilogue_turn(drone.id, game_data, game_end_state)
             tasks.append(asyncio.create_task(self._generate_epilogue_response(ctx, tools, drone, sys_prompt, user_msg)))
-            await asyncio.sleep(GameConfig.AI_PARALLEL_DELAY)
             
         if tasks:
             await asyncio.gather(*tasks)
+        return False
 
     async def _generate_epilogue_response(self, ctx, tools, drone, sys, user):
         try:
@@ -272,7 +335,22 @@ class FosterProtocol:
             logging.warning(f"Ignoring dream_phase task: expected cycle {target_cycle}, current {game_data.cycle}")
             return None
 
+        if self._batch_pending(game_data, "dream"):
+            # Redelivered: the batch job already covers this stage
+            return None
+        dreaming = self._dreaming_drones(game_data)
+        compose = lambda drone: ai_templates.compose_dream_turn(drone, game_data)
+        # The chat lines each dream consolidates; anything appended while the job runs is kept
+        chat_lines = {drone.id: len(drone.night_chat_log) for drone in dreaming}
+        if await self._submit_batch("dream", dreaming, compose, game_data, ctx, tools, chat_lines=chat_lines):
+            # The night is over once the crew is asleep: nanny chat waits for the next one
+            game_data.phase = "day"
+            return {"metadata": game_data.model_dump()}
+
         await self._run_dream_phase(game_data, tools)
+        return self._finish_dream_phase(game_data, ctx)
+
+    def _finish_dream_phase(self, game_data: Caisson, ctx) -> Dict[str, Any]:
         game_data.phase = "day"
         game_data.hour = 1
         ctx.schedule_task("tick_hour", {"target_hour": 1})
@@ -304,37 +382,42 @@ class FosterProtocol:
             logging.warning(f"Ignoring dusk_phase task: expected cycle {target_cycle}, current {game_data.cycle}")
             return None
 
+        if self._batch_pending(game_data, "dusk"):
+            return None
+        saboteurs = [d for d in game_data.drones.values() if d.role == "saboteur" and (d.daily_memory or d.daily_event_log)]
+        ship_logs = await self._read_ship_logs(game_data, ctx) if saboteurs else game_data.ship_logs
+        compose = lambda drone: ai_templates.compose_dusk_turn(drone, game_data, ship_logs)
+        if await self._submit_batch("dusk", saboteurs, compose, game_data, ctx, tools, response_schema=DUSK_SCHEMA):
+            return {"metadata": game_data.model_dump()}
+
         tasks = []
-        for drone in game_data.drones.values():
-            if drone.role == "saboteur" and (drone.daily_memory or drone.daily_event_log):
-                tasks.append(asyncio.create_task(self._process_saboteur_dusk(drone, game_data, ctx, tools)))
-                await asyncio.sleep(GameConfig.AI_PARALLEL_DELAY)
+        for drone in saboteurs:
+            tasks.append(asyncio.create_task(self._process_saboteur_dusk(drone, game_data, ctx, tools, ship_logs)))
         
         if tasks:
             await asyncio.gather(*tasks)
             
+        return self._finish_dusk_phase(game_data, ctx)
+
+    @staticmethod
+    async def _read_ship_logs(game_data: Caisson, ctx) -> List[str]:
+        """The whole ship log: lines past the document window are read back from the archived stream."""
+        if len(game_data.ship_logs) < GameConfig.SHIP_LOG_WINDOW:
+            return game_data.ship_logs
+        try:
+            archived = await ctx.read_log_stream("ship_logs")
+        except Exception as e:
+            logging.warning(f"Could not read the archived ship log, using the document window: {e}")
+            return game_data.ship_logs
+        return archived if len(archived) > len(game_data.ship_logs) else game_data.ship_logs
+
+    def _finish_dusk_phase(self, game_data: Caisson, ctx) -> Dict[str, Any]:
         ctx.schedule_task("physics_arbitration", {"cycle": game_data.cycle})
         return {"metadata": game_data.model_dump()}
 
-    async def _process_saboteur_dusk(self, drone: Drone, game_data: Caisson, ctx, tools):
+    async def _process_saboteur_dusk(self, drone: Drone, game_data: Caisson, ctx, tools, ship_logs: List[str]):
         try:
-            schema = {
-                "type": "object",
-                "properties": {
-                    "falsified_memory": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                        "description": "Fabricated log of things you saw today"
-                    },
-                    "falsified_event_log": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                        "description": "Fabricated log of things you did today"
-                    }
-                },
-                "required": ["falsified_memory", "falsified_event_log"]
-            }
-            sys_prompt, user_msg = ai_templates.compose_dusk_turn(drone, game_data)
+            sys_prompt, user_msg = ai_templates.compose_dusk_turn(drone, game_data, ship_logs)
             
             response_text = await tools.ai.generate_response(
                 system_prompt=sys_prompt,
@@ -342,9 +425,15 @@ class FosterProtocol:
                 user_input=user_msg,
                 model_version=drone.model_version,
                 game_id=ctx.game_id,
-                response_schema=schema
+                response_schema=DUSK_SCHEMA
             )
-            
+            self._apply_dusk_falsification(drone, response_text)
+        except Exception as e:
+            logging.error(f"Dusk falsification failed for {drone.id}: {e}")
+
+    @staticmethod
+    def _apply_dusk_falsification(drone: Drone, response_text):
+        try:
             if isinstance(response_text, list):
                 response_text = "\n".join(str(item) for item in response_text)
                 
@@ -395,23 +484,104 @@ class FosterProtocol:
         else:
             # Game over
             await FosterPresenter.report_game_end(ctx, game_end_state)
-            await self.generate_epilogues(game_data, ctx, tools, game_end_state)
-            await ctx.end()
+            if not await self.generate_epilogues(game_data, ctx, tools, game_end_state):
+                await ctx.end()
 
         return {
             "metadata": game_data.model_dump(),
             "channel_ops": channel_ops if channel_ops else None
         }
 
+    # --- BATCHED AI STAGES ---
+    # When the engine has batch prediction enabled, a stage's calls (dreams, dusk falsification,
+    # epilogues) go out as one batch job. The stage's task only records the job in pending_batch;
+    # batch_poll tasks wait for it, then finish the stage, making inline any call it did not answer.
+
+    def _batch_pending(self, game_data: Caisson, stage: str) -> bool:
+        pending = game_data.pending_batch
+        return bool(pending) and pending.get("stage") == stage and pending.get("cycle") == game_data.cycle
+
+    async def _submit_batch(self, stage: str, drones: List[Drone], compose, game_data: Caisson, ctx, tools, response_schema: dict = None, **context) -> bool:
+        if getattr(tools.ai, "batch_enabled", False) is not True or not drones:
+            return False
+        requests = []
+        for drone in drones:
+            sys_prompt, user_msg = compose(drone)
+            requests.append({
+                "key": drone.id,
+                "system_prompt": sys_prompt,
+                "user_input": user_msg,
+                "model_version": drone.model_version,
+                "response_schema": response_schema
+            })
+        handle = await tools.ai.submit_batch(ctx.game_id, requests)
+        if not handle:
+            return False
+        game_data.pending_batch = {"stage": stage, "cycle": game_data.cycle, **context, **handle}
+        ctx.schedule_task("batch_poll", {"stage": stage, "cycle": game_data.cycle}, delay=handle.get("poll_seconds", 60))
+        return True
+
+    async def _handle_batch_poll(self, game_data: Caisson, data: dict, ctx, tools) -> Dict[str, Any]:
+        stage = data.get("stage")
+        if not self._batch_pending(game_data, stage) or data.get("cycle") != game_data.cycle:
+            logging.warning(f"Ignoring batch_poll task: no pending {stage} batch for cycle {data.get('cycle')}")
+            return None
+
+        pending = game_data.pending_batch
+        results = await tools.ai.collect_batch(ctx.game_id, pending)
+        if results is None:
+            ctx.schedule_task("batch_poll", data, delay=pending.get("poll_seconds", 60))
+            return None
+
+        game_data.pending_batch = None
+        drones = [game_data.drones[key] for key in pending.get("keys", []) if key in game_data.drones]
+        return await self._batch_finishers[stage](game_data, pending, results, drones, ctx, tools)
+
+    async def _finish_dream_batch(self, game_data: Caisson, pending: dict, results: dict, drones: List[Drone], ctx, tools) -> Dict[str, Any]:
+        tasks = []
+        for drone in drones:
+            if drone.id in results:
+                self._apply_dream(drone, results[drone.id], pending.get("chat_lines", {}).get(drone.id))
+            else:
+                tasks.append(asyncio.create_task(self._process_single_dream(drone, game_data, tools)))
+        if tasks:
+            await asyncio.gather(*tasks)
+        return self._finish_dream_phase(game_data, ctx)
+
+    async def _finish_dusk_batch(self, game_data: Caisson, pending: dict, results: dict, drones: List[Drone], ctx, tools) -> Dict[str, Any]:
+        tasks = []
+        missing = [drone for drone in drones if drone.id not in results]
+        ship_logs = await self._read_ship_logs(game_data, ctx) if missing else game_data.ship_logs
+        for drone in drones:
+            if drone.id in results:
+                self._apply_dusk_falsification(drone, results[drone.id])
+            else:
+                tasks.append(asyncio.create_task(self._process_saboteur_dusk(drone, game_data, ctx, tools, ship_logs)))
+        if tasks:
+            await asyncio.gather(*tasks)
+        return self._finish_dusk_phase(game_data, ctx)
+
+    async def _finish_epilogue_batch(self, game_data: Caisson, pending: dict, results: dict, drones: List[Drone], ctx, tools) -> Dict[str, Any]:
+        game_end_state = GameEndState(pending.get("game_end_state"))
+        tasks = []
+        for drone in drones:
+            if drone.id in results:
+                await FosterPresenter.send_private_message(ctx, drone.foster_id, results[drone.id])
+            else:
+                sys_prompt, user_msg = ai_templates.compose_epilogue_turn(drone.id, game_data, game_end_state)
+                tasks.append(asyncio.create_task(self._generate_epilogue_response(ctx, tools, drone, sys_prompt, user_msg)))
+        if tasks:
+            await asyncio.gather(*tasks)
+        await ctx.end()
+        return {"metadata": game_data.model_dump()}
+
     # --- PIPELINE STAGES ---
 
     async def _run_dream_phase(self, game_data: Caisson, tools):
         """Processes logs from previous night into long term memory."""
         tasks = []
-        for drone in game_data.drones.values():
-            if drone.status == "active" and (drone.night_chat_log or drone.daily_memory):
-                tasks.append(asyncio.create_task(self._process_single_dream(drone, game_data, tools)))
-                await asyncio.sleep(GameConfig.AI_PARALLEL_DELAY)
+        for drone in self._dreaming_drones(game_data):
+            tasks.append(asyncio.create_task(self._process_single_dream(drone, game_data, tools)))
         if tasks:
              await asyncio.gather(*tasks)
 
@@ -435,7 +605,6 @@ class FosterProtocol:
         tasks = []
         for drone in acting_drones:
             tasks.append(asyncio.create_task(process_drone(drone)))
-            await asyncio.sleep(GameConfig.AI_PARALLEL_DELAY)
 
         if tasks:
             results = await asyncio.gather(*tasks)
@@ -516,6 +685,13 @@ class FosterProtocol:
 
     # --- INPUT HANDLERS ---
 
+    async def screen_input(self, header: dict, user_input: str, ctx) -> bool:
+        """Rejects input during the day from the game header, before the full state is loaded."""
+        if header.get('phase') == "day":
+            await FosterPresenter.reply_day_phase_active(ctx)
+            return True
+        return False
+
     async def handle_input(self, generic_state: dict, user_input: str, ctx, tools) -> Dict[str, Any]:
         game_data = Caisson(**generic_state.get('metadata', {}))
         channel_id = ctx.trigger_data.get('channel_id')
@@ -68,6 +68,9 @@ class Caisson(BaseModel):
     ship_logs: List[str] = Field(default_factory=list)
     blackbox_logs: List[str] = Field(default_factory=list)
 
+    # AI batch job a stage is waiting on: stage, cycle, the engine's job handle (see batch_poll)
+    pending_batch: Optional[Dict[str, Any]] = None
+
     # Pydantic V2 Config
     model_config = ConfigDict(populate_by_name=True)
 
@@ -0,0 +1,87 @@
+import json
+import time
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from app import config
+from app.ai_batch import BatchJobState, parse_result_line, request_line
+from app.ai_engine import AIEngine
+
+def _result(index, text, status=None):
+    line = request_line(index, "SYSTEM", "USER", 0.7, 100)
+    line["response"] = {
+        "candidates": [{"content": {"parts": [{"text": text}]}}],
+        "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": 2, "totalTokenCount": 12}
+    }
+    if status:
+        line["status"] = status
+    return json.dumps(line)
+
+def test_result_lines_map_back_to_request_index():
+    line = request_line(3, "SYSTEM", "USER", 0.7, 100, response_schema={"type": "object"})
+    assert line["request"]["generationConfig"]["responseMimeType"] == "application/json"
+
+    index, row = parse_result_line(_result(3, "dreamt"))
+    assert (index, row["text"], row["system_prompt"], row["user_input"]) == (3, "dreamt", "SYSTEM", "USER")
+    assert row["usage"] == {"input_tokens": 10, "output_tokens": 2, "total_tokens": 12}
+    assert parse_result_line(_result(4, "x", status="RESOURCE_EXHAUSTED")) is None
+
+class FakeBatch:
+    def __init__(self):
+        self.submitted = []
+        self.cancelled = []
+        self.states = {}
+        self.rows = {}
+
+    def submit(self, model_name, job_id, lines):
+        name = f"jobs/{model_name}"
+        self.submitted.append((model_name, len(lines)))
+        self.states[name] = BatchJobState(False, False, None)
+        return name
+
+    def status(self, job_name):
+        return self.states[job_name]
+
+    def cancel(self, job_name):
+        self.cancelled.append(job_name)
+
+    def read_results(self, output_location):
+        return self.rows[output_location]
+
+@pytest.mark.asyncio
+async def test_batch_submits_per_model_and_collects_answered_keys():
+    engine = AIEngine()
+    engine.batch = FakeBatch()
+    requests = [
+        {"key": "d1", "system_prompt": "S", "user_input": "U1", "model_version": "gemini-2.5-flash"},
+        {"key": "d2", "system_prompt": "S", "user_input": "U2", "model_version": "gemini-2.5-pro"},
+        {"key": "d3", "system_prompt": "S", "user_input": "U3", "model_version": "gemini-2.5-flash"}
+    ]
+    assert await engine.submit_batch("g1", requests) is None  # Disabled by default
+
+    with patch.object(config, "AI_BATCH_ENABLED", True), patch.object(config, "AI_BATCH_BUCKET", "bucket"), \
+         patch("app.ai_engine.persistence.db") as mock_db:
+        mock_db.enqueue_ai_log = AsyncMock()
+        handle = await engine.submit_batch("g1", requests)
+        assert sorted(engine.batch.submitted) == [("gemini-2.5-flash", 2), ("gemini-2.5-pro", 1)]
+        assert handle["keys"] == ["d1", "d2", "d3"]
+        assert await engine.collect_batch("g1", handle) is None
+
+        # flash answered d1 (d3 blocked), pro failed: d2 and d3 are left to the caller
+        engine.batch.states["jobs/gemini-2.5-flash"] = BatchJobState(True, True, "gs://bucket/out")
+        engine.batch.states["jobs/gemini-2.5-pro"] = BatchJobState(True, False, None, "quota")
+        engine.batch.rows["gs://bucket/out"] = dict([parse_result_line(_result(0, "dreamt"))])
+        assert await engine.collect_batch("g1", handle) == {"d1": "dreamt"}
+        assert mock_db.enqueue_ai_log.await_count == 1
+        mock_db.record_token_usage.assert_called_once_with("g1", 10, 2)
+
+@pytest.mark.asyncio
+async def test_batch_past_timeout_is_cancelled():
+    engine = AIEngine()
+    engine.batch = FakeBatch()
+    requests = [{"key": "d1", "system_prompt": "S", "user_input": "U", "model_version": "gemini-2.5-flash"}]
+    with patch.object(config, "AI_BATCH_ENABLED", True), patch.object(config, "AI_BATCH_BUCKET", "bucket"):
+        handle = await engine.submit_batch("g1", requests)
+        handle["submitted_at"] = time.time() - config.AI_BATCH_TIMEOUT_SECONDS - 1
+        assert await engine.collect_batch("g1", handle) == {}
+    assert engine.batch.cancelled == ["jobs/gemini-2.5-flash"]
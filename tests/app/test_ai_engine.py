@@ -1,6 +1,8 @@
 import pytest
+import asyncio
 from unittest.mock import MagicMock, AsyncMock, patch
-from app.ai_engine import AIEngine
+from google.api_core import exceptions as google_exceptions
+from app.ai_engine import AIEngine, AdaptiveLimiter, ModelPool, PromptCache
 
 # Since conftest.py mocks the modules, we need to ensure the async methods 
 # return values that the code expects (like .content and .response_metadata)
@@ -109,4 +111,180 @@ async def test_generate_response_with_schema():
 
         assert response == "{'key': 'value'}"
         # Verify .bind() was called to attach the schema
-        mock_model_instance.bind.assert_called_once()
\ No newline at end of file
+        mock_model_instance.bind.assert_called_once()
+def test_split_static_prefix_uses_longest_registered_prefix():
+    from app.ai_engine import register_static_prompt, split_static_prefix, prompt_hash
+
+    base = "LORE BIBLE " * 100
+    register_static_prompt(base)
+    register_static_prompt(base + "EXTENDED")
+
+    digest, suffix = split_static_prefix(base + "EXTENDED\n\nI am unit_001")
+    assert digest == prompt_hash(base + "EXTENDED")
+    assert suffix == "\n\nI am unit_001"
+
+    assert split_static_prefix("unrelated prompt") == (None, "unrelated prompt")
+
+@pytest.mark.asyncio
+async def test_generate_response_logs_prompt_by_hash():
+    from app.ai_engine import register_static_prompt
+
+    engine = AIEngine()
+    base = "SHARED RULES " * 100
+    digest = register_static_prompt(base)
+
+    with patch("app.ai_engine.ChatVertexAI") as MockChatClass, \
+         patch("app.ai_engine.persistence.db") as mock_db:
+        mock_result = MagicMock()
+        mock_result.content = "ok"
+        mock_result.response_metadata = {"finish_reason": "STOP"}
+        MockChatClass.return_value.model_name = "gemini-test"
+        MockChatClass.return_value.ainvoke = AsyncMock(return_value=mock_result)
+        mock_db.enqueue_ai_log = AsyncMock()
+        mock_db.increment_token_usage = AsyncMock()
+
+        await engine.generate_response(base + "\n\nidentity", "conv", "hi", game_id="game_1")
+        await asyncio.sleep(0)
+
+        entry, static_text = mock_db.enqueue_ai_log.call_args[0]
+        assert entry.prompt_hash == digest
+        assert entry.system_prompt == "\n\nidentity"
+        assert static_text == base
+
+@pytest.mark.asyncio
+async def test_model_pool_keys_clients_and_evicts_lru():
+    built = []
+    def factory(model_name, overrides):
+        built.append((model_name, overrides))
+        return MagicMock(model_name=model_name)
+    pool = ModelPool(factory, max_size=2)
+
+    # Concurrent misses for one key share a single build
+    first, second = await asyncio.gather(pool.get("flash"), pool.get("flash"))
+    assert first is second and built == [("flash", {})]
+
+    pro = await pool.get("pro")
+    assert await pool.get("flash") is first
+    hot = await pool.get("flash", {"temperature": 1.0})
+    assert hot is not first and built[-1] == ("flash", {"temperature": 1.0})
+
+    # "pro" was the least recently used of the three
+    assert pool.stats()["evictions"] == 1
+    assert await pool.get("pro") is not pro
+
+    # Unhashable override values key by their canonical JSON
+    stopped = await pool.get("pro", {"stop": ["END"], "temperature": 0.2})
+    assert await pool.get("pro", {"temperature": 0.2, "stop": ["END"]}) is stopped
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter_queues_and_backs_off():
+    limiter = AdaptiveLimiter(initial=2, minimum=1, maximum=4, latency_ceiling=30, backoff=0.5, cooldown=60)
+    await limiter.acquire()
+    await limiter.acquire()
+    third = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not third.done() and limiter.stats()["waiting"] == 1
+
+    # A success grows the limit additively and admits the waiter
+    limiter.release(1.0)
+    await third
+    assert limiter.limit == 2.5 and limiter.in_flight == 2
+
+    # A 429 halves it, but a burst of them only counts once per cooldown
+    limiter.release(1.0, ok=False, throttled=True)
+    limiter.release(1.0, ok=False, throttled=True)
+    assert limiter.limit == 1.25 and limiter.stats()["decreases"] == 1 and limiter.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_generate_response_goes_through_the_model_limiter():
+    engine = AIEngine()
+    with patch("app.ai_engine.ChatVertexAI") as MockChatClass:
+        MockChatClass.return_value.ainvoke = AsyncMock(side_effect=google_exceptions.ResourceExhausted("Quota exceeded"))
+        response = await engine.generate_response("sys", "conv", "hi", model_version="gemini-x")
+
+        # Only the error type counts: a message that happens to mention 429 is not a throttle
+        MockChatClass.return_value.ainvoke = AsyncMock(side_effect=ValueError("prompt line 429 is malformed"))
+        await engine.generate_response("sys", "conv", "hi", model_version="gemini-x")
+
+    assert response.startswith("[SYSTEM ERROR]")
+    stats = engine.limiters["gemini-x"].stats()
+    assert stats["throttled"] == 1 and stats["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter_token_budget():
+    now = [0.0]
+    limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=4, latency_ceiling=30, backoff=0.5,
+                              tokens_per_minute=1000, clock=lambda: now[0])
+    await limiter.acquire()
+    limiter.record_tokens(600)
+    limiter.release(1.0)
+    assert limiter.token_wait() == 0
+
+    now[0] = 10.0
+    limiter.record_tokens(500)
+    # The window is spent until the first call's tokens age out
+    assert limiter.token_wait() == 50.0
+    with patch("app.ai_engine.asyncio.sleep", new=AsyncMock(side_effect=lambda seconds: now.__setitem__(0, now[0] + seconds))):
+        await limiter.acquire()
+    assert now[0] == 60.0 and limiter.stats()["tokens_last_minute"] == 500 and limiter.stats()["token_waits"] == 1
+
+@pytest.mark.asyncio
+async def test_prompt_cache_refreshes_before_expiry_and_backs_off_on_failure():
+    now = [0.0]
+    created = []
+    def create(client, text, ttl):
+        created.append(text)
+        if text == "tiny":
+            raise ValueError("below the minimum cacheable size")
+        return f"cache-{len(created)}"
+    cache = PromptCache(create, ttl_seconds=3600, refresh_margin=300, retry_after=900, clock=lambda: now[0])
+
+    assert await cache.get("flash", None, "d1", "BASE") == "cache-1"
+    now[0] = 3000
+    assert await cache.get("flash", None, "d1", "BASE") == "cache-1"
+    now[0] = 3400  # Inside the refresh margin
+    assert await cache.get("flash", None, "d1", "BASE") == "cache-2"
+
+    assert await cache.get("flash", None, "d2", "tiny") is None
+    assert await cache.get("flash", None, "d2", "tiny") is None
+    assert created.count("tiny") == 1
+
+@pytest.mark.asyncio
+async def test_prompt_cache_keeps_each_digest_of_a_model():
+    created = []
+    def create(client, text, ttl):
+        created.append(text)
+        return f"cache-{text}"
+    cache = PromptCache(create, ttl_seconds=3600, refresh_margin=300, retry_after=900, clock=lambda: 0.0)
+
+    # Two cartridges' base prompts on one model share neither resource nor entry
+    assert await cache.get("flash", None, "d1", "FOSTER") == "cache-FOSTER"
+    assert await cache.get("flash", None, "d2", "OTHER") == "cache-OTHER"
+    assert await cache.get("flash", None, "d1", "FOSTER") == "cache-FOSTER"
+    assert created == ["FOSTER", "OTHER"]
+    assert len(cache.stats()["resources"]) == 2
+
+@pytest.mark.asyncio
+async def test_generate_response_references_cached_static_prefix():
+    from app.ai_engine import register_static_prompt
+
+    engine = AIEngine()
+    base = "CACHED RULES " * 100
+    register_static_prompt(base)
+    engine.prompt_cache.create = lambda client, text, ttl: "cache-1"
+
+    with patch("app.ai_engine.ChatVertexAI") as MockChatClass, \
+         patch("app.ai_engine.config.AI_CONTEXT_CACHE_ENABLED", True):
+        mock_result = MagicMock(content="ok", response_metadata={"finish_reason": "STOP"})
+        MockChatClass.return_value.ainvoke = AsyncMock(return_value=mock_result)
+        assert await engine.generate_response(base + "\n\nI am unit_7", "conv", "report") == "ok"
+
+        messages = MockChatClass.return_value.ainvoke.call_args[0][0]
+        assert MockChatClass.return_value.ainvoke.call_args[1] == {"cached_content": "cache-1"}
+        assert [m.content for m in messages] == ["I am unit_7\n\nreport"]
+
+        # A call the cache cannot serve is retried with the prompt inline
+        MockChatClass.return_value.ainvoke = AsyncMock(side_effect=[Exception("404 cache not found"), mock_result])
+        assert await engine.generate_response(base + "\n\nI am unit_7", "conv", "report") == "ok"
+        assert MockChatClass.return_value.ainvoke.call_args[1] == {}
+        assert len(MockChatClass.return_value.ainvoke.call_args[0][0]) == 2
@@ -0,0 +1,115 @@
+import datetime
+import pytest
+from unittest.mock import patch
+
+from app import config
+from app.export import export_analytics
+from app.models import AILogEntry, GameState, LobbyPlayer
+from app.persistence import PersistenceLayer
+
+T0 = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+class ListSink:
+    def __init__(self):
+        self.rows = []
+
+    def write(self, table, partition, row):
+        self.rows.append((table, partition, row))
+
+    def table(self, name):
+        return [row for table, _, row in self.rows if table == name]
+
+def _memory_layer():
+    with patch.object(config, "STORAGE_BACKEND", "memory"):
+        return PersistenceLayer()
+
+async def _log(layer, game_id, minutes, tokens):
+    await layer.log_ai_interaction(AILogEntry(
+        game_id=game_id, model="gemini", system_prompt="p", user_input="u", raw_response="r",
+        usage={"input_tokens": tokens, "output_tokens": 1, "total_tokens": tokens + 1},
+        scope="task foster-protocol:tick_hour", timestamp=T0 + datetime.timedelta(minutes=minutes)
+    ))
+
+@pytest.mark.asyncio
+async def test_export_is_incremental_by_log_timestamp():
+    layer = _memory_layer()
+    players = [LobbyPlayer(id="p1", name="A"), LobbyPlayer(id="p2", name="B")]
+    for game_id, created in [("g1", T0), ("g2", T0 + datetime.timedelta(minutes=1))]:
+        await layer.create_game_record(GameState(id=game_id, story_id="foster-protocol", host_id="u1",
+                                                 status="active", created_at=created, players=players))
+    await _log(layer, "g1", 5, 100)
+    await _log(layer, "g2", 6, 200)
+
+    first = ListSink()
+    cutoff = T0 + datetime.timedelta(minutes=10)
+    assert await export_analytics(layer, first, None, cutoff) == {"ai_logs": 2, "games": 2}
+    log = first.table("ai_logs")[0]
+    assert (log["game_id"], log["input_tokens"], log["scope"]) == ("g1", 100, "task foster-protocol:tick_hour")
+    assert first.table("games")[0]["player_count"] == 2
+    assert {partition for _, partition, _ in first.rows} == {"2024-01-01"}
+
+    # The next run only sees logs after the watermark, and only games that logged since
+    await _log(layer, "g2", 12, 300)
+    await _log(layer, "g2", 30, 400)  # Newer than this run's cutoff
+    second = ListSink()
+    assert await export_analytics(layer, second, cutoff, T0 + datetime.timedelta(minutes=20)) == {"ai_logs": 1, "games": 1}
+    assert [row["input_tokens"] for row in second.table("ai_logs")] == [300]
+    assert [row["game_id"] for row in second.table("games")] == ["g2"]
+
+@pytest.mark.asyncio
+async def test_export_reads_logs_of_archived_games_from_the_archive():
+    layer = _memory_layer()
+    await layer.create_game_record(GameState(id="g1", story_id="foster-protocol", host_id="u1",
+                                             status="active", created_at=T0))
+    await _log(layer, "g1", 5, 100)
+    await layer.mark_game_ended("g1")
+    assert await layer.archive_game("g1")
+
+    sink = ListSink()
+    until = datetime.datetime.now(datetime.timezone.utc)
+    assert await export_analytics(layer, sink, T0, until) == {"ai_logs": 1, "games": 1}
+    assert sink.table("games")[0]["archived"] is True
+
+def test_parquet_sink_writes_partitions_atomically(tmp_path):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    from app.export import ParquetSink, game_row
+
+    sink = ParquetSink(str(tmp_path), "run1", batch_rows=1)
+    game = {"id": "g1", "story_id": "foster-protocol", "host_id": "u1", "status": "active", "created_at": T0, "players": []}
+    sink.write("games", "2024-01-01", game_row(game, T0))
+    sink.write("games", "2024-01-01", game_row({**game, "id": "g2"}, T0))
+    path = tmp_path / "games" / "date=2024-01-01" / "part-run1.parquet"
+    assert not path.exists()
+
+    sink.close()
+    table = pyarrow_parquet.read_table(str(path))
+    assert table.column("game_id").to_pylist() == ["g1", "g2"]
+    assert table.column("created_at").to_pylist()[0] == T0
+
+@pytest.mark.asyncio
+async def test_streams_page_through_equal_timestamps():
+    layer = _memory_layer()
+    for game_id in ["g3", "g1", "g2", "g4", "g5"]:
+        await layer.create_game_record(GameState(id=game_id, story_id="foster-protocol", host_id="u1",
+                                                 status="active", created_at=T0))
+    games = [game["id"] async for game in layer.stream_games(page_size=2)]
+    assert games == ["g1", "g2", "g3", "g4", "g5"]
+
+    for _ in range(5):
+        await _log(layer, "g1", 5, 100)
+    logs = [log["id"] async for log in layer.stream_ai_logs("g1", page_size=2)]
+    assert len(logs) == len(set(logs)) == 5
+
+@pytest.mark.asyncio
+async def test_stream_games_skips_games_that_ended_before_the_watermark():
+    layer = _memory_layer()
+    for game_id in ["old", "new", "running"]:
+        await layer.create_game_record(GameState(id=game_id, story_id="foster-protocol", host_id="u1",
+                                                 status="active", created_at=T0))
+    await layer.mark_game_ended("old")
+    watermark = datetime.datetime.now(datetime.timezone.utc)
+    await layer.mark_game_ended("new")
+
+    games = [game["id"] async for game in layer.stream_games(since=watermark, page_size=1)]
+    assert games == ["new", "running"]
+    assert len([game async for game in layer.stream_games()]) == 3
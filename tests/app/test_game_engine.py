@@ -1,8 +1,8 @@
 import pytest
 import asyncio
 from unittest.mock import MagicMock, AsyncMock, patch
-from app.game_engine import GameEngine
-from app.models import GameState, GameInterface
+from app.game_engine import GameEngine, ARCHIVE_OPERATION
+from app.models import GameState, GameHeader, GameInterface
 
 # --- MOCKS ---
 
@@ -32,12 +32,17 @@ def mock_db():
     # This forces all attributes of the mock (like create_game_record) 
     # to be AsyncMocks by default, so they can be awaited.
     with patch("app.persistence.db", new_callable=AsyncMock) as mock:
+        # Headers follow whatever full game the test has staged
+        async def _header(game_id, **kwargs):
+            game = mock.get_game_by_id.return_value
+            return GameHeader.from_game(game) if isinstance(game, GameState) else None
+        mock.get_game_header.side_effect = _header
         yield mock
 
 @pytest.fixture
 def engine(mock_db):
     # We patch the AI engine to avoid API costs during tests
-    with patch("app.game_engine.AIEngine", return_value=MagicMock()):
+    with patch("app.ai_engine.ai", MagicMock()):
         eng = GameEngine()
         # Mock the cartridge loader to return our dummy cartridge
         eng._load_cartridge = AsyncMock(return_value=MockCartridge())
@@ -135,4 +140,244 @@ async def test_dispatch_input_ignored_if_game_ended(engine, mock_db):
     await engine.dispatch_input(channel_id, "u1", "me", "ping", "g_dead")
 
     # Should NOT hit the DB update
-    mock_db.update_game_metadata_fields.assert_not_called()
\ No newline at end of file
+    mock_db.update_game_metadata_fields.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_dispatch_task_commits_only_changed_paths(engine, mock_db):
+    class TaskCartridge(MockCartridge):
+        async def handle_task(self, state, payload, ctx, tools):
+            metadata = dict(state["metadata"])
+            metadata["hour"] = 2
+            metadata["ship_logs"] = metadata["ship_logs"] + ["[Hour 1] nominal"]
+            return {"metadata": metadata}
+
+    engine._load_cartridge = AsyncMock(return_value=TaskCartridge())
+    fake_game = GameState(
+        id="g_task", story_id="test", host_id="u1", status="active",
+        created_at="2024-01-01", version=7,
+        metadata={"hour": 1, "ship_logs": ["boot"], "drones": {"d1": {"battery": 100}}}
+    )
+    mock_db.get_game_by_id.return_value = fake_game
+
+    await engine.dispatch_task("test", "g_task", {"operation": "tick_hour"})
+
+    mock_db.update_game_metadata.assert_not_called()
+    game_id, diff, version = mock_db.update_game_metadata_diff.call_args[0][:3]
+    assert (game_id, version) == ("g_task", 7)
+    assert diff.sets == {"hour": 2}
+    assert diff.appends == {"ship_logs": ["[Hour 1] nominal"]}
+
+@pytest.mark.asyncio
+async def test_dispatch_input_archives_log_stream_lines(engine, mock_db):
+    class ChatCartridge(MockCartridge):
+        LOG_STREAMS = {"drones.*.night_chat_log": None}
+
+        async def handle_input(self, state, user_input, ctx, tools):
+            log = state["metadata"]["drones"]["d1"]["night_chat_log"] + [f"Foster: {user_input}"]
+            return {"drones.d1.night_chat_log": log}
+
+    engine._load_cartridge = AsyncMock(return_value=ChatCartridge())
+    mock_db.get_game_by_id.return_value = GameState(
+        id="g_chat", story_id="test", host_id="u1", status="active", created_at="2024-01-01",
+        metadata={"drones": {"d1": {"night_chat_log": ["You: hello"]}}}
+    )
+
+    await engine.dispatch_input("c1", "u1", "Alice", "hi", "g_chat")
+
+    mock_db.update_game_metadata_fields.assert_called_once_with(
+        "g_chat", {"drones.d1.night_chat_log": ["You: hello", "Foster: hi"]}
+    )
+    mock_db.append_log_lines.assert_called_once_with("g_chat", [("drones.d1.night_chat_log", ["Foster: hi"])])
+
+@pytest.mark.asyncio
+async def test_dispatch_task_loads_game_once(engine, mock_db):
+    mock_db.get_game_by_id.return_value = GameState(
+        id="g_old", story_id="test", host_id="u1", status="ended", created_at="2024-01-01"
+    )
+
+    await engine.dispatch_task("test", "g_old", {"operation": "tick"})
+
+    # The OCC read doubles as the status gate; no separate header round trip
+    mock_db.get_game_header.assert_not_called()
+    mock_db.get_game_by_id.assert_awaited_once_with("g_old", use_cache=False)
+    mock_db.update_game_metadata_fields.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_dispatch_input_loads_state_behind_the_header(engine, mock_db):
+    mock_db.get_game_by_id.return_value = GameState(
+        id="g_in", story_id="test", host_id="u1", status="active", created_at="2024-01-01"
+    )
+
+    await engine.dispatch_input("c1", "u1", "me", "hello", "g_in")
+
+    mock_db.get_game_header.assert_awaited_once()
+    assert mock_db.get_game_by_id.await_args.kwargs["header"].id == "g_in"
+
+@pytest.mark.asyncio
+async def test_dispatch_input_screened_from_header(engine, mock_db):
+    class ScreeningCartridge(MockCartridge):
+        async def screen_input(self, header, user_input, ctx):
+            await ctx.reply("locked")
+            return header["phase"] == "day"
+
+    engine._load_cartridge = AsyncMock(return_value=ScreeningCartridge())
+    engine._dispatch_message_to_interfaces = AsyncMock()
+    mock_db.get_game_header.side_effect = None
+    mock_db.get_game_header.return_value = GameHeader(
+        id="g_day", story_id="test", host_id="u1", status="active", phase="day"
+    )
+
+    await engine.dispatch_input("c1", "u1", "me", "hello", "g_day")
+
+    mock_db.get_game_by_id.assert_not_called()
+    mock_db.update_game_metadata_fields.assert_not_called()
+    engine._dispatch_message_to_interfaces.assert_awaited_once_with("g_day", "c1", "locked")
+
+@pytest.mark.asyncio
+async def test_end_game_schedules_archive(engine, mock_db):
+    mock_db.get_game_by_id.return_value = GameState(
+        id="g_end", story_id="test", host_id="u1", status="active", created_at="2024-01-01"
+    )
+    engine._schedule_cloud_task = MagicMock()
+
+    await engine.end_game("g_end")
+
+    mock_db.mark_game_ended.assert_awaited_once_with("g_end")
+    engine._schedule_cloud_task.assert_called_once()
+    assert engine._schedule_cloud_task.call_args[0][:3] == ("g_end", "test", ARCHIVE_OPERATION)
+
+    # The archive task is served by the engine even though the game is no longer active
+    await engine.dispatch_task("test", "g_end", {"operation": ARCHIVE_OPERATION, "data": {}})
+    mock_db.archive_game.assert_awaited_once_with("g_end")
+
+@pytest.mark.asyncio
+async def test_dispatch_task_rebases_over_concurrent_chat(engine, mock_db):
+    class TaskCartridge(MockCartridge):
+        REBASE_SAFE_PATHS = ["drones.*.night_chat_log"]
+
+        async def handle_task(self, state, payload, ctx, tools):
+            metadata = dict(state["metadata"])
+            metadata["hour"] = 2
+            return {"metadata": metadata}
+
+    engine._load_cartridge = AsyncMock(return_value=TaskCartridge())
+    base = GameState(
+        id="g_race", story_id="test", host_id="u1", status="active", created_at="2024-01-01", version=7,
+        metadata={"hour": 1, "drones": {"d1": {"night_chat_log": []}}}
+    )
+    latest = base.model_copy(update={"version": 8, "metadata": {"hour": 1, "drones": {"d1": {"night_chat_log": ["Foster: hi"]}}}})
+    mock_db.get_game_by_id.return_value = base
+    mock_db.get_game_by_id.side_effect = [base, latest]
+    mock_db.update_game_metadata_diff.side_effect = [False, True]
+
+    await engine.dispatch_task("test", "g_race", {"operation": "tick_hour"})
+
+    _, diff, version = mock_db.update_game_metadata_diff.call_args[0][:3]
+    assert version == 8
+    assert diff.sets == {"hour": 2}
+    assert engine.rebase_stats["rebased"] == 1
+
+@pytest.mark.asyncio
+async def test_dispatch_task_duplicate_still_aborts(engine, mock_db):
+    class TaskCartridge(MockCartridge):
+        REBASE_SAFE_PATHS = ["drones.*.night_chat_log"]
+
+        async def handle_task(self, state, payload, ctx, tools):
+            ctx.schedule_task("tick_hour", {}, 60)
+            return {"metadata": {**state["metadata"], "hour": 2}}
+
+    engine._load_cartridge = AsyncMock(return_value=TaskCartridge())
+    engine._schedule_cloud_task = MagicMock()
+    base = GameState(
+        id="g_dup", story_id="test", host_id="u1", status="active", created_at="2024-01-01", version=7,
+        metadata={"hour": 1}
+    )
+    mock_db.get_game_by_id.return_value = base
+    # The first delivery of the same task already committed hour 2
+    mock_db.get_game_by_id.side_effect = [base, base.model_copy(update={"version": 8, "metadata": {"hour": 2}})]
+    mock_db.update_game_metadata_diff.return_value = False
+
+    await engine.dispatch_task("test", "g_dup", {"operation": "tick_hour"})
+
+    assert mock_db.update_game_metadata_diff.call_count == 1
+    engine._schedule_cloud_task.assert_not_called()
+    assert engine.rebase_stats["conflict"] == 1
+
+@pytest.mark.asyncio
+async def test_dispatch_input_versions_chat_writes_separately(engine, mock_db):
+    class ChatCartridge(MockCartridge):
+        REBASE_SAFE_PATHS = ["drones.*.night_chat_log"]
+
+        async def handle_input(self, state, user_input, ctx, tools):
+            if user_input == "!rename":
+                return {"drones.d1.name": "Rex"}
+            return {"drones.d1.night_chat_log": [f"Foster: {user_input}"]}
+
+    engine._load_cartridge = AsyncMock(return_value=ChatCartridge())
+    mock_db.get_game_by_id.return_value = GameState(
+        id="g_chat", story_id="test", host_id="u1", status="active", created_at="2024-01-01",
+        metadata={"drones": {"d1": {"night_chat_log": []}}}
+    )
+
+    await engine.dispatch_input("c1", "u1", "Alice", "hi", "g_chat")
+    mock_db.update_game_metadata_fields.assert_called_once_with(
+        "g_chat", {"drones.d1.night_chat_log": ["Foster: hi"]}, version_field="chat_version"
+    )
+
+    # Anything outside the chat paths still bumps the task version
+    await engine.dispatch_input("c1", "u1", "Alice", "!rename", "g_chat")
+    mock_db.update_game_metadata_fields.assert_called_with("g_chat", {"drones.d1.name": "Rex"})
+
+@pytest.mark.asyncio
+async def test_dispatch_task_offloads_log_lines_near_size_limit(engine, mock_db):
+    class ChattyCartridge(MockCartridge):
+        LOG_STREAMS = {"drones.*.daily_memory": None}
+
+        async def handle_task(self, state, payload, ctx, tools):
+            metadata = dict(state["metadata"])
+            metadata["drones"] = {"d1": {"daily_memory": metadata["drones"]["d1"]["daily_memory"] + ["y" * 400]}}
+            return {"metadata": metadata}
+
+    engine._load_cartridge = AsyncMock(return_value=ChattyCartridge())
+    mock_db.get_game_by_id.return_value = GameState(
+        id="g_big", story_id="test", host_id="u1", status="active", created_at="2024-01-01", version=3,
+        metadata={"drones": {"d1": {"daily_memory": ["x" * 400] * 5}}}
+    )
+
+    with patch("app.game_engine.config.STATE_SIZE_OFFLOAD_BYTES", 2000), \
+         patch("app.game_engine.config.STATE_SIZE_TARGET_BYTES", 1500):
+        await engine.dispatch_task("test", "g_big", {"operation": "tick"})
+
+    _, diff, _, log_lines = mock_db.update_game_metadata_diff.call_args[0][:4]
+    # The document keeps only the newest lines; the new one is still archived to its stream
+    assert diff.sets["drones.d1.daily_memory"] == ["x" * 400, "x" * 400, "y" * 400]
+    assert log_lines == [("drones.d1.daily_memory", ["y" * 400])]
+    # The lines already in the document are handed over for archiving before they are shed
+    mock_db.archive_legacy_lines.assert_awaited_once_with("g_big", [("drones.d1.daily_memory", ["x" * 400] * 5)])
+
+@pytest.mark.asyncio
+async def test_blob_encoded_state_is_measured_compressed(engine, mock_db):
+    class ChattyCartridge(MockCartridge):
+        LOG_STREAMS = {"drones.*.daily_memory": None}
+
+        async def handle_task(self, state, payload, ctx, tools):
+            metadata = dict(state["metadata"])
+            metadata["drones"] = {"d1": {"daily_memory": metadata["drones"]["d1"]["daily_memory"] + ["x" * 400]}}
+            return {"metadata": metadata}
+
+    engine._load_cartridge = AsyncMock(return_value=ChattyCartridge())
+    mock_db.state_encoding = "blob"
+    mock_db.encoded_state_size = MagicMock(return_value=300)
+    mock_db.get_game_by_id.return_value = GameState(
+        id="g_blob", story_id="test", host_id="u1", status="active", created_at="2024-01-01", version=3,
+        metadata={"drones": {"d1": {"daily_memory": ["x" * 400] * 5}}}
+    )
+
+    with patch("app.game_engine.config.STATE_SIZE_OFFLOAD_BYTES", 2000), \
+         patch("app.game_engine.config.STATE_SIZE_TARGET_BYTES", 1500):
+        await engine.dispatch_task("test", "g_blob", {"operation": "tick"})
+
+    # Repetitive lines compress far below the limit, so nothing leaves the document
+    diff = mock_db.update_game_metadata_diff.call_args[0][1]
+    assert diff.sets["drones.d1.daily_memory"] == ["x" * 400] * 6
+    mock_db.archive_legacy_lines.assert_not_called()
@@ -0,0 +1,44 @@
+import pytest
+from unittest.mock import patch
+
+from app import config, io_stats
+from app.models import GameState
+from app.persistence import PersistenceLayer
+from app.storage.base import document_size, estimate_size
+
+def test_estimate_size_follows_firestore_rules():
+    assert estimate_size("abc") == 4
+    assert estimate_size({"n": 1, "ok": True, "none": None}) == (2 + 8) + (3 + 1) + (5 + 1)
+    assert estimate_size(["ab", 2.5]) == 3 + 8
+    assert document_size({}) == 32
+
+def test_latency_histogram_quantiles():
+    histogram = io_stats.LatencyHistogram()
+    for elapsed_ms in [0.5, 3, 3, 4, 40, 9000]:
+        histogram.observe(elapsed_ms)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 6
+    assert (snapshot["p50_ms"], snapshot["p95_ms"]) == (5, 9000)
+    assert snapshot["buckets"]["le_5"] == 3 and snapshot["buckets"]["le_inf"] == 1
+
+@pytest.mark.asyncio
+async def test_scope_aggregates_persistence_io():
+    with patch.object(config, "STORAGE_BACKEND", "memory"):
+        layer = PersistenceLayer()
+    layer.journal_enabled = False
+    io_stats.stats.reset()
+
+    game = GameState(id="g1", story_id="foster-protocol", host_id="u1", status="active",
+                     created_at="2024-01-01T00:00:00Z", metadata={"log": ["x" * 100]})
+    with io_stats.scope("task test:tick") as scope:
+        await layer.create_game_record(game)
+        await layer.get_game_by_id("g1", use_cache=False)
+
+    # Header + state written, then both read back in one get_all
+    assert (scope.io.reads, scope.io.writes, scope.calls) == (2, 2, 2)
+    assert scope.io.bytes_read == scope.io.bytes_written > 100
+
+    snapshot = io_stats.stats.snapshot()
+    assert snapshot["methods"]["get_game_by_id"]["reads"] == 2
+    assert snapshot["methods"]["get_game_by_id"]["latency"]["count"] == 1
+    assert snapshot["scopes"]["task test:tick"]["writes"] == 2
@@ -24,3 +24,29 @@ def test_dashboard_routes_exist():
         routes = [route.path for route in app.routes]
         assert "/dashboard" in routes
         assert "/dashboard/{game_id}" in routes
+
+def test_metrics_report_the_engine_ai_limiters():
+    """The game engine's AI calls and /ops/metrics share one AIEngine."""
+    from app import ai_engine, config, game_engine
+    assert game_engine.engine.ai is ai_engine.ai
+
+    limiter = game_engine.engine.ai._limiter("gemini-test")
+    limiter.throttled = 2
+    try:
+        with patch.object(config, "OPS_KEY", "ops-test-key"):
+            response = client.get("/ops/metrics", headers={"X-Ops-Key": "ops-test-key"})
+    finally:
+        ai_engine.ai.limiters.pop("gemini-test", None)
+    assert response.status_code == 200
+    assert response.json()["ai_concurrency"]["gemini-test"]["throttled"] == 2
+
+def test_metrics_report_the_engine_context_caches():
+    from app import config, game_engine
+    prompt_cache = game_engine.engine.ai.prompt_cache
+    prompt_cache.created += 1
+    try:
+        with patch.object(config, "OPS_KEY", "ops-test-key"):
+            response = client.get("/ops/metrics", headers={"X-Ops-Key": "ops-test-key"})
+    finally:
+        prompt_cache.created -= 1
+    assert response.json()["ai_context_cache"]["created"] == prompt_cache.created + 1
@@ -1,7 +1,12 @@
 import pytest
-from unittest.mock import AsyncMock, MagicMock, patch
-from app.persistence import PersistenceLayer
-from app.models import AILogEntry
+import datetime
+from unittest.mock import AsyncMock, MagicMock, PropertyMock, patch
+from app import config
+from app import io_stats
+from app.persistence import PersistenceLayer, GameStateCache, CacheCoherence, STATE_DOC_OVERHEAD_BYTES
+from app.storage.base import estimate_size
+from app.state_diff import diff_metadata
+from app.models import AILogEntry, GameState, GameInterface, LobbyPlayer
 
 @pytest.mark.asyncio
 async def test_log_ai_interaction():
@@ -44,4 +49,721 @@ async def test_log_ai_interaction():
         # Verify
         mock_games_col.document.assert_called_with("test_game")
         mock_game_doc.collection.assert_called_with("logs")
-        mock_logs_col.add.assert_called_once()
\ No newline at end of file
+        mock_logs_col.add.assert_called_once()
+
+# --- GAME STATE CACHE ---
+
+def _make_game(game_id="g1", version=1, status="active"):
+    return GameState(
+        id=game_id, story_id="foster-protocol", host_id="u1",
+        status=status, created_at="2024-01-01T00:00:00Z", version=version
+    )
+
+def _make_layer(mock_games_col):
+    mock_client = MagicMock()
+    mock_client.collection.return_value = mock_games_col
+    with patch("app.persistence.firestore.AsyncClient", return_value=mock_client):
+        layer = PersistenceLayer()
+    layer.games_collection = mock_games_col
+    # Mocked clients cannot run transactions; the journaled paths are covered on the memory backend
+    layer.journal_enabled = False
+    return layer
+
+def _memory_layer(snapshot_interval=50, journal=True):
+    with patch.object(config, "STORAGE_BACKEND", "memory"):
+        layer = PersistenceLayer()
+    # The journal is off by default; most tests here run the journaled paths
+    layer.journal_enabled = journal
+    layer.snapshot_interval = snapshot_interval
+    return layer
+
+def test_game_cache_lru_eviction_and_counters():
+    cache = GameStateCache(max_entries=2, ttl_seconds=60)
+    cache.put(_make_game("a"))
+    cache.put(_make_game("b"))
+    assert cache.get("a") is not None  # 'a' becomes most recently used
+    cache.put(_make_game("c"))          # evicts 'b'
+
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 1
+
+def test_game_cache_ttl_expiry():
+    cache = GameStateCache(max_entries=4, ttl_seconds=0)
+    cache.put(_make_game("a"))
+    with patch("app.persistence.time.monotonic", return_value=10**9):
+        assert cache.get("a") is None
+
+def test_game_cache_rejects_older_version():
+    cache = GameStateCache(max_entries=4, ttl_seconds=60)
+    cache.put(_make_game("a", version=5))
+    cache.put(_make_game("a", version=3))
+    assert cache.get("a").version == 5
+
+def test_game_cache_returns_copies():
+    cache = GameStateCache(max_entries=4, ttl_seconds=60)
+    cache.put(_make_game("a"))
+    cache.get("a").interface.channels["x"] = "1"
+    assert cache.get("a").interface.channels == {}
+
+def _snapshot(doc_id, data):
+    doc = MagicMock()
+    doc.id = doc_id
+    doc.exists = data is not None
+    doc.to_dict.return_value = data
+    return doc
+
+def _mock_get_all(layer, docs):
+    calls = []
+    async def _get_all(refs, field_paths=None):
+        calls.append((refs, field_paths))
+        for doc in docs:
+            yield doc
+    layer.db.get_all = _get_all
+    return calls
+
+def _write_batch(layer):
+    batch = MagicMock()
+    batch.commit = AsyncMock()
+    layer.db.batch = MagicMock(return_value=batch)
+    return batch
+
+@pytest.mark.asyncio
+async def test_get_game_by_id_serves_cache_only_when_coherent():
+    header, state = PersistenceLayer._split_game(_make_game("g1", version=4))
+    mock_games_col = MagicMock()
+    state_ref = mock_games_col.document.return_value.collection.return_value.document.return_value
+    state_ref.get = AsyncMock(return_value=_snapshot("current", state))
+    layer = _make_layer(mock_games_col)
+    calls = _mock_get_all(layer, [_snapshot("g1", header), _snapshot("current", state)])
+
+    # Without the listener nothing vouches for a cached entry, so every load reads both halves
+    await layer.get_game_by_id("g1")
+    await layer.get_game_by_id("g1")
+    assert [len(refs) for refs, _ in calls] == [2, 2]
+
+    with patch.object(CacheCoherence, "running", new_callable=PropertyMock, return_value=True):
+        assert (await layer.get_game_by_id("g1")).version == 4
+        assert len(calls) == 2 and state_ref.get.await_count == 0
+        # Bypassing the cache rereads the state only; the coherent header still serves
+        await layer.get_game_by_id("g1", use_cache=False)
+    assert len(calls) == 2 and state_ref.get.await_count == 1
+
+@pytest.mark.asyncio
+async def test_get_game_by_id_rereads_state_behind_a_matching_header():
+    layer = _memory_layer()
+    game = _make_game("g1")
+    game.metadata = {"night_chat_log": ["hi"]}
+    await layer.create_game_record(game)
+    await layer.get_game_by_id("g1")
+
+    # Another instance clears the log: our cache never saw the write
+    other = _memory_layer()
+    other.db = layer.db
+    other.games_collection = layer.games_collection
+    await other.update_game_metadata_fields("g1", {"night_chat_log": []}, version_field="chat_version")
+
+    layer.db.get_all = MagicMock(side_effect=AssertionError("the cached header matches"))
+    header = await layer.get_game_header("g1", use_cache=False)
+    fresh = await layer.get_game_by_id("g1", header=header)
+    assert fresh.metadata["night_chat_log"] == []
+    assert (fresh.story_id, fresh.created_at) == (game.story_id, game.created_at)
+    assert layer.game_cache.stats()["stale"] == 1
+
+@pytest.mark.asyncio
+async def test_get_game_by_id_builds_a_miss_from_the_projected_header():
+    layer = _memory_layer()
+    game = _make_game("g1")
+    game.players = [LobbyPlayer(id="u1", name="Alice")]
+    game.metadata = {"phase": "night", "day": 2}
+    await layer.create_game_record(game)
+    layer.game_cache.clear()
+
+    header = await layer.get_game_header("g1", use_cache=False)
+    layer.db.get_all = MagicMock(side_effect=AssertionError("the header document is read once"))
+    loaded = await layer.get_game_by_id("g1", header=header)
+
+    assert loaded.metadata == {"phase": "night", "day": 2}
+    assert (loaded.players, loaded.created_at, loaded.seq) == (game.players, game.created_at, game.seq)
+
+@pytest.mark.asyncio
+async def test_get_game_by_id_migrates_inline_metadata():
+    legacy = _make_game("g1", version=6).model_dump()
+    legacy["metadata"] = {"phase": "night", "day": 2}
+    legacy.pop("header_version")
+    layer = _make_layer(MagicMock())
+    _mock_get_all(layer, [_snapshot("g1", legacy), _snapshot("current", None)])
+    batch = _write_batch(layer)
+
+    game = await layer.get_game_by_id("g1")
+
+    assert game.metadata == {"phase": "night", "day": 2}
+    assert game.version == 6
+    state = batch.create.call_args[0][1]
+    assert state["metadata"] == {"phase": "night", "day": 2} and state["version"] == 6
+    header_update = batch.update.call_args[0][1]
+    assert header_update["phase"] == "night"
+    assert header_update["schema_version"] == 3
+    batch.commit.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_header_writes_leave_state_version_alone():
+    layer = _make_layer(MagicMock())
+    batch = _write_batch(layer)
+    layer.game_cache.put(_make_game("g1", version=5))
+
+    await layer.commit_channel_provisioning("g1", GameInterface(callsign="ALPHA"), [])
+
+    update = batch.update.call_args[0][1]
+    assert "version" not in update and update["interface"]["callsign"] == "ALPHA"
+    batch.set.assert_not_called()
+    cached = layer.game_cache.get("g1")
+    assert (cached.version, cached.header_version) == (5, 2)
+
+def test_game_cache_merges_halves_by_version():
+    cache = GameStateCache(max_entries=4, ttl_seconds=60)
+    newer_state = _make_game("a", version=5)
+    newer_state.metadata = {"day": 3}
+    cache.put(newer_state)
+
+    newer_header = _make_game("a", version=4)
+    newer_header.header_version = 2
+    newer_header.status = "ended"
+    cache.put(newer_header)
+
+    cached = cache.get("a")
+    assert (cached.status, cached.header_version) == ("ended", 2)
+    assert (cached.metadata, cached.version) == ({"day": 3}, 5)
+
+@pytest.mark.asyncio
+async def test_get_game_header_uses_projection_or_cache():
+    mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = {
+        "id": "g1", "story_id": "foster-protocol", "host_id": "u1",
+        "status": "active", "header_version": 7, "phase": "night"
+    }
+
+    mock_games_col = MagicMock()
+    mock_games_col.document.return_value.get = AsyncMock(return_value=mock_doc)
+    layer = _make_layer(mock_games_col)
+
+    header = await layer.get_game_header("g1")
+    assert (header.status, header.header_version, header.phase) == ("active", 7, "night")
+    _, kwargs = mock_games_col.document.return_value.get.call_args
+    assert "metadata.phase" in kwargs["field_paths"]
+    assert "metadata" not in kwargs["field_paths"]
+
+    # A cached game answers without any read
+    game = _make_game("g2")
+    game.header_version = 3
+    layer.game_cache.put(game)
+    header = await layer.get_game_header("g2")
+    assert header.header_version == 3
+    assert mock_games_col.document.return_value.get.await_count == 1
+
+@pytest.mark.asyncio
+async def test_own_writes_refresh_cache():
+    mock_games_col = MagicMock()
+    mock_games_col.document.return_value.update = AsyncMock()
+    state_ref = mock_games_col.document.return_value.collection.return_value.document.return_value
+    state_ref.update = AsyncMock()
+    layer = _make_layer(mock_games_col)
+    batch = _write_batch(layer)
+    layer.game_cache.put(_make_game("g1", version=2, status="setup"))
+
+    await layer.set_game_active("g1")
+    await layer.update_game_metadata_fields("g1", {"drones.d1.name": "Rex"})
+
+    # Status goes to the header and (for listener scoping) the state document in one batch
+    batch.commit.assert_awaited_once()
+    state_ref.update.assert_awaited_once()
+    header, state = PersistenceLayer._split_game(layer.game_cache.get("g1"))
+    _mock_get_all(layer, [_snapshot("g1", header), _snapshot("current", state)])
+    cached = await layer.get_game_by_id("g1")
+    assert cached.status == "active"
+    assert cached.metadata["drones"]["d1"]["name"] == "Rex"
+    assert (cached.version, cached.header_version) == (3, 2)
+
+@pytest.mark.asyncio
+async def test_phase_is_mirrored_onto_header():
+    mock_games_col = MagicMock()
+    layer = _make_layer(mock_games_col)
+    batch = _write_batch(layer)
+
+    await layer.update_game_metadata_fields("g1", {"phase": "day", "day": 4})
+
+    updates = [c[0][1] for c in batch.update.call_args_list]
+    assert {"version", "metadata.phase", "metadata.day"} <= set(updates[0])
+    assert updates[1] == {"phase": "day"}
+
+
+# --- CHANNEL INDEX ---
+
+@pytest.mark.asyncio
+async def test_channel_index_caches_negative_lookups():
+    missing_doc = MagicMock()
+    missing_doc.exists = False
+    mock_channels_col = MagicMock()
+    mock_channels_col.document.return_value.get = AsyncMock(return_value=missing_doc)
+
+    layer = _make_layer(MagicMock())
+    layer.channels_collection = mock_channels_col
+
+    assert await layer.get_game_id_by_channel_index("chatter") is None
+    assert await layer.get_game_id_by_channel_index("chatter") is None
+    assert mock_channels_col.document.return_value.get.await_count == 1
+    assert layer.channel_index.stats()["negative_hits"] == 1
+
+@pytest.mark.asyncio
+async def test_channel_index_register_and_remove_invalidate():
+    mock_channels_col = MagicMock()
+    mock_channels_col.document.return_value.set = AsyncMock()
+    mock_channels_col.document.return_value.delete = AsyncMock()
+    mock_channels_col.document.return_value.get = AsyncMock()
+
+    layer = _make_layer(MagicMock())
+    layer.channels_collection = mock_channels_col
+    layer.channel_index.store("c1", None)
+
+    await layer.register_channel_association("c1", "g1")
+    assert await layer.get_game_id_by_channel_index("c1") == "g1"
+
+    await layer.remove_channel_association("c1")
+    assert await layer.get_game_id_by_channel_index("c1") is None
+    mock_channels_col.document.return_value.get.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_channel_provisioning_is_one_batch():
+    layer = _make_layer(MagicMock())
+    layer.channels_collection = MagicMock()
+    batch = _write_batch(layer)
+    layer.game_cache.put(_make_game("g1"))
+    interface = GameInterface(channels={"aux-comm": "c1", "nanny_u1": "c2"}, listener_ids=["c1", "c2"])
+
+    await layer.commit_channel_provisioning("g1", interface, ["c1", "c2"])
+
+    batch.commit.assert_awaited_once()
+    assert batch.set.call_count == 2
+    assert batch.update.call_args[0][1]["interface"]["listener_ids"] == ["c1", "c2"]
+    assert layer.channel_index.lookup("c2") == (True, "g1")
+    assert layer.game_cache.get("g1").interface.channels["aux-comm"] == "c1"
+
+    await layer.remove_channel_associations(["c1", "c2"])
+    assert batch.delete.call_count == 2
+    assert batch.commit.await_count == 2
+    assert layer.channel_index.lookup("c1") == (True, None)
+
+@pytest.mark.asyncio
+async def test_channel_lookup_racing_provisioning_keeps_the_association():
+    layer = _make_layer(MagicMock())
+    _write_batch(layer)
+    layer.channels_collection = MagicMock()
+    missing_doc = MagicMock()
+    missing_doc.exists = False
+
+    # The index read misses, and provisioning commits before the read returns
+    async def _read_before_commit():
+        await layer.commit_channel_provisioning("g1", GameInterface(listener_ids=["c1"]), ["c1"])
+        return missing_doc
+    layer.channels_collection.document.return_value.get = _read_before_commit
+
+    assert await layer.get_game_id_by_channel_index("c1") is None
+    assert layer.channel_index.lookup("c1") == (True, "g1")
+
+    # A negative cached before provisioning is overwritten by the commit
+    layer.channel_index.store("c2", None)
+    await layer.commit_channel_provisioning("g1", GameInterface(listener_ids=["c1", "c2"]), ["c2"])
+    assert layer.channel_index.lookup("c2") == (True, "g1")
+
+@pytest.mark.asyncio
+async def test_warm_channel_index():
+    def _doc(doc_id, game_id):
+        d = MagicMock()
+        d.id = doc_id
+        d.to_dict.return_value = {"game_id": game_id}
+        return d
+
+    async def _stream():
+        for d in [_doc("c1", "g1"), _doc("c2", "g2")]:
+            yield d
+
+    mock_channels_col = MagicMock()
+    mock_channels_col.stream = _stream
+    mock_channels_col.document.return_value.get = AsyncMock()
+
+    layer = _make_layer(MagicMock())
+    layer.channels_collection = mock_channels_col
+
+    assert await layer.warm_channel_index() == 2
+    assert await layer.get_game_id_by_channel_index("c2") == "g2"
+    mock_channels_col.document.return_value.get.assert_not_called()
+
+
+# --- CACHE COHERENCE ---
+
+def test_coherence_applies_remote_changes():
+    layer = _make_layer(MagicMock())
+    layer.game_cache.put(_make_game("g1", version=2))
+    layer.game_cache.put(_make_game("g2", version=1))
+
+    remote = _make_game("g1", version=3)
+    remote.interface.listener_ids = ["c9"]
+    layer.coherence.apply_game_changes([
+        ("g1", remote.model_dump()),
+        ("g2", None),
+    ])
+
+    assert layer.game_cache.get("g1").version == 3
+    assert layer.game_cache.get("g2") is None
+    assert layer.channel_index.lookup("c9") == (True, "g1")
+
+def test_coherence_applies_remote_state_changes():
+    layer = _make_layer(MagicMock())
+    layer.game_cache.put(_make_game("g1", version=2))
+
+    header, _ = PersistenceLayer._split_game(_make_game("g1", version=2))
+    header["header_version"] = 4
+    layer.coherence.apply_game_changes([("g1", header)])
+    layer.coherence.apply_state_changes([("g1", {"metadata": {"day": 9}, "version": 3}), ("g_other", {"version": 1})])
+
+    cached = layer.game_cache.get("g1")
+    assert (cached.header_version, cached.version, cached.metadata) == (4, 3, {"day": 9})
+    # A state change for a game we do not hold cannot build an entry
+    assert layer.game_cache.get("g_other") is None
+
+def test_coherence_ignores_stale_snapshot():
+    layer = _make_layer(MagicMock())
+    layer.game_cache.put(_make_game("g1", version=5))
+    layer.coherence.apply_game_changes([("g1", _make_game("g1", version=4).model_dump())])
+    assert layer.game_cache.get("g1").version == 5
+
+
+# --- CONTENT-ADDRESSED PROMPTS ---
+
+@pytest.mark.asyncio
+async def test_get_game_logs_reassembles_prompts():
+    def _log_doc(data):
+        d = MagicMock()
+        d.to_dict.return_value = data
+        return d
+
+    async def _stream():
+        yield _log_doc({"prompt_hash": "abc", "system_prompt": "\n\nsuffix"})
+        yield _log_doc({"system_prompt": "plain"})
+
+    mock_games_col = MagicMock()
+    logs_ref = mock_games_col.document.return_value.collection.return_value
+    logs_ref.order_by.return_value.limit.return_value.stream = _stream
+    layer = _make_layer(mock_games_col)
+    layer._prompt_texts["abc"] = "BASE"
+
+    logs = await layer.get_game_logs("g1")
+
+    assert logs[0]["system_prompt"] == "BASE\n\nsuffix"
+    assert logs[1]["system_prompt"] == "plain"
+
+@pytest.mark.asyncio
+async def test_dashboard_pages_projected_games_and_logs():
+    layer = _memory_layer()
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    for i in range(5):
+        game = _make_game(f"g{i}")
+        game.created_at = start + datetime.timedelta(days=i)
+        game.metadata = {"big": "x" * 100}
+        await layer.create_game_record(game)
+
+    first, cursor = await layer.list_games(limit=3)
+    assert [g["id"] for g in first] == ["g4", "g3", "g2"]
+    assert "metadata" not in first[0] and "interface" not in first[0]
+    rest, cursor = await layer.list_games(limit=3, before=cursor)
+    assert [g["id"] for g in rest] == ["g1", "g0"] and cursor is None
+
+    layer._prompt_texts["abc"] = "BASE"
+    for i in range(3):
+        await layer.log_ai_interaction(AILogEntry(
+            timestamp=start + datetime.timedelta(minutes=i), game_id="g1", model="m",
+            system_prompt=f"-{i}", prompt_hash="abc", user_input=f"in {i}", raw_response="out"
+        ))
+    logs, cursor = await layer.get_game_log_page("g1", limit=2)
+    assert [log["user_input"] for log in logs] == ["in 2", "in 1"]
+    assert "system_prompt" not in logs[0]
+    older, _ = await layer.get_game_log_page("g1", limit=2, before=cursor)
+    assert [log["user_input"] for log in older] == ["in 0"]
+
+    assert await layer.get_log_prompt("g1", logs[0]["id"]) == "BASE-2"
+    assert await layer.get_log_prompt("g1", "missing") is None
+
+@pytest.mark.asyncio
+async def test_dashboard_pages_through_equal_timestamps():
+    layer = _memory_layer()
+    created = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    for i in range(5):
+        game = _make_game(f"g{i}")
+        game.created_at = created
+        await layer.create_game_record(game)
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = await layer.list_games(limit=2, before=cursor)
+        seen.extend(g["id"] for g in page)
+        if cursor is None:
+            break
+    assert seen == ["g4", "g3", "g2", "g1", "g0"]
+
+    for i in range(3):
+        await layer.log_ai_interaction(AILogEntry(
+            timestamp=created, game_id="g1", model="m", system_prompt="s", user_input=f"in {i}", raw_response="out"
+        ))
+    logs, cursor = await layer.get_game_log_page("g1", limit=2)
+    older, _ = await layer.get_game_log_page("g1", limit=2, before=cursor)
+    assert sorted(log["user_input"] for log in logs + older) == ["in 0", "in 1", "in 2"]
+    assert cursor[1] == logs[-1]["id"]
+
+@pytest.mark.asyncio
+async def test_store_prompt_writes_once():
+    layer = _make_layer(MagicMock())
+    layer.prompts_collection = MagicMock()
+    layer.prompts_collection.document.return_value.set = AsyncMock()
+
+    await layer.store_prompt("abc", "BASE")
+    await layer.store_prompt("abc", "BASE")
+
+    layer.prompts_collection.document.return_value.set.assert_awaited_once()
+
+
+# --- AI LOG WRITE-BEHIND ---
+
+@pytest.mark.asyncio
+async def test_ai_log_writer_batches_entries_and_prompts():
+    layer = _make_layer(MagicMock())
+    write_batch = MagicMock()
+    write_batch.commit = AsyncMock()
+    layer.db.batch = MagicMock(return_value=write_batch)
+    layer.prompts_collection = MagicMock()
+    layer.log_writer.flush_interval = 0.05
+
+    for i in range(3):
+        entry = AILogEntry(
+            game_id="g1", model="gemini", system_prompt=f"suffix {i}",
+            prompt_hash="abc", user_input="u", raw_response="r"
+        )
+        await layer.enqueue_ai_log(entry, "BASE")
+    await layer.log_writer.drain()
+
+    write_batch.commit.assert_awaited_once()
+    # One prompt document plus three log rows in a single batch
+    assert write_batch.set.call_count == 4
+    assert layer._prompt_texts["abc"] == "BASE"
+    assert layer.log_writer.stats()["entries_written"] == 3
+
+@pytest.mark.asyncio
+async def test_ai_log_writer_retries_failed_commits():
+    layer = _make_layer(MagicMock())
+    write_batch = MagicMock()
+    write_batch.commit = AsyncMock(side_effect=[Exception("unavailable"), None])
+    layer.db.batch = MagicMock(return_value=write_batch)
+    layer.log_writer.flush_interval = 0.05
+    layer.log_writer.retry_backoff = 0.01
+
+    entry = AILogEntry(game_id="g1", model="gemini", system_prompt="s", user_input="u", raw_response="r")
+    await layer.enqueue_ai_log(entry)
+    await layer.log_writer.drain()
+
+    stats = layer.log_writer.stats()
+    assert (stats["entries_written"], stats["entries_failed"], stats["commit_retries"]) == (1, 0, 1)
+    # The retry rewrites the same log document rather than allocating a new one
+    logs_col = layer.games_collection.document.return_value.collection.return_value
+    assert logs_col.document.call_count == 1 and write_batch.set.call_count == 2
+
+    # A batch that keeps failing is dropped once the attempts run out
+    write_batch.commit = AsyncMock(side_effect=Exception("unavailable"))
+    await layer.enqueue_ai_log(entry)
+    await layer.log_writer.drain()
+    assert write_batch.commit.await_count == layer.log_writer.retry_attempts + 1
+    assert layer.log_writer.stats()["entries_failed"] == 1
+
+
+# --- TOKEN USAGE ---
+
+@pytest.mark.asyncio
+async def test_token_usage_is_coalesced_per_game():
+    mock_games_col = MagicMock()
+    mock_games_col.document.return_value.update = AsyncMock()
+    layer = _make_layer(mock_games_col)
+
+    layer.record_token_usage("g1", 10, 1)
+    layer.record_token_usage("g1", 20, 2)
+    layer.record_token_usage("g2", 5, 5)
+    await layer.flush_token_usage("g1")
+
+    mock_games_col.document.return_value.update.assert_awaited_once()
+    assert layer._pending_usage == {"g2": [5, 5]}
+
+    await layer.flush_token_usage()
+    assert mock_games_col.document.return_value.update.await_count == 2
+    assert layer._pending_usage == {}
+
+
+# --- JOURNAL ---
+
+@pytest.mark.asyncio
+async def test_journal_rebuilds_any_version():
+    layer = _memory_layer(snapshot_interval=3)
+    await layer.create_game_record(_make_game("g1"))
+
+    history = {1: {}}
+    current = {}
+    for day in range(1, 6):
+        after = {**current, "day": day, "log": current.get("log", []) + [f"day {day}"]}
+        version = max(history)
+        assert await layer.update_game_metadata_diff("g1", diff_metadata(current, after), version)
+        current = after
+        history[version + 1] = after
+    await layer.update_game_metadata_fields("g1", {"phase": "day"})
+    current = {**current, "phase": "day"}
+    history[max(history) + 1] = current
+
+    snapshots = [doc.id async for doc in layer._snapshots_ref("g1").stream()]
+    assert snapshots == ["000000000001", "000000000003", "000000000006"]
+
+    for version, metadata in history.items():
+        assert await layer.rebuild_metadata("g1", version) == (version, metadata)
+    assert await layer.rebuild_metadata("g1") == (7, current)
+
+@pytest.mark.asyncio
+async def test_restore_metadata_rolls_back_and_journals():
+    layer = _memory_layer()
+    await layer.create_game_record(_make_game("g1"))
+    assert await layer.update_game_metadata("g1", {"day": 1}, 1)
+    assert await layer.update_game_metadata("g1", {"day": 2, "broken": True}, 2)
+
+    assert await layer.restore_metadata("g1", 2) is True
+
+    game = await layer.get_game_by_id("g1", use_cache=False)
+    assert (game.version, game.metadata) == (4, {"day": 1})
+    assert await layer.rebuild_metadata("g1") == (4, {"day": 1})
+
+
+@pytest.mark.asyncio
+async def test_chat_writes_do_not_invalidate_task_version():
+    layer = _memory_layer()
+    await layer.create_game_record(_make_game("g1"))
+    base = {"hour": 1, "drones": {"d1": {"night_chat_log": []}}}
+    assert await layer.update_game_metadata("g1", base, 1)
+
+    # A nanny chat lands while a task that read version 2 is running
+    await layer.update_game_metadata_fields("g1", {"drones.d1.night_chat_log": ["Foster: hi"]}, version_field="chat_version")
+    game = await layer.get_game_by_id("g1", use_cache=False)
+    assert (game.version, game.chat_version, game.seq) == (2, 2, 3)
+
+    # A task that leaves the chat paths alone commits against the version it read
+    assert await layer.update_game_metadata_diff("g1", diff_metadata(base, {**base, "hour": 2}), 2)
+    # One that rewrites them must also match the chat version it read
+    cleared = {"hour": 3, "drones": {"d1": {"night_chat_log": []}}}
+    stale = diff_metadata({**base, "hour": 2}, cleared)
+    assert not await layer.update_game_metadata_diff("g1", stale, 3, expected_chat_version=1)
+
+    game = await layer.get_game_by_id("g1", use_cache=False)
+    assert game.metadata == {"hour": 2, "drones": {"d1": {"night_chat_log": ["Foster: hi"]}}}
+    # Every commit, whichever domain, is in the journal
+    assert await layer.rebuild_metadata("g1") == (4, game.metadata)
+
+
+@pytest.mark.asyncio
+async def test_commits_record_estimated_state_size():
+    layer = _memory_layer()
+    await layer.create_game_record(_make_game("g1"))
+    metadata = {"log": ["x" * 1000]}
+
+    with patch.object(config, "STATE_SIZE_WARN_BYTES", 1000), patch("app.persistence.logging") as log:
+        assert await layer.update_game_metadata_diff("g1", diff_metadata({}, metadata), 1)
+    log.warning.assert_called_once()
+
+    state = (await layer._state_ref("g1").get()).to_dict()
+    assert state["state_bytes"] == estimate_size(metadata) + STATE_DOC_OVERHEAD_BYTES
+    journal = [doc.to_dict() async for doc in layer._journal_ref("g1").stream()]
+    assert journal[-1]["state_bytes"] == state["state_bytes"]
+    assert io_stats.stats.state_sizes["g1"]["bytes"] == state["state_bytes"]
+
+
+# --- STATE ENCODING ---
+
+@pytest.mark.asyncio
+async def test_blob_encoding_round_trips_and_converts_map_documents():
+    layer = _memory_layer()
+    await layer.create_game_record(_make_game("g1"))
+    first = {"day": 1, "drones": {"d1": {"log": ["a"]}}}
+    assert await layer.update_game_metadata_diff("g1", diff_metadata({}, first), 1)
+
+    layer.state_encoding = "blob"
+    second = {"day": 2, "drones": {"d1": {"log": ["a", "b"]}}}
+    assert await layer.update_game_metadata_diff("g1", diff_metadata(first, second), 2)
+    await layer.update_game_metadata_fields("g1", {"drones.d1.name": "Ace"}, version_field="chat_version")
+
+    state = (await layer._state_ref("g1").get()).to_dict()
+    assert "metadata" not in state and state["metadata_codec"] == "json-zlib-1"
+    assert state["state_bytes"] == len(state["metadata_blob"]) + STATE_DOC_OVERHEAD_BYTES
+
+    expected = {"day": 2, "drones": {"d1": {"log": ["a", "b"], "name": "Ace"}}}
+    fresh = await layer.get_game_by_id("g1", use_cache=False)
+    assert fresh.metadata == expected and (fresh.version, fresh.chat_version, fresh.seq) == (3, 2, 4)
+    assert (await layer.rebuild_metadata("g1"))[1] == expected
+
+    # Switching back rewrites the game as a map on its next commit
+    layer.state_encoding = "map"
+    assert await layer.update_game_metadata_diff("g1", diff_metadata(expected, {**expected, "day": 3}), 3)
+    state = (await layer._state_ref("g1").get()).to_dict()
+    assert "metadata_blob" not in state and state["metadata"]["day"] == 3
+
+@pytest.mark.asyncio
+async def test_archive_legacy_lines_fills_the_stream_in_order():
+    layer = _memory_layer()
+    await layer.create_game_record(_make_game("g1"))
+    # "a" and "b" were stored before the stream was archived
+    await layer.append_log_lines("g1", [("ship_logs", ["c", "d"])])
+
+    assert await layer.archive_legacy_lines("g1", [("ship_logs", ["a", "b", "c", "d"])]) == 2
+    lines, _ = await layer.get_log_stream("g1", "ship_logs")
+    assert [entry["line"] for entry in lines] == ["a", "b", "c", "d"]
+
+    # Once the stream covers the document, nothing more is written
+    assert await layer.archive_legacy_lines("g1", [("ship_logs", ["a", "b", "c", "d"])]) == 0
+
+
+# --- ARCHIVAL ---
+
+@pytest.mark.asyncio
+async def test_archive_game_compacts_and_reopens():
+    layer = _memory_layer()
+    await layer.create_game_record(_make_game("g1"))
+    assert await layer.update_game_metadata("g1", {"phase": "night", "blackbox_logs": ["boot"]}, 1)
+    await layer.log_ai_interaction(AILogEntry(
+        game_id="g1", model="gemini", system_prompt=" suffix", prompt_hash="abc",
+        user_input="u", raw_response="r"
+    ), static_prompt="BASE")
+    await layer.append_log_lines("g1", [("blackbox_logs", ["boot"])])
+
+    # Only ended games are archived
+    assert await layer.archive_game("g1") is False
+    await layer.mark_game_ended("g1")
+    assert await layer.archive_game("g1") is True
+
+    game_ref = layer.games_collection.document("g1")
+    assert [doc async for doc in game_ref.collection('logs').stream()] == []
+    assert [doc async for doc in layer._journal_ref("g1").stream()] == []
+    assert not (await layer._state_ref("g1").get()).exists
+    summary = await layer.get_game_by_id("g1", use_cache=False)
+    assert summary.status == "ended" and summary.archive["purged"] is True
+
+    layer._prompt_texts.clear()
+    archived = await layer.open_archive("g1")
+    assert archived["game"]["metadata"]["phase"] == "night"
+    assert archived["ai_logs"][0]["system_prompt"] == "BASE suffix"
+    assert [e["line"] for e in archived["log_streams"]["blackbox_logs"]] == ["boot"]
+
+    # Reruns (e.g. a redelivered task) are no-ops
+    assert await layer.archive_game("g1") is True
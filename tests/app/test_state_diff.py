@@ -0,0 +1,157 @@
+from app.state_diff import diff_metadata, estimate_size_after, offload_log_streams, rebase_metadata, split_log_streams
+from app.storage.base import estimate_size
+
+def test_diff_scalars_and_nested_paths():
+    before = {"hour": 1, "drones": {"d1": {"battery": 100, "name": None}}}
+    after = {"hour": 2, "drones": {"d1": {"battery": 90, "name": None}}}
+
+    diff = diff_metadata(before, after)
+
+    assert diff.sets == {"hour": 2, "drones.d1.battery": 90}
+    assert diff.appends == {}
+    assert diff.deletes == []
+
+def test_diff_list_growth_is_append():
+    before = {"ship_logs": ["a", "b"]}
+    after = {"ship_logs": ["a", "b", "c", "d"]}
+
+    diff = diff_metadata(before, after)
+
+    assert diff.appends == {"ship_logs": ["c", "d"]}
+    assert diff.sets == {}
+
+def test_diff_duplicate_append_falls_back_to_set():
+    # ArrayUnion would drop the repeated line, so the whole list must be written
+    before = {"log": ["You: hi"]}
+    after = {"log": ["You: hi", "You: hi"]}
+
+    diff = diff_metadata(before, after)
+
+    assert diff.sets == {"log": ["You: hi", "You: hi"]}
+    assert diff.appends == {}
+
+def test_diff_shrunk_list_and_removed_keys():
+    before = {"station": {"pending_deactivation": ["d1"]}, "drones": {"d1": {}, "d2": {}}}
+    after = {"station": {"pending_deactivation": []}, "drones": {"d1": {}}}
+
+    diff = diff_metadata(before, after)
+
+    assert diff.sets == {"station.pending_deactivation": []}
+    assert diff.deletes == ["drones.d2"]
+
+def test_diff_unsafe_keys_rewrite_parent():
+    before = {"scores": {"a.b": 1}}
+    after = {"scores": {"a.b": 2}}
+
+    diff = diff_metadata(before, after)
+
+    assert diff.sets == {"scores": {"a.b": 2}}
+
+def test_apply_to_reproduces_after():
+    before = {"hour": 1, "logs": ["x"], "drones": {"d1": {"battery": 5}, "d2": {}}}
+    after = {"hour": 2, "logs": ["x", "y"], "drones": {"d1": {"battery": 4}}, "new": {"k": 1}}
+
+    diff = diff_metadata(before, after)
+    diff.apply_to(before)
+
+    assert before == after
+
+# --- LOG STREAMS ---
+
+STREAMS = {"ship_logs": 3, "drones.*.night_chat_log": None}
+
+def test_split_log_streams_collects_new_lines():
+    before = {"ship_logs": ["a"], "drones": {"d1": {"night_chat_log": ["Foster: hi"]}, "d2": {"night_chat_log": []}}}
+    after = {"ship_logs": ["a", "b"], "drones": {"d1": {"night_chat_log": ["Foster: hi", "You: hello"]}, "d2": {"night_chat_log": []}}}
+
+    trimmed, lines = split_log_streams(before, after, STREAMS)
+
+    assert trimmed == after
+    assert sorted(lines) == [("drones.d1.night_chat_log", ["You: hello"]), ("ship_logs", ["b"])]
+
+def test_split_log_streams_trims_to_window():
+    before = {"ship_logs": ["a", "b", "c"]}
+    after = {"ship_logs": ["a", "b", "c", "d", "e"]}
+
+    trimmed, lines = split_log_streams(before, after, STREAMS)
+
+    assert trimmed["ship_logs"] == ["c", "d", "e"]
+    assert lines == [("ship_logs", ["d", "e"])]
+    # The caller's state is untouched
+    assert after["ship_logs"] == ["a", "b", "c", "d", "e"]
+
+def test_split_log_streams_archives_legacy_unwindowed_lists():
+    before = {"ship_logs": ["a", "b", "c", "d"]}
+    after = {"ship_logs": ["a", "b", "c", "d", "e"]}
+
+    trimmed, lines = split_log_streams(before, after, STREAMS)
+
+    assert trimmed["ship_logs"] == ["c", "d", "e"]
+    assert lines == [("ship_logs", ["a", "b", "c", "d", "e"])]
+
+def test_split_log_streams_cleared_list_archives_nothing():
+    before = {"drones": {"d1": {"night_chat_log": ["Foster: hi"]}}}
+    after = {"drones": {"d1": {"night_chat_log": []}}}
+
+    _, lines = split_log_streams(before, after, STREAMS)
+
+    assert lines == []
+
+# --- REBASE ---
+
+SAFE = ["drones.*.night_chat_log"]
+
+def test_rebase_keeps_concurrent_chat_and_task_result():
+    base = {"hour": 1, "drones": {"d1": {"battery": 90, "night_chat_log": ["Foster: hi"]}}}
+    ours = {"hour": 2, "drones": {"d1": {"battery": 80, "night_chat_log": ["Foster: hi"]}}}
+    latest = {"hour": 1, "drones": {"d1": {"battery": 90, "night_chat_log": ["Foster: hi", "You: hello"]}}}
+
+    merged, conflicts = rebase_metadata(base, ours, latest, SAFE)
+
+    assert conflicts == []
+    assert merged == {"hour": 2, "drones": {"d1": {"battery": 80, "night_chat_log": ["Foster: hi", "You: hello"]}}}
+
+def test_rebase_concatenates_lists_appended_on_both_sides():
+    base = {"drones": {"d1": {"night_chat_log": ["a"]}}}
+    ours = {"drones": {"d1": {"night_chat_log": ["a", "task"]}}}
+    latest = {"drones": {"d1": {"night_chat_log": ["a", "chat"]}}}
+
+    merged, _ = rebase_metadata(base, ours, latest, SAFE)
+
+    assert merged["drones"]["d1"]["night_chat_log"] == ["a", "chat", "task"]
+
+def test_rebase_rejects_unsafe_or_overlapping_changes():
+    base = {"hour": 1, "drones": {"d1": {"night_chat_log": ["a", "b"]}}}
+
+    # A duplicate delivery of the same task already advanced the hour
+    advanced = {**base, "hour": 2}
+    merged, conflicts = rebase_metadata(base, advanced, advanced, SAFE)
+    assert merged is None and conflicts == ["hour"]
+
+    # The task cleared the log that a chat appended to meanwhile
+    ours = {"hour": 1, "drones": {"d1": {"night_chat_log": []}}}
+    latest = {"hour": 1, "drones": {"d1": {"night_chat_log": ["a", "b", "c"]}}}
+    merged, conflicts = rebase_metadata(base, ours, latest, SAFE)
+    assert merged is None and conflicts == ["drones.d1.night_chat_log"]
+
+
+# --- SIZE GUARD ---
+
+def test_estimate_size_after_matches_applied_diff():
+    before = {"hour": 1, "name": "old", "log": ["a"], "gone": {"x": 1}}
+    after = {"hour": 2, "name": "a longer name", "log": ["a", "b"], "new": [1, 2]}
+    assert estimate_size_after(before, diff_metadata(before, after)) == estimate_size(after)
+
+def test_offload_log_streams_drops_oldest_lines_of_largest_stream():
+    metadata = {
+        "drones": {"d1": {"night_chat_log": [f"line {i}" for i in range(8)]}, "d2": {"night_chat_log": ["x"]}},
+        "hour": 3
+    }
+    target = estimate_size(metadata) - 20
+
+    trimmed, dropped = offload_log_streams(metadata, STREAMS, target)
+
+    assert estimate_size(trimmed) <= target
+    assert trimmed["drones"]["d1"]["night_chat_log"] == [f"line {i}" for i in range(4, 8)]
+    assert trimmed["drones"]["d2"]["night_chat_log"] == ["x"] and dropped == 4
+    assert len(metadata["drones"]["d1"]["night_chat_log"]) == 8
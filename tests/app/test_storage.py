@@ -0,0 +1,173 @@
+import asyncio
+import datetime
+import threading
+import pytest
+from unittest.mock import patch
+
+from app import config
+from app.models import GameState
+from app.persistence import PersistenceLayer
+from app.state_diff import diff_metadata
+from app.storage import AlreadyExists, NotFound
+from app.storage.memory_backend import MemoryBackend
+from app.storage.sqlite_backend import SQLiteBackend
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        store = MemoryBackend()
+    else:
+        store = SQLiteBackend(str(tmp_path / "store.sqlite3"))
+    yield store
+    store.close()
+
+# --- DOCUMENT SEMANTICS ---
+
+@pytest.mark.asyncio
+async def test_update_applies_dotted_paths_and_transforms(backend):
+    ref = backend.collection("games").document("g1")
+    await ref.set({"metadata": {"a": 1, "log": ["x"]}, "version": 1, "gone": True})
+
+    await ref.update({
+        "metadata.a": 2,
+        "metadata.b.c": "new",
+        "metadata.log": backend.ArrayUnion(["x", "y"]),
+        "version": backend.Increment(1),
+        "gone": backend.DELETE_FIELD,
+        "stamp": backend.SERVER_TIMESTAMP
+    })
+
+    data = (await ref.get()).to_dict()
+    assert data["metadata"] == {"a": 2, "b": {"c": "new"}, "log": ["x", "y"]}
+    assert data["version"] == 2
+    assert "gone" not in data
+    assert isinstance(data["stamp"], datetime.datetime)
+
+    projected = (await ref.get(field_paths=["version", "metadata.b"])).to_dict()
+    assert projected == {"version": 2, "metadata": {"b": {"c": "new"}}}
+
+@pytest.mark.asyncio
+async def test_update_and_create_preconditions(backend):
+    ref = backend.collection("users").document("u1")
+    with pytest.raises(NotFound):
+        await ref.update({"scratch_balance": 1})
+    await ref.create({"scratch_balance": 5})
+    with pytest.raises(AlreadyExists):
+        await ref.create({"scratch_balance": 0})
+
+@pytest.mark.asyncio
+async def test_batch_is_all_or_nothing(backend):
+    batch = backend.batch()
+    batch.set(backend.collection("channels").document("c1"), {"game_id": "g1"})
+    batch.update(backend.collection("games").document("missing"), {"status": "active"})
+    with pytest.raises(NotFound):
+        await batch.commit()
+    assert not (await backend.collection("channels").document("c1").get()).exists
+
+@pytest.mark.asyncio
+async def test_transaction_retries_after_concurrent_write(backend):
+    ref = backend.collection("users").document("u1")
+    await ref.set({"scratch_balance": 10})
+    attempts = []
+
+    @backend.transactional
+    async def _deduct(transaction, ref):
+        snapshot = await ref.get(transaction=transaction)
+        attempts.append(snapshot.to_dict()["scratch_balance"])
+        if len(attempts) == 1:
+            # Another writer lands between our read and our commit
+            await ref.update({"scratch_balance": backend.Increment(-4)})
+        transaction.update(ref, {"scratch_balance": snapshot.to_dict()["scratch_balance"] - 5})
+        return True
+
+    assert await _deduct(backend.transaction(), ref) is True
+    assert attempts == [10, 6]
+    assert (await ref.get()).to_dict()["scratch_balance"] == 1
+
+@pytest.mark.asyncio
+async def test_query_filter_order_limit(backend):
+    entries = backend.collection("games").document("g1").collection("entries")
+    for seq in [3, 1, 4, 2]:
+        await entries.document(f"e{seq}").set({"seq": seq})
+    await entries.document("no_seq").set({"other": True})
+
+    query = entries.where(filter=backend.FieldFilter("seq", "<", 4)).order_by("seq", direction=backend.DESCENDING).limit(2)
+    assert [doc.to_dict()["seq"] async for doc in query.stream()] == [3, 2]
+
+@pytest.mark.asyncio
+async def test_query_pages_after_cursor_with_document_id_tie_breaker(backend):
+    games = backend.collection("games")
+    for doc_id, created in [("b", 1), ("a", 1), ("c", 1), ("d", 0)]:
+        await games.document(doc_id).set({"created_at": created})
+
+    query = games.order_by("created_at").order_by(backend.DOCUMENT_ID)
+    assert [doc.id async for doc in query.stream()] == ["d", "a", "b", "c"]
+    after = query.start_after({"created_at": 1, backend.DOCUMENT_ID: "a"})
+    assert [doc.id async for doc in after.stream()] == ["b", "c"]
+
+@pytest.mark.asyncio
+async def test_list_documents_includes_parents_of_subcollections(backend):
+    streams = backend.collection("games").document("g1").collection("log_streams")
+    await streams.document("ship_logs").collection("entries").document("e1").set({"seq": 1})
+    await streams.document("drones.d1.night_chat_log").collection("entries").document("e1").set({"seq": 1})
+    await backend.collection("games").document("g1").collection("log_streams_other").document("x").set({})
+
+    assert [ref.id async for ref in streams.list_documents()] == ["drones.d1.night_chat_log", "ship_logs"]
+
+def test_sqlite_documents_survive_reopen(tmp_path):
+    path = str(tmp_path / "store.sqlite3")
+    created = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+    first = SQLiteBackend(path)
+    asyncio.run(first.collection("games").document("g1").set({"created_at": created, "blob": b"\x00\x01"}))
+    first.close()
+
+    second = SQLiteBackend(path)
+    data = asyncio.run(second.collection("games").document("g1").get()).to_dict()
+    second.close()
+    assert data == {"created_at": created, "blob": b"\x00\x01"}
+
+@pytest.mark.asyncio
+async def test_sqlite_runs_connection_work_off_the_event_loop(tmp_path):
+    store = SQLiteBackend(str(tmp_path / "store.sqlite3"))
+    threads = []
+    read = store._read
+    def _read(path):
+        threads.append(threading.get_ident())
+        return read(path)
+    store._read = _read
+
+    await store.collection("games").document("g1").set({"n": 1})
+    assert (await store.collection("games").document("g1").get()).to_dict() == {"n": 1}
+    store.close()
+    assert threads and threading.get_ident() not in threads and len(set(threads)) == 1
+
+# --- PERSISTENCE LAYER ON A LOCAL BACKEND ---
+
+@pytest.mark.asyncio
+async def test_persistence_layer_runs_on_memory_backend():
+    with patch.object(config, "STORAGE_BACKEND", "memory"):
+        layer = PersistenceLayer()
+    assert isinstance(layer.db.inner, MemoryBackend)
+
+    game = GameState(id="g1", story_id="foster-protocol", host_id="u1", status="active",
+                     created_at="2024-01-01T00:00:00Z", metadata={"phase": "night", "day": 1})
+    await layer.create_game_record(game)
+
+    stored = await layer.get_game_by_id("g1", use_cache=False)
+    assert stored.metadata == {"phase": "night", "day": 1}
+    assert (await layer.get_game_header("g1", use_cache=False)).phase == "night"
+
+    diff = diff_metadata(stored.metadata, {"phase": "day", "day": 2})
+    assert await layer.update_game_metadata_diff("g1", diff, expected_version=1) is True
+    # Replaying against the old version is rejected by the transaction
+    assert await layer.update_game_metadata_diff("g1", diff, expected_version=1) is False
+
+    fresh = await layer.get_game_by_id("g1", use_cache=False)
+    assert (fresh.version, fresh.metadata["day"]) == (2, 2)
+    assert (await layer.get_game_header("g1", use_cache=False)).phase == "day"
+
+    assert await layer.adjust_user_balance("u1", 10) == 10
+    assert await layer.deduct_balance_if_sufficient("u1", 4) is True
+    assert not await layer.deduct_balance_if_sufficient("u1", 40)
+    assert await layer.get_user_balance("u1") == 6
@@ -142,3 +142,65 @@ async def test_gather_success(cartridge):
     assert res["result"].success is True
     assert "fuel_canister" in drone.inventory
     assert game_data.shuttle_bay_fuel == expected_remaining
+
+@pytest.mark.asyncio
+async def test_dream_phase_batch_resumes_from_poll(cartridge, mock_ctx):
+    game_data = Caisson(phase="night", cycle=2)
+    game_data.drones["d1"] = Drone(id="d1", daily_memory=["saw a rat"])
+    game_data.drones["d2"] = Drone(id="d2", night_chat_log=["hello"])
+
+    tools = MagicMock()
+    tools.ai.batch_enabled = True
+    tools.ai.submit_batch = AsyncMock(return_value={"jobs": {"m": "jobs/1"}, "keys": ["d1", "d2"], "submitted_at": 0, "poll_seconds": 30})
+    tools.ai.collect_batch = AsyncMock(return_value=None)
+    tools.ai.generate_response = AsyncMock(return_value="INLINE DREAM")
+
+    result = await cartridge.handle_task({"metadata": game_data.model_dump()}, {"operation": "dream_phase", "data": {"cycle": 2}}, mock_ctx, tools)
+    state = result["metadata"]
+    # Nanny chat is closed while the dreams run
+    assert state["pending_batch"]["stage"] == "dream" and state["phase"] == "day"
+    mock_ctx.schedule_task.assert_called_once_with("batch_poll", {"stage": "dream", "cycle": 2}, delay=30)
+
+    # Still running: poll again later
+    mock_ctx.schedule_task.reset_mock()
+    poll = {"operation": "batch_poll", "data": {"stage": "dream", "cycle": 2}}
+    assert await cartridge.handle_task({"metadata": state}, poll, mock_ctx, tools) is None
+    mock_ctx.schedule_task.assert_called_once_with("batch_poll", {"stage": "dream", "cycle": 2}, delay=30)
+
+    # A line that landed after submission is not consolidated, so it survives the dream
+    state["drones"]["d1"]["night_chat_log"] = ["late line"]
+
+    # d2 had no answer: dreamt inline
+    mock_ctx.schedule_task.reset_mock()
+    tools.ai.collect_batch.return_value = {"d1": "BATCH DREAM"}
+    state = (await cartridge.handle_task({"metadata": state}, poll, mock_ctx, tools))["metadata"]
+    assert state["pending_batch"] is None and state["phase"] == "day"
+    assert state["drones"]["d1"]["long_term_memory"] == "BATCH DREAM"
+    assert state["drones"]["d1"]["night_chat_log"] == ["late line"]
+    assert state["drones"]["d2"]["night_chat_log"] == []
+    assert state["drones"]["d2"]["long_term_memory"] == "INLINE DREAM"
+    assert tools.ai.generate_response.await_count == 1
+    mock_ctx.schedule_task.assert_called_once_with("tick_hour", {"target_hour": 1})
+
+@pytest.mark.asyncio
+async def test_dusk_prompt_reads_the_archived_ship_log(cartridge, mock_ctx):
+    from app.state_diff import split_log_streams
+
+    game_data = Caisson()
+    game_data.drones["d1"] = Drone(id="d1", role="saboteur", daily_memory=["saw things"])
+    game_data.ship_logs = [f"ship line {i}" for i in range(200)]
+    stored, archived = split_log_streams({}, game_data.model_dump(), cartridge.LOG_STREAMS)
+    assert ("ship_logs", game_data.ship_logs) in archived
+    assert len(stored["ship_logs"]) == GameConfig.SHIP_LOG_WINDOW
+
+    mock_ctx.read_log_stream = AsyncMock(return_value=game_data.ship_logs)
+    tools = MagicMock()
+    tools.ai.batch_enabled = False
+    tools.ai.generate_response = AsyncMock(return_value="{}")
+
+    with patch("cartridges.foster_protocol.ai_templates._get_base_prompt", return_value="MOCK PROMPT"):
+        await cartridge.handle_task({"metadata": stored}, {"operation": "dusk_phase", "data": {"cycle": 1}}, mock_ctx, tools)
+
+    mock_ctx.read_log_stream.assert_awaited_once_with("ship_logs")
+    user_msg = tools.ai.generate_response.call_args.kwargs["user_input"]
+    assert "ship line 0\n" in user_msg and "ship line 199" in user_msg
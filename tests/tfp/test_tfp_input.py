@@ -66,6 +66,16 @@ async def test_input_blocked_during_day_phase(cartridge, mock_ctx, mock_tools, b
     mock_ctx.reply.assert_called_with("Day cycle in progress\nYou are sleeping now\nPretend to snore or something")
     assert "d1" not in base_state['station']['pending_deactivation'] # Should not have triggered
 
+@pytest.mark.asyncio
+async def test_screen_input_rejects_day_phase_from_header(cartridge, mock_ctx):
+    """The day lock is answered from the header, before the full state is loaded."""
+    assert await cartridge.screen_input({"phase": "day"}, "!destroy", mock_ctx) is True
+    mock_ctx.reply.assert_called_with("Day cycle in progress\nYou are sleeping now\nPretend to snore or something")
+
+    mock_ctx.reply.reset_mock()
+    assert await cartridge.screen_input({"phase": "night"}, "!destroy", mock_ctx) is False
+    mock_ctx.reply.assert_not_called()
+
 @pytest.mark.asyncio
 async def test_destroy_nanny_channel(cartridge, mock_ctx, mock_tools, base_state):
     """User u1 should be able to destroy d1 (their own drone) via nanny channel."""